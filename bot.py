@@ -1,19 +1,29 @@
+import time
+IMPORTS_STARTED = time.perf_counter()  # El reporte de arranque incluye la importación de módulos
 import logging
 import os
 import datetime
 import pytz
 import gspread
 import schedule
-import time
 import threading
+import sys
 import json
-import pandas as pd
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
-import plotly.express as px
+import random
+import pickle
+import hashlib
+from contextlib import contextmanager
+import re
+import uuid
+import sqlite3
+import requests
+import importlib
+import multiprocessing
 from io import BytesIO
 import numpy as np
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from gspread.utils import rowcol_to_a1, numericise
 from oauth2client.service_account import ServiceAccountCredentials
 from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackContext, ConversationHandler, CallbackQueryHandler
@@ -22,78 +32,328 @@ from config_temp import *
 
 # Variables de entorno cargadas desde config_temp
 
-# Configuración de logging mejorado
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', 
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler('bot.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
-# Configuración de Google Sheets
-try:
-    # Intentar usar variable de entorno primero (Railway/Heroku)
-    google_creds_json = os.getenv('GOOGLE_CREDENTIALS_JSON')
-    if google_creds_json:
-        # Usar credenciales desde variable de entorno
-        import json
-        from oauth2client.service_account import ServiceAccountCredentials
-        creds_dict = json.loads(google_creds_json)
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, GOOGLE_SHEETS_SCOPE)
-    else:
-        # Fallback a archivo local
-        creds = ServiceAccountCredentials.from_json_keyfile_name("credentials.json", GOOGLE_SHEETS_SCOPE)
+def configure_logging():
+    """Configuración de logging mejorado (al ejecutar el bot, no al importar el módulo)"""
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', 
+        level=logging.INFO,
+        handlers=[
+            logging.FileHandler('bot.log', encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+
+class StartupTimer:
+    """Mide la duración de cada fase del arranque para el reporte de inicio"""
     
-    client = gspread.authorize(creds)
-    spreadsheet = client.open(GOOGLE_SHEETS_NAME)
+    def __init__(self, started=None):
+        self.started = started or time.perf_counter()
+        self.phases = []
     
-    # Hoja principal para transacciones
-    sheet = spreadsheet.sheet1
+    @contextmanager
+    def phase(self, name):
+        """Registra el tiempo que toma el bloque con el nombre indicado"""
+        phase_started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - phase_started))
+    
+    def report(self):
+        """Escribe en el log el detalle de fases y el tiempo total de arranque"""
+        logger.info("⏱️ Reporte de arranque:")
+        for name, elapsed in self.phases:
+            logger.info(f"   • {name}: {elapsed * 1000:.0f} ms")
+        logger.info(f"   Total: {(time.perf_counter() - self.started) * 1000:.0f} ms")
+        deferred = [module.name for module in LazyModule.registry if not module.loaded]
+        if deferred:
+            logger.info(f"   Sin importar (bajo demanda): {', '.join(deferred)}")
+        try:
+            import resource
+            logger.info(f"   Memoria máxima: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+        except ImportError:
+            pass
+
+startup_timer = StartupTimer(started=IMPORTS_STARTED)
+startup_timer.phases.append(("Importación de módulos", time.perf_counter() - IMPORTS_STARTED))
+
+class LazyModule:
+    """Módulo pesado que se importa recién en su primer uso.
+    
+    pandas y matplotlib solo se usan en el motor pandas y en los gráficos; importarlos
+    al cargar bot.py sumaba cerca de un segundo y decenas de MB a cada arranque.
+    El primer acceso a un atributo importa el módulo y deja el tiempo en el log.
+    """
+    
+    registry = []
+    
+    def __init__(self, name, setup=None):
+        self.name = name
+        self._setup = setup
+        self._module = None
+        self._lock = threading.Lock()
+        LazyModule.registry.append(self)
+    
+    @property
+    def loaded(self):
+        return self._module is not None
+    
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    started = time.perf_counter()
+                    module = importlib.import_module(self.name)
+                    if self._setup:
+                        self._setup(module)
+                    self._module = module
+                    logger.info(f"📦 {self.name} importado bajo demanda en {(time.perf_counter() - started) * 1000:.0f} ms")
+        return self._module
+    
+    def __getattr__(self, attribute):
+        return getattr(self.load(), attribute)
+
+def use_agg_backend(_):
+    """Sin pantalla: los gráficos se dibujan directo a PNG"""
+    importlib.import_module('matplotlib').use('Agg')
+
+# Dependencias pesadas, cargadas solo por las rutas que las usan
+pd = LazyModule('pandas')                                          # PandasAnalytics
+mpl_figure = LazyModule('matplotlib.figure', setup=use_agg_backend)  # render_chart
+
+# Cuota de la API de Google Sheets (llamadas por minuto) y reintentos ante 429/5xx
+SHEETS_READS_PER_MINUTE = int(os.getenv("SHEETS_READS_PER_MINUTE", "60"))
+SHEETS_WRITES_PER_MINUTE = int(os.getenv("SHEETS_WRITES_PER_MINUTE", "60"))
+SHEETS_MAX_RETRIES = int(os.getenv("SHEETS_MAX_RETRIES", "5"))
+
+class TokenBucket:
+    """Limitador de tasa: como máximo `rate` llamadas por minuto, con ráfagas hasta `rate`"""
+    
+    def __init__(self, rate):
+        self.capacity = max(rate, 1)
+        self.tokens = float(self.capacity)
+        self.refill_per_second = self.capacity / 60.0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Espera hasta que haya una ficha disponible; devuelve los segundos esperados"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_second)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.refill_per_second
+            time.sleep(wait)
+            waited += wait
+
+class SheetsApiLimiter:
+    """Aplica la cuota de lectura/escritura, reintenta errores transitorios y mide cada método"""
+    
+    READ_METHODS = {'open', 'worksheet', 'worksheets', 'sheet1', 'row_values', 'col_values', 'get',
+                    'get_all_values', 'get_all_records', 'batch_get', 'values_batch_get',
+                    'list_named_ranges', 'fetch_sheet_metadata', 'acell', 'cell'}
+    WRITE_METHODS = {'add_worksheet', 'del_worksheet', 'append_row', 'append_rows', 'update',
+                     'update_cell', 'update_cells', 'batch_update', 'values_batch_update', 'clear',
+                     'delete_rows', 'insert_row', 'insert_rows', 'add_rows', 'add_cols', 'resize',
+                     'define_named_range', 'delete_named_range', 'values_append'}
+    # Si fallan con 5xx pueden haberse aplicado igual: solo se reintentan ante 429
+    # (repetir un delete_rows que sí llegó borraría las filas siguientes)
+    NON_IDEMPOTENT = {'append_row', 'append_rows', 'values_append', 'insert_row', 'insert_rows',
+                      'add_worksheet', 'add_rows', 'add_cols', 'define_named_range',
+                      'delete_rows', 'del_worksheet'}
+    # Métodos que devuelven hojas u hojas de cálculo que también deben pasar por el limitador
+    WRAPPED_RESULTS = {'open', 'worksheet', 'add_worksheet', 'worksheets', 'sheet1'}
+    
+    def __init__(self, reads_per_minute=SHEETS_READS_PER_MINUTE, writes_per_minute=SHEETS_WRITES_PER_MINUTE,
+                 max_retries=SHEETS_MAX_RETRIES):
+        self.buckets = {'read': TokenBucket(reads_per_minute), 'write': TokenBucket(writes_per_minute)}
+        self.max_retries = max_retries
+        self.metrics = defaultdict(lambda: {'calls': 0, 'errors': 0, 'retries': 0, 'throttled': 0.0,
+                                            'total_ms': 0.0, 'max_ms': 0.0})
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _status(error):
+        """Código HTTP de un error de gspread (None si no es un error de la API)"""
+        response = getattr(error, 'response', None)
+        return getattr(response, 'status_code', None)
+    
+    def _should_retry(self, method, error):
+        status = self._status(error)
+        if status == 429:
+            return True
+        if method in self.NON_IDEMPOTENT:
+            return False
+        return (status is not None and status >= 500) or isinstance(
+            error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+    
+    def call(self, method, func, *args, **kwargs):
+        """Ejecuta una llamada a la API respetando la cuota y con reintentos exponenciales"""
+        kind = 'write' if method in self.WRITE_METHODS else 'read'
+        attempt = 0
+        while True:
+            throttled = self.buckets[kind].acquire()
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                self._record(method, started, throttled, error=True)
+                if attempt >= self.max_retries or not self._should_retry(method, e):
+                    raise
+                attempt += 1
+                delay = random.uniform(0, min(2 ** attempt, 64))
+                with self._lock:
+                    self.metrics[method]['retries'] += 1
+                logger.warning(f"⏳ Google Sheets {method} falló ({self._status(e) or e}); reintento {attempt} en {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            self._record(method, started, throttled)
+            return result
+    
+    def _record(self, method, started, throttled, error=False):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            stats = self.metrics[method]
+            stats['calls'] += 1
+            stats['errors'] += int(error)
+            stats['throttled'] += throttled
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+    
+    def report(self):
+        """Escribe en el log las llamadas y latencias por método"""
+        with self._lock:
+            snapshot = {method: dict(stats) for method, stats in self.metrics.items()}
+        if not snapshot:
+            return
+        logger.info("📡 Uso de la API de Google Sheets:")
+        for method, stats in sorted(snapshot.items(), key=lambda item: -item[1]['calls']):
+            logger.info(f"   • {method}: {stats['calls']} llamadas, {stats['errors']} errores, "
+                        f"{stats['retries']} reintentos, media {stats['total_ms'] / stats['calls']:.0f} ms, "
+                        f"máx {stats['max_ms']:.0f} ms, espera por cuota {stats['throttled']:.1f}s")
+
+class QuotaAwareProxy:
+    """Envoltorio de un objeto de gspread que pasa sus llamadas por el limitador"""
+    
+    def __init__(self, target, limiter):
+        self._target = target
+        self._limiter = limiter
+    
+    def _wrap(self, value):
+        if isinstance(value, list):
+            return [QuotaAwareProxy(item, self._limiter) for item in value]
+        return QuotaAwareProxy(value, self._limiter)
+    
+    def __getattr__(self, name):
+        known = name in SheetsApiLimiter.READ_METHODS or name in SheetsApiLimiter.WRITE_METHODS
+        if not known:
+            return getattr(self._target, name)
+        
+        # sheet1 es una propiedad que consulta la API
+        if name == 'sheet1':
+            return self._wrap(self._limiter.call(name, getattr, self._target, name))
+        
+        method = getattr(self._target, name)
+        def call(*args, **kwargs):
+            result = self._limiter.call(name, method, *args, **kwargs)
+            return self._wrap(result) if name in SheetsApiLimiter.WRAPPED_RESULTS else result
+        return call
+    
+    def __repr__(self):
+        return f"QuotaAwareProxy({self._target!r})"
+
+# Limitador compartido por todas las llamadas a Google Sheets
+sheets_api = SheetsApiLimiter()
+
+def connect_google_sheets():
+    """Conecta con Google Sheets y prepara las hojas del sistema"""
+    global spreadsheet, sheet, sheet_goals, sheet_budgets, sheet_users
+    global sheet_categories, sheet_paydays, sheet_family_groups
+    global sheet_archive, sheet_monthly_summary
     
-    # Crear o acceder a hojas adicionales
     try:
-        sheet_goals = spreadsheet.worksheet("Metas_Ahorro")
-    except gspread.WorksheetNotFound:
-        sheet_goals = spreadsheet.add_worksheet("Metas_Ahorro", 1000, 10)
+        # Intentar usar variable de entorno primero (Railway/Heroku)
+        google_creds_json = os.getenv('GOOGLE_CREDENTIALS_JSON')
+        if google_creds_json:
+            # Usar credenciales desde variable de entorno
+            creds_dict = json.loads(google_creds_json)
+            creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, GOOGLE_SHEETS_SCOPE)
+        else:
+            # Fallback a archivo local
+            creds = ServiceAccountCredentials.from_json_keyfile_name("credentials.json", GOOGLE_SHEETS_SCOPE)
+    
+        client = QuotaAwareProxy(gspread.authorize(creds), sheets_api)
+        spreadsheet = client.open(GOOGLE_SHEETS_NAME)
+    
+        # Hoja principal para transacciones
+        sheet = spreadsheet.sheet1
+    
+        # Crear o acceder a hojas adicionales
+        try:
+            sheet_goals = spreadsheet.worksheet("Metas_Ahorro")
+        except gspread.WorksheetNotFound:
+            sheet_goals = spreadsheet.add_worksheet("Metas_Ahorro", 1000, 10)
         
-    try:
-        sheet_budgets = spreadsheet.worksheet("Presupuestos")
-    except gspread.WorksheetNotFound:
-        sheet_budgets = spreadsheet.add_worksheet("Presupuestos", 1000, 6)
+        try:
+            sheet_budgets = spreadsheet.worksheet("Presupuestos")
+        except gspread.WorksheetNotFound:
+            sheet_budgets = spreadsheet.add_worksheet("Presupuestos", 1000, 6)
         
-    try:
-        sheet_users = spreadsheet.worksheet("Usuarios")
-    except gspread.WorksheetNotFound:
-        sheet_users = spreadsheet.add_worksheet("Usuarios", 1000, 8)
+        try:
+            sheet_users = spreadsheet.worksheet("Usuarios")
+        except gspread.WorksheetNotFound:
+            sheet_users = spreadsheet.add_worksheet("Usuarios", 1000, 8)
         
-    try:
-        sheet_categories = spreadsheet.worksheet("Categorias_Personalizadas")
-    except gspread.WorksheetNotFound:
-        sheet_categories = spreadsheet.add_worksheet("Categorias_Personalizadas", 1000, 4)
+        try:
+            sheet_categories = spreadsheet.worksheet("Categorias_Personalizadas")
+        except gspread.WorksheetNotFound:
+            sheet_categories = spreadsheet.add_worksheet("Categorias_Personalizadas", 1000, 4)
         
-    try:
-        sheet_paydays = spreadsheet.worksheet("Fechas_Pago")
-    except gspread.WorksheetNotFound:
-        sheet_paydays = spreadsheet.add_worksheet("Fechas_Pago", 1000, 6)
+        try:
+            sheet_paydays = spreadsheet.worksheet("Fechas_Pago")
+        except gspread.WorksheetNotFound:
+            sheet_paydays = spreadsheet.add_worksheet("Fechas_Pago", 1000, 6)
         
-    try:
-        sheet_family_groups = spreadsheet.worksheet("Grupos_Familiares")
-    except gspread.WorksheetNotFound:
-        sheet_family_groups = spreadsheet.add_worksheet("Grupos_Familiares", 1000, 8)
-    
-    logger.info("Conexion exitosa con Google Sheets - Sistema multihojas configurado")
-except Exception as e:
-    logger.error(f"Error al conectar con Google Sheets: {e}")
-    sheet = None
-    sheet_goals = None
-    sheet_budgets = None
-    sheet_users = None
-    sheet_categories = None
-    sheet_paydays = None
-    sheet_family_groups = None
+        try:
+            sheet_family_groups = spreadsheet.worksheet("Grupos_Familiares")
+        except gspread.WorksheetNotFound:
+            sheet_family_groups = spreadsheet.add_worksheet("Grupos_Familiares", 1000, 8)
+        
+        try:
+            sheet_archive = spreadsheet.worksheet("Archivo_Transacciones")
+        except gspread.WorksheetNotFound:
+            sheet_archive = spreadsheet.add_worksheet("Archivo_Transacciones", 1000, len(SHEET_HEADERS))
+        
+        try:
+            sheet_monthly_summary = spreadsheet.worksheet("Resumen_Mensual")
+        except gspread.WorksheetNotFound:
+            sheet_monthly_summary = spreadsheet.add_worksheet("Resumen_Mensual", 1000, 7)
+    
+        logger.info("Conexion exitosa con Google Sheets - Sistema multihojas configurado")
+    except Exception as e:
+        logger.error(f"Error al conectar con Google Sheets: {e}")
+        spreadsheet = None
+        sheet = None
+        sheet_goals = None
+        sheet_budgets = None
+        sheet_users = None
+        sheet_categories = None
+        sheet_paydays = None
+        sheet_family_groups = None
+        sheet_archive = None
+        sheet_monthly_summary = None
+
+# Hojas de Google Sheets (se conectan en build_app_context, no al importar el módulo)
+spreadsheet = sheet = sheet_goals = sheet_budgets = sheet_users = None
+sheet_categories = sheet_paydays = sheet_family_groups = None
+sheet_archive = sheet_monthly_summary = None
 
 # Token del bot ya está definido en config_temp
 if not BOT_TOKEN:
@@ -103,6 +363,45 @@ if not BOT_TOKEN:
 # Zona horaria
 TIMEZONE = pytz.timezone(os.getenv("TIMEZONE", "America/Santiago"))
 
+# IDs de Telegram con acceso a comandos de mantenimiento (/resync), separados por comas
+ADMIN_USER_IDS = {int(value) for value in os.getenv("ADMIN_USER_IDS", "").split(",") if value.strip()}
+
+# Escritura diferida de transacciones (segundos entre envíos / filas por envío)
+SHEETS_FLUSH_INTERVAL = float(os.getenv("SHEETS_FLUSH_INTERVAL", "5"))
+SHEETS_BATCH_SIZE = int(os.getenv("SHEETS_BATCH_SIZE", "50"))
+# Registro local (WAL) de transacciones aún no enviadas
+TRANSACTIONS_WAL_PATH = os.getenv("TRANSACTIONS_WAL_PATH", "transactions.wal")
+# Archivo de pendientes de versiones anteriores (se migra al WAL al iniciar)
+LEGACY_SPOOL_PATH = os.getenv("SHEETS_SPOOL_PATH", "pending_transactions.json")
+# Segundos tras los cuales una lectura trae las filas nuevas de la hoja (0 para desactivar)
+TRANSACTIONS_SYNC_INTERVAL = float(os.getenv("TRANSACTIONS_SYNC_INTERVAL", "60"))
+# Período de las hojas de transacciones: "month" (Transacciones_2026_10) o "year" (Transacciones_2026)
+TRANSACTIONS_PARTITION = os.getenv("TRANSACTIONS_PARTITION", "month").lower()
+# Meses hacia atrás en los que los recordatorios buscan deudas pendientes
+PENDING_DEBT_MONTHS = int(os.getenv("PENDING_DEBT_MONTHS", "12"))
+
+# Backend de persistencia: "sheets" (Google Sheets) o "sqlite" (disco local)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sheets").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "finbot.db")
+# Hora diaria de exportación de SQLite a Google Sheets (vacío para desactivar)
+SHEETS_EXPORT_TIME = os.getenv("SHEETS_EXPORT_TIME", "03:00")
+
+# Archivo de transacciones: meses que se mantienen en las hojas activas (0 para desactivar)
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", "12"))
+ARCHIVE_TIME = os.getenv("ARCHIVE_TIME", "04:00")
+
+# Motor de los análisis: "rollup" (totales incrementales) o "pandas" (DataFrame en memoria)
+ANALYTICS_ENGINE = os.getenv("ANALYTICS_ENGINE", "rollup").lower()
+
+# Gráficos: procesos que los dibujan (0 para no enviar gráficos) y PNG guardados en caché
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "2"))
+CHART_CACHE_SIZE = int(os.getenv("CHART_CACHE_SIZE", "256"))
+
+# Instantánea local del manager para arranque en caliente (vacío para desactivar)
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "finbot_snapshot.pkl")
+SNAPSHOT_INTERVAL = int(os.getenv("SNAPSHOT_INTERVAL", "10"))  # minutos
+SNAPSHOT_HEADER = b"FINBOT-SNAPSHOT v1\n"
+
 # Estados de la conversación ampliados
 (CHOOSING, TYPING_AMOUNT, TYPING_CATEGORY, TYPING_DESCRIPTION, 
  TYPING_DUE_DATE, SELECTING_USER, SETTING_PAYDAY, CONFIRMING_SALARY,
@@ -124,132 +423,905 @@ def get_reply_method(update_or_query):
         # Es un query de callback
         return update_or_query.edit_message_text
 
-class AdvancedFinanceBotManager:
-    def __init__(self):
-        self.users = {}
-        self.paydays = {}  # {user_id: day_of_month}
-        self.payday_dates = {}  # {user_id: {'day': X, 'month': Y, 'next_payday': date}}
-        self.budgets = {}  # {user_id: {category: amount}}
-        self.goals = {}    # {user_id: [{name, amount, target_date, saved}]}
-        self.notifications = {}  # {user_id: [notification_settings]}
-        self.custom_categories = {}  # {user_id: {type: [categories]}}
-        self.family_groups = {}  # {group_id: {name, code, creator, members, settings}}
-        self.user_groups = {}  # {user_id: group_id}
-        
-        # Cargar datos desde Google Sheets al inicializar
-        self.load_all_data()
+# Encabezados de cada tabla (hoja de Google Sheets o tabla SQLite)
+SHEET_SCHEMAS = {
+    'Transacciones': SHEET_HEADERS,
+    'Metas_Ahorro': ['Usuario_ID', 'Usuario_Nombre', 'Meta_Nombre', 'Monto_Meta', 'Monto_Ahorrado', 'Fecha_Limite', 'Fecha_Creacion', 'Estado'],
+    'Presupuestos': ['Usuario_ID', 'Usuario_Nombre', 'Categoria', 'Presupuesto', 'Fecha_Creacion', 'Estado'],
+    'Usuarios': ['Usuario_ID', 'Usuario_Nombre', 'Fecha_Registro', 'Ultima_Actividad', 'Dia_Pago', 'Fecha_Pago_Completa', 'Ingreso_Mensual', 'Configuraciones'],
+    'Categorias_Personalizadas': ['Usuario_ID', 'Tipo_Registro', 'Categoria_Personalizada', 'Fecha_Creacion'],
+    'Fechas_Pago': ['Usuario_ID', 'Usuario_Nombre', 'Dia_Pago', 'Mes_Pago', 'Proxima_Fecha', 'Ultima_Actualizacion'],
+    'Grupos_Familiares': ['Grupo_ID', 'Nombre_Grupo', 'Codigo_Invitacion', 'Creador_ID', 'Miembros', 'Fecha_Creacion', 'Estado', 'Configuraciones'],
+    'Archivo_Transacciones': SHEET_HEADERS,
+    'Resumen_Mensual': ['Usuario', 'Mes', 'Tipo', 'Categoria', 'Total', 'Cantidad', 'Usuario_ID']
+}
+
+# Tablas que no se leen al iniciar (se consultan bajo demanda)
+LAZY_TABLES = {'Transacciones', 'Archivo_Transacciones'}
+
+# Versión del esquema; cambiarla obliga a verificar de nuevo los encabezados
+SCHEMA_VERSION = 4
+
+# Columna con el identificador único de cada transacción (reenvíos idempotentes)
+RECORD_ID_COLUMN = SHEET_HEADERS.index('Registro_ID')
+
+# Columna con el ID de Telegram del autor (no cambia aunque cambie su nombre)
+USER_ID_COLUMN = SHEET_HEADERS.index('Usuario_ID')
+
+def new_record_id():
+    """Identificador único para una transacción nueva"""
+    return uuid.uuid4().hex[:16]
+
+# Prefijo de las hojas de transacciones particionadas por período
+PARTITION_PREFIX = 'Transacciones_'
+PARTITION_KEY_PATTERN = re.compile(r"^\d{4}$" if TRANSACTIONS_PARTITION == 'year' else r"^\d{4}_\d{2}$")
+
+def period_key(date):
+    """Clave del período (año o mes) de una fecha o de un texto 'YYYY-MM-DD ...'"""
+    text = date.strftime("%Y-%m-%d") if hasattr(date, 'strftime') else str(date)
+    if not re.match(r"^\d{4}-\d{2}", text):
+        return None
+    return text[:4] if TRANSACTIONS_PARTITION == 'year' else f"{text[:4]}_{text[5:7]}"
+
+def transaction_partition(fecha):
+    """Hoja de la partición de una transacción según su fecha ('Transacciones' si no es válida)"""
+    key = period_key(fecha)
+    return f"{PARTITION_PREFIX}{key}" if key else 'Transacciones'
+
+def is_partition(table):
+    return table.startswith(PARTITION_PREFIX)
+
+def table_schema(table):
+    """Encabezados de una tabla (las particiones usan los de Transacciones)"""
+    return SHEET_HEADERS if is_partition(table) else SHEET_SCHEMAS[table]
+
+def is_archivable(fecha, cutoff_month):
+    """Indica si una fecha 'YYYY-MM-DD ...' es de un mes anterior a cutoff_month ('YYYY-MM')"""
+    text = str(fecha or '')
+    return bool(re.match(r"^\d{4}-\d{2}", text)) and text[:7] < cutoff_month
+
+def archive_key(record):
+    """Identidad de una transacción archivada: su Registro_ID o, en filas antiguas sin ID, la fila completa"""
+    record_id = str(record.get('Registro_ID', '')).strip()
+    return record_id or tuple(str(record.get(col, '')) for col in SHEET_HEADERS)
+
+def in_period_range(fecha, start=None, end=None):
+    """Indica si la fecha cae en los períodos entre start y end (ambos opcionales)"""
+    key = period_key(fecha)
+    if key is None:
+        return True
+    return (start is None or key >= period_key(start)) and (end is None or key <= period_key(end))
+
+# Columnas que identifican una fila en las tablas que se actualizan (upsert)
+TABLE_KEYS = {
+    'Presupuestos': ['Usuario_ID', 'Categoria'],
+    'Usuarios': ['Usuario_ID'],
+    'Fechas_Pago': ['Usuario_ID'],
+    'Grupos_Familiares': ['Grupo_ID'],
+    # El nombre solo distingue las filas antiguas sin Usuario_ID
+    'Resumen_Mensual': ['Usuario_ID', 'Usuario', 'Mes', 'Tipo', 'Categoria']
+}
+
+# Columnas numéricas (se devuelven como número, igual que get_all_records)
+NUMERIC_COLUMNS = {'Monto', 'Monto_Meta', 'Monto_Ahorrado', 'Presupuesto', 'Ingreso_Mensual', 'Dia_Pago', 'Mes_Pago',
+                   'Total', 'Cantidad'}
+
+# Índices secundarios de la base SQLite
+SQLITE_INDEXES = {
+    'Transacciones': [['Usuario_ID', 'Fecha'], ['Usuario', 'Fecha'], ['Tipo', 'Estado_Pago']],
+    'Metas_Ahorro': [['Usuario_ID']],
+    'Categorias_Personalizadas': [['Usuario_ID']],
+    'Archivo_Transacciones': [['Usuario_ID', 'Fecha'], ['Usuario', 'Fecha']],
+    'Resumen_Mensual': [['Usuario_ID', 'Mes'], ['Usuario', 'Mes']]
+}
+
+def table_key(table, record):
+    """Clave de una fila (dict de registro) según TABLE_KEYS"""
+    return tuple(str(record.get(col, '')) for col in TABLE_KEYS[table])
+
+class WorksheetRowIndex:
+    """Mapa clave -> número de fila de una hoja para actualizar sin buscar"""
+    
+    def __init__(self, key_func):
+        self.key_func = key_func
+        self.rows = {}
+        self.next_row = 2
+        self.ready = False
+        self.lock = threading.RLock()
+    
+    def build(self, records):
+        """Construye el índice a partir de get_all_records (fila 2 en adelante)"""
+        rows = {}
+        for i, record in enumerate(records, 2):
+            key = self.key_func(record)
+            if key is not None and key not in rows:
+                rows[key] = i
+        with self.lock:
+            self.rows = rows
+            self.next_row = len(records) + 2
+            self.ready = True
+    
+    def reset(self):
+        """Vacía el índice tras limpiar la hoja (solo quedan encabezados)"""
+        self.build([])
+    
+    def lookup(self, key):
+        """Número de fila de una clave, o None si no existe"""
+        return self.rows.get(key)
+    
+    def register(self, key, response):
+        """Anota la fila recién agregada a partir de la respuesta de append_row"""
+        row = self._appended_row(response) or self.next_row
+        self.rows[key] = row
+        self.next_row = max(self.next_row, row + 1)
+        return row
     
-    def _ensure_sheet_has_headers(self, sheet, expected_headers):
-        """Verifica que una hoja tenga los encabezados correctos"""
+    @staticmethod
+    def _appended_row(response):
+        """Extrae el número de fila del rango devuelto por append_row"""
         try:
-            if not sheet:
-                return False
-            headers = sheet.row_values(1)
-            return headers == expected_headers
-        except Exception as e:
-            logger.error(f"Error verificando encabezados: {e}")
-            return False
+            updated_range = response['updates']['updatedRange']
+            match = re.search(r'![A-Z]+(\d+)', updated_range)
+            return int(match.group(1)) if match else None
+        except (KeyError, TypeError):
+            return None
+
+# Tipos de las columnas que se convierten al leer cada tabla (las demás quedan como texto):
+# 'id' entero positivo obligatorio, 'int'/'float' números (vacío = 0), 'ref' entero o 0,
+# 'date'/'datetime' fechas o None. Un 'id', 'int' o 'float' inválido rechaza la fila.
+ROW_TYPES = {
+    'Usuarios': {'Usuario_ID': 'id', 'Fecha_Registro': 'date', 'Ultima_Actividad': 'datetime', 'Ingreso_Mensual': 'float'},
+    'Metas_Ahorro': {'Usuario_ID': 'id', 'Monto_Meta': 'float', 'Monto_Ahorrado': 'float'},
+    'Presupuestos': {'Usuario_ID': 'id', 'Presupuesto': 'float'},
+    'Categorias_Personalizadas': {'Usuario_ID': 'id'},
+    'Fechas_Pago': {'Usuario_ID': 'id', 'Dia_Pago': 'int', 'Mes_Pago': 'int', 'Proxima_Fecha': 'date'},
+    'Grupos_Familiares': {'Creador_ID': 'ref', 'Fecha_Creacion': 'datetime'},
+    'Resumen_Mensual': {'Total': 'float', 'Cantidad': 'int', 'Usuario_ID': 'ref'},
+}
+
+DATE_FORMATS = {'date': "%Y-%m-%d", 'datetime': "%Y-%m-%d %H:%M"}
+
+class TypedRecord:
+    """Base de las filas ya convertidas: un atributo por columna (ver RowDecoder)"""
+    
+    __slots__ = ()
+    
+    def __repr__(self):
+        values = ', '.join(f"{field}={getattr(self, field)!r}" for field in self.__slots__)
+        return f"{type(self).__name__}({values})"
+
+class RowDecoder:
+    """Convierte las filas de una tabla a registros tipados una sola vez, al leerlas.
+    
+    Se compila por tabla y orden de encabezados: para cada columna del esquema queda
+    la posición de donde leerla y su conversión. Las filas que no se pueden convertir
+    se descartan y se cuentan por tabla (ver report).
+    """
+    
+    _compiled = {}
+    _lock = threading.Lock()
+    rejected = Counter()  # {tabla: filas descartadas desde el arranque}
+    
+    def __init__(self, table, headers):
+        self.table = table
+        fields = table_schema(table)
+        types = ROW_TYPES.get(table, {})
+        positions = {header: i for i, header in enumerate(headers)}
+        self.plan = [(positions.get(field), types.get(field, 'text')) for field in fields]
+        self.record_class = type(f"{table}Record", (TypedRecord,), {'__slots__': tuple(fields)})
+    
+    @classmethod
+    def for_table(cls, table, headers=None):
+        """Decodificador de la tabla para ese orden de encabezados (el del esquema si no se indica)"""
+        headers = tuple(headers if headers is not None else table_schema(table))
+        with cls._lock:
+            decoder = cls._compiled.get((table, headers))
+            if decoder is None:
+                decoder = cls._compiled[(table, headers)] = cls(table, headers)
+        return decoder
     
-    def _ensure_all_sheet_headers(self):
-        """Asegura que todas las hojas tengan los encabezados correctos"""
-        success = True
-        
-        # Hoja principal de transacciones
-        if sheet:
+    @staticmethod
+    def _convert(value, kind):
+        if kind == 'text':
+            return '' if value is None else str(value)
+        if kind in DATE_FORMATS:
             try:
-                headers = sheet.row_values(1)
-                expected_headers = ['Fecha', 'Usuario', 'Tipo', 'Monto', 'Categoria', 'Descripcion', 'Fecha_Vencimiento', 'Estado_Pago']
-                if not headers or headers != expected_headers:
-                    sheet.clear()
-                    sheet.append_row(expected_headers)
-                    logger.info("📋 Encabezados de la hoja principal actualizados")
-            except Exception as e:
-                logger.error(f"❌ Error al configurar encabezados principales: {e}")
-                success = False
-        
-        # Hoja de metas de ahorro
-        if sheet_goals:
+                return datetime.datetime.strptime(str(value), DATE_FORMATS[kind])
+            except ValueError:
+                return None
+        if value is None or str(value).strip() == '':
+            if kind == 'id':
+                raise ValueError("vacío")
+            return 0.0 if kind == 'float' else 0
+        if kind == 'float':
+            return float(value)
+        try:
+            number = int(value)
+        except (ValueError, TypeError):
+            number = int(float(value))
+        if kind == 'id' and number <= 0:
+            raise ValueError(f"{number} no es un ID válido")
+        return number
+    
+    def decode_row(self, row):
+        """Convierte una fila (lista en el orden de encabezados); ValueError si no es válida"""
+        record = self.record_class.__new__(self.record_class)
+        for field, (position, kind) in zip(self.record_class.__slots__, self.plan):
+            value = row[position] if position is not None and position < len(row) else ''
             try:
-                headers = sheet_goals.row_values(1)
-                goals_headers = ['Usuario_ID', 'Usuario_Nombre', 'Meta_Nombre', 'Monto_Meta', 'Monto_Ahorrado', 'Fecha_Limite', 'Fecha_Creacion', 'Estado']
-                if not headers or headers != goals_headers:
-                    sheet_goals.clear()
-                    sheet_goals.append_row(goals_headers)
-                    logger.info("📋 Encabezados de Metas de Ahorro configurados")
-            except Exception as e:
-                logger.error(f"❌ Error en encabezados de metas: {e}")
-                success = False
-        
-        # Hoja de presupuestos
-        if sheet_budgets:
+                converted = self._convert(value, kind)
+            except (ValueError, TypeError, OverflowError):
+                if kind == 'ref':
+                    converted = 0
+                else:
+                    raise ValueError(f"{field}={value!r}")
+            setattr(record, field, converted)
+        return record
+    
+    def decode(self, rows):
+        """Convierte las filas válidas y cuenta las descartadas"""
+        records = []
+        rejected = []
+        for row in rows:
             try:
-                headers = sheet_budgets.row_values(1)
-                budget_headers = ['Usuario_ID', 'Usuario_Nombre', 'Categoria', 'Presupuesto', 'Fecha_Creacion', 'Estado']
-                if not headers or headers != budget_headers:
-                    sheet_budgets.clear()
-                    sheet_budgets.append_row(budget_headers)
-                    logger.info("📋 Encabezados de Presupuestos configurados")
-            except Exception as e:
-                logger.error(f"❌ Error en encabezados de presupuestos: {e}")
-                success = False
+                records.append(self.decode_row(row))
+            except ValueError as e:
+                rejected.append(str(e))
+        if rejected:
+            self.note_rejected(self.table, len(rejected), rejected[0])
+        return records
+    
+    @classmethod
+    def decode_records(cls, table, records):
+        """Convierte registros encabezado -> valor (get_records) con el orden de sus claves"""
+        if not records:
+            return []
+        headers = tuple(records[0])
+        return cls.for_table(table, headers).decode(
+            [[record.get(header, '') for header in headers] for record in records]
+        )
+    
+    @classmethod
+    def note_rejected(cls, table, count, example=''):
+        with cls._lock:
+            cls.rejected[table] += count
+        logger.warning(f"⚠️ {table}: {count} filas inválidas descartadas (p. ej. {example})")
+    
+    @classmethod
+    def report(cls):
+        """Escribe en el log las filas descartadas por tabla"""
+        with cls._lock:
+            rejected = dict(cls.rejected)
+        if rejected:
+            logger.info("🧾 Filas descartadas al leer: " + ', '.join(f"{table} {count}" for table, count in sorted(rejected.items())))
+
+class StorageBackend:
+    """Interfaz común de persistencia (transacciones, usuarios, metas, presupuestos...)"""
+    
+    name = 'base'
+    
+    def has_table(self, table):
+        """Indica si la tabla está disponible para leer y escribir"""
+        raise NotImplementedError
+    
+    def check_schema(self, table):
+        """Verifica que la tabla tenga los encabezados esperados"""
+        raise NotImplementedError
+    
+    def ensure_schema(self, table):
+        """Crea o corrige los encabezados de la tabla"""
+        raise NotImplementedError
+    
+    def migrate_schema(self, table, headers):
+        """Agrega las columnas nuevas al final sin borrar datos; False si no es posible"""
+        return False
+    
+    def transaction_table_for(self, fecha):
+        """Tabla donde se guarda una transacción con esa fecha"""
+        return 'Transacciones'
+    
+    def transaction_tables(self, start=None, end=None):
+        """Tablas de transacciones que pueden contener fechas entre start y end"""
+        return ['Transacciones'] if self.has_table('Transacciones') else []
+    
+    def archive_transactions(self, table, cutoff_month, on_archived):
+        """Mueve a Archivo_Transacciones las filas de meses anteriores a cutoff_month ('YYYY-MM').
         
-        # Hoja de usuarios
-        if sheet_users:
-            try:
-                headers = sheet_users.row_values(1)
-                user_headers = ['Usuario_ID', 'Usuario_Nombre', 'Fecha_Registro', 'Ultima_Actividad', 'Dia_Pago', 'Fecha_Pago_Completa', 'Ingreso_Mensual', 'Configuraciones']
-                if not headers or headers != user_headers:
-                    sheet_users.clear()
-                    sheet_users.append_row(user_headers)
-                    logger.info("📋 Encabezados de Usuarios configurados")
-            except Exception as e:
-                logger.error(f"❌ Error en encabezados de usuarios: {e}")
-                success = False
+        Copia al archivo, borra de la tabla y recién entonces llama a on_archived con las
+        filas ya borradas. Si algo falla a mitad de camino, el siguiente intento no vuelve
+        a copiar lo que ya está en el archivo ni suma dos veces al resumen.
+        """
+        raise NotImplementedError
+    
+    def get_records(self, table):
+        """Devuelve todas las filas como diccionarios encabezado -> valor"""
+        raise NotImplementedError
+    
+    def update_column(self, table, column, updates):
+        """Escribe valores en una columna: updates = {posición de la fila (0 = primera de datos): valor}"""
+        raise NotImplementedError
+    
+    def append_rows(self, table, rows):
+        """Agrega filas al final de la tabla"""
+        raise NotImplementedError
+    
+    def upsert_row(self, table, row):
+        """Actualiza la fila con la misma clave (TABLE_KEYS) o la agrega"""
+        raise NotImplementedError
+    
+    def clear_table(self, table):
+        """Borra todas las filas dejando solo los encabezados"""
+        raise NotImplementedError
+    
+    def load_table(self, table):
+        """Devuelve (encabezados, registros) de una tabla"""
+        raise NotImplementedError
+    
+    def load_tables(self, tables):
+        """Carga varias tablas en paralelo: {tabla: (encabezados, registros)}"""
+        with ThreadPoolExecutor(max_workers=max(len(tables), 1)) as executor:
+            results = dict(zip(tables, executor.map(self.load_table, tables)))
+        return results
+    
+    def read_tail(self, table, known_rows, last_record):
+        """Registros agregados después de las primeras known_rows filas.
         
-        # Hoja de categorías personalizadas
-        if sheet_categories:
+        last_record es la última fila ya leída; si ya no coincide (tabla truncada
+        o editada) o cambiaron los encabezados devuelve None y hay que recargar todo.
+        """
+        return None
+
+class SheetsStorage(StorageBackend):
+    """Persistencia en Google Sheets (una hoja por tabla)"""
+    
+    name = 'sheets'
+    
+    def __init__(self):
+        self.row_indexes = {
+            table: WorksheetRowIndex(lambda record, table=table: table_key(table, record))
+            for table in TABLE_KEYS
+        }
+        self.verified = set()  # Tablas con encabezados ya verificados en este proceso
+        self._schema_markers = None
+        # Reentrante: check_schema lo mantiene tomado al llamar a migrate_schema
+        self._schema_lock = threading.RLock()
+        self._partitions = None  # {título: hoja} de las particiones de transacciones
+        self._partition_lock = threading.RLock()
+    
+    @staticmethod
+    def _schema_marker(table):
+        """Nombre del rango con nombre que marca la versión del esquema de una hoja"""
+        return f"finbot_schema_v{SCHEMA_VERSION}_{table}"
+    
+    def _load_schema_markers(self):
+        """Lee una sola vez los rangos con nombre de la planilla"""
+        if self._schema_markers is None:
             try:
-                headers = sheet_categories.row_values(1)
-                category_headers = ['Usuario_ID', 'Tipo_Registro', 'Categoria_Personalizada', 'Fecha_Creacion']
-                if not headers or headers != category_headers:
-                    sheet_categories.clear()
-                    sheet_categories.append_row(category_headers)
-                    logger.info("📋 Encabezados de Categorías Personalizadas configurados")
+                self._schema_markers = {r.get('name') for r in spreadsheet.list_named_ranges()}
             except Exception as e:
-                logger.error(f"❌ Error en encabezados de categorías: {e}")
-                success = False
+                logger.warning(f"⚠️ No se pudieron leer los marcadores de esquema: {e}")
+                self._schema_markers = set()
+        return self._schema_markers
+    
+    def _mark_verified(self, table):
+        """Recuerda que la hoja está al día y deja el marcador de versión si falta"""
+        self.verified.add(table)
+        markers = self._load_schema_markers()
+        marker = self._schema_marker(table)
+        if marker in markers:
+            return
+        try:
+            self.worksheet(table).define_named_range(f"A1:{rowcol_to_a1(1, len(table_schema(table)))}", marker)
+            markers.add(marker)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo marcar el esquema de {table}: {e}")
+    
+    def worksheet(self, table):
+        """Hoja de Google Sheets asociada a una tabla"""
+        if is_partition(table):
+            return self._partition_sheets().get(table) if sheet else None
+        return {
+            'Transacciones': sheet,
+            'Metas_Ahorro': sheet_goals,
+            'Presupuestos': sheet_budgets,
+            'Usuarios': sheet_users,
+            'Categorias_Personalizadas': sheet_categories,
+            'Fechas_Pago': sheet_paydays,
+            'Grupos_Familiares': sheet_family_groups,
+            'Archivo_Transacciones': sheet_archive,
+            'Resumen_Mensual': sheet_monthly_summary
+        }.get(table)
+    
+    def has_table(self, table):
+        return self.worksheet(table) is not None
+    
+    def _partition_sheets(self):
+        """Particiones existentes (la planilla se lista una sola vez por proceso)"""
+        with self._partition_lock:
+            if self._partitions is None:
+                self._partitions = {ws.title: ws for ws in spreadsheet.worksheets() if is_partition(ws.title)}
+            return self._partitions
+    
+    def _create_partition(self, table):
+        """Crea la hoja de un período nuevo con sus encabezados (cambio de mes o de año)"""
+        with self._partition_lock:
+            partitions = self._partition_sheets()
+            if table in partitions:
+                return
+            ws = spreadsheet.add_worksheet(table, 1000, len(SHEET_HEADERS))
+            ws.append_row(SHEET_HEADERS)
+            partitions[table] = ws
+        with self._schema_lock:
+            self._mark_verified(table)
+        logger.info(f"🗓️ Nueva partición de transacciones: {table}")
+    
+    def transaction_table_for(self, fecha):
+        return transaction_partition(fecha)
+    
+    def transaction_tables(self, start=None, end=None):
+        """Particiones que se cruzan con el rango, más la hoja histórica si puede tener esas fechas"""
+        if not self.has_table('Transacciones'):
+            return []
+        keys = sorted(
+            title[len(PARTITION_PREFIX):] for title in self._partition_sheets()
+            if PARTITION_KEY_PATTERN.match(title[len(PARTITION_PREFIX):])
+        )
+        lo = period_key(start) if start is not None else None
+        hi = period_key(end) if end is not None else None
+        selected = [key for key in keys if (lo is None or key >= lo) and (hi is None or key <= hi)]
+        # La hoja principal (sheet1) guarda lo registrado antes de la primera partición
+        legacy = not keys or lo is None or lo <= keys[0]
+        return (['Transacciones'] if legacy else []) + [f"{PARTITION_PREFIX}{key}" for key in selected]
+    
+    def check_schema(self, table):
+        """Verifica los encabezados una sola vez por proceso (o por marcador de versión)"""
+        if table in self.verified:
+            return True
         
-        # Hoja de fechas de pago
-        if sheet_paydays:
-            try:
-                headers = sheet_paydays.row_values(1)
-                payday_headers = ['Usuario_ID', 'Usuario_Nombre', 'Dia_Pago', 'Mes_Pago', 'Proxima_Fecha', 'Ultima_Actualizacion']
-                if not headers or headers != payday_headers:
-                    sheet_paydays.clear()
-                    sheet_paydays.append_row(payday_headers)
-                    logger.info("📋 Encabezados de Fechas de Pago configurados")
-            except Exception as e:
-                logger.error(f"❌ Error en encabezados de fechas de pago: {e}")
-                success = False
+        try:
+            ws = self.worksheet(table)
+            if not ws:
+                return False
+            with self._schema_lock:
+                if self._schema_marker(table) in self._load_schema_markers():
+                    self.verified.add(table)
+                    return True
+                headers = ws.row_values(1)
+                if headers != table_schema(table):
+                    return self.migrate_schema(table, headers)
+                self._mark_verified(table)
+            return True
+        except Exception as e:
+            logger.error(f"Error verificando encabezados de {table}: {e}")
+            return False
+    
+    def migrate_schema(self, table, headers):
+        """Si los encabezados actuales son el inicio del esquema, escribe solo los que faltan"""
+        expected = table_schema(table)
+        if not headers or len(headers) >= len(expected) or expected[:len(headers)] != list(headers):
+            return False
         
-        # Hoja de grupos familiares
-        if sheet_family_groups:
-            try:
-                headers = sheet_family_groups.row_values(1)
-                group_headers = ['Grupo_ID', 'Nombre_Grupo', 'Codigo_Invitacion', 'Creador_ID', 'Miembros', 'Fecha_Creacion', 'Estado', 'Configuraciones']
-                if not headers or headers != group_headers:
-                    sheet_family_groups.clear()
-                    sheet_family_groups.append_row(group_headers)
-                    logger.info("📋 Encabezados de Grupos Familiares configurados")
-            except Exception as e:
-                logger.error(f"❌ Error en encabezados de grupos familiares: {e}")
-                success = False
+        ws = self.worksheet(table)
+        if ws.col_count < len(expected):
+            ws.add_cols(len(expected) - ws.col_count)
+        ws.update(f"{rowcol_to_a1(1, len(headers) + 1)}:{rowcol_to_a1(1, len(expected))}", [expected[len(headers):]])
+        with self._schema_lock:
+            self._mark_verified(table)
+        logger.info(f"📋 Columnas {', '.join(expected[len(headers):])} agregadas a {table}")
+        return True
+    
+    def ensure_schema(self, table):
+        if not self.has_table(table):
+            return False
         
-        return success
+        try:
+            if not self.check_schema(table):
+                self.clear_table(table)
+                logger.info(f"📋 Encabezados de {table} configurados")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error en encabezados de {table}: {e}")
+            return False
+    
+    def clear_table(self, table):
+        ws = self.worksheet(table)
+        ws.clear()
+        ws.append_row(table_schema(table))
+        if table in self.row_indexes:
+            self.row_indexes[table].reset()
+        with self._schema_lock:
+            self._mark_verified(table)
+    
+    def get_records(self, table):
+        return self.load_table(table)[1]
+    
+    def load_table(self, table):
+        return self._decode_values(table, self.worksheet(table).get_all_values())
+    
+    def load_tables(self, tables):
+        """Lee todas las hojas con una sola llamada values_batch_get"""
+        if not tables:
+            return {}
+        started = time.perf_counter()
+        try:
+            ranges = ["'" + self.worksheet(table).title.replace("'", "''") + "'" for table in tables]
+            response = spreadsheet.values_batch_get(ranges)
+            value_ranges = response.get('valueRanges', [])
+        except Exception as e:
+            logger.warning(f"⚠️ Lectura en lote falló, leyendo hojas en paralelo: {e}")
+            return super().load_tables(tables)
+        
+        logger.info(f"⏱️ {len(tables)} hojas leídas en una llamada en {(time.perf_counter() - started) * 1000:.0f} ms")
+        return {
+            table: self._decode_values(table, value_range.get('values', []))
+            for table, value_range in zip(tables, value_ranges)
+        }
+    
+    def _decode_values(self, table, values):
+        """Convierte una matriz de valores en (encabezados, registros) como get_all_records"""
+        headers = values[0] if values else []
+        if headers == table_schema(table) and table not in self.verified:
+            with self._schema_lock:
+                self._mark_verified(table)
+        width = len(headers)
+        records = []
+        for row in values[1:]:
+            row = list(row[:width]) + [''] * (width - len(row))
+            records.append({
+                col: numericise(value) if col in NUMERIC_COLUMNS else value
+                for col, value in zip(headers, row)
+            })
+        if table in self.row_indexes:
+            self.row_indexes[table].build(records)
+        return headers, records
+    
+    def read_tail(self, table, known_rows, last_record):
+        """Lee el encabezado y las filas desde la última conocida con un solo batch_get"""
+        headers = table_schema(table)
+        last_col = rowcol_to_a1(1, len(headers))[:-1]
+        # La fila ancla es la última ya leída (o el encabezado si aún no hay filas)
+        anchor = known_rows + 1
+        header_values, tail_values = self.worksheet(table).batch_get(
+            [f"A1:{last_col}1", f"A{anchor}:{last_col}"]
+        )
+        if not header_values or list(header_values[0]) != headers:
+            return None
         
+        _, records = self._decode_values(table, [headers] + [list(row) for row in tail_values])
+        if known_rows and (not records or records[0] != last_record):
+            return None
+        return records[1:]
+    
+    def append_rows(self, table, rows):
+        if is_partition(table) and not self.has_table(table):
+            self._create_partition(table)
+        self.worksheet(table).append_rows(rows)
+    
+    def update_column(self, table, column, updates):
+        """Escribe los valores con un solo batch_update, un rango por cada tramo de filas seguidas"""
+        if not updates:
+            return
+        col = rowcol_to_a1(1, table_schema(table).index(column) + 1)[:-1]
+        ranges = []
+        for position in sorted(updates):
+            if ranges and ranges[-1]['end'] == position:
+                ranges[-1]['values'].append([updates[position]])
+                ranges[-1]['end'] += 1
+            else:
+                ranges.append({'start': position, 'end': position + 1, 'values': [[updates[position]]]})
+        self.worksheet(table).batch_update([
+            {'range': f"{col}{r['start'] + 2}:{col}{r['end'] + 1}", 'values': r['values']} for r in ranges
+        ])
+    
+    def archive_transactions(self, table, cutoff_month, on_archived):
+        ws = self.worksheet(table)
+        _, records = self.load_table(table)
+        old_rows = [
+            (index + 2, record) for index, record in enumerate(records)
+            if is_archivable(record.get('Fecha'), cutoff_month)
+        ]
+        if not old_rows:
+            return []
+        
+        moved = [record for _, record in old_rows]
+        # El archivo no se lee al iniciar: verificar sus encabezados antes de escribir
+        self.ensure_schema('Archivo_Transacciones')
+        # Un intento anterior pudo copiar estas filas y fallar al borrarlas: no se copian de nuevo
+        missing = self._not_archived(moved)
+        if missing:
+            self.append_rows('Archivo_Transacciones', [[record.get(col, '') for col in SHEET_HEADERS] for record in missing])
+        
+        deleted = []
+        try:
+            if is_partition(table) and len(old_rows) == len(records):
+                # Partición completa fuera del horizonte: se elimina la hoja
+                self._delete_partition(ws, table, records)
+                deleted = moved
+            else:
+                # Borrar de abajo hacia arriba por tramos contiguos para no desplazar los pendientes
+                row_numbers = [row for row, _ in old_rows]
+                ranges = []
+                for row in row_numbers:
+                    if ranges and row == ranges[-1][1] + 1:
+                        ranges[-1][1] = row
+                    else:
+                        ranges.append([row, row])
+                for start, end in reversed(ranges):
+                    chunk = records[start - 2:end - 1]
+                    self._delete_rows(ws, table, start, end, chunk)
+                    deleted.extend(chunk)
+        finally:
+            # El resumen suma solo lo que ya salió de la tabla (también si falló a mitad de camino)
+            if deleted:
+                on_archived(deleted)
+        return moved
+    
+    def _not_archived(self, records):
+        """Registros que todavía no están en Archivo_Transacciones"""
+        archived = Counter(archive_key(record) for record in self.get_records('Archivo_Transacciones'))
+        missing = []
+        for record in records:
+            key = archive_key(record)
+            if archived[key] > 0:
+                archived[key] -= 1
+            else:
+                missing.append(record)
+        return missing
+    
+    @staticmethod
+    def _rows_are(ws, start, end, expected):
+        """Relee las filas start..end (o hasta el final si end es None) y las compara con las esperadas"""
+        last_col = rowcol_to_a1(1, RECORD_ID_COLUMN + 1)[:-1]
+        current = ws.get(f"A{start}:{last_col}{end or ''}")
+        found = [(row[0] if row else '', row[RECORD_ID_COLUMN] if len(row) > RECORD_ID_COLUMN else '')
+                 for row in current]
+        return found == [(str(record.get('Fecha', '')), str(record.get('Registro_ID', ''))) for record in expected]
+    
+    def _delete_rows(self, ws, table, start, end, expected):
+        """Borra las filas start..end si siguen siendo las esperadas; si el borrado falla, verifica si llegó"""
+        if not self._rows_are(ws, start, end, expected):
+            raise RuntimeError(f"Las filas {start}-{end} de {table} cambiaron desde la lectura; no se borran")
+        try:
+            ws.delete_rows(start, end)
+        except Exception as e:
+            if self._rows_are(ws, start, end, expected):
+                raise
+            logger.warning(f"⚠️ El borrado de las filas {start}-{end} de {table} falló ({e}) pero ya no están")
+    
+    def _delete_partition(self, ws, table, expected):
+        """Elimina la hoja de una partición si sigue teniendo solo las filas esperadas"""
+        if not self._rows_are(ws, 2, None, expected):
+            raise RuntimeError(f"{table} cambió desde la lectura; no se elimina")
+        try:
+            spreadsheet.del_worksheet(ws)
+        except Exception as e:
+            if any(sheet.title == table for sheet in spreadsheet.worksheets()):
+                raise
+            logger.warning(f"⚠️ La eliminación de {table} falló ({e}) pero la hoja ya no está")
+        with self._partition_lock:
+            self._partition_sheets().pop(table, None)
+    
+    def upsert_row(self, table, row):
+        ws = self.worksheet(table)
+        index = self.row_indexes[table]
+        if not index.ready:
+            self.load_table(table)
+        
+        key = table_key(table, dict(zip(table_schema(table), row)))
+        with index.lock:
+            existing_row = index.lookup(key)
+            if existing_row:
+                ws.update(f"A{existing_row}:{rowcol_to_a1(existing_row, len(row))}", [row])
+            else:
+                index.register(key, ws.append_row(row))
+
+class SQLiteStorage(StorageBackend):
+    """Persistencia local en SQLite con índices por usuario y fecha"""
+    
+    name = 'sqlite'
+    
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._lock = threading.RLock()
+        for table in SHEET_SCHEMAS:
+            self.ensure_schema(table)
+        logger.info(f"🗄️ Base de datos SQLite abierta en {path}")
+    
+    @staticmethod
+    def _quote(name):
+        return '"' + name.replace('"', '""') + '"'
+    
+    def has_table(self, table):
+        return table in SHEET_SCHEMAS
+    
+    def _columns(self, table):
+        rows = self.conn.execute(f"PRAGMA table_info({self._quote(table)})").fetchall()
+        return [row[1] for row in rows]
+    
+    def check_schema(self, table):
+        with self._lock:
+            return self._columns(table) == table_schema(table)
+    
+    def ensure_schema(self, table):
+        headers = table_schema(table)
+        q = self._quote
+        try:
+            with self._lock, self.conn:
+                existing = self._columns(table)
+                if not existing:
+                    columns = ', '.join(f"{q(col)} {'NUMERIC' if col in NUMERIC_COLUMNS else 'TEXT'}" for col in headers)
+                    self.conn.execute(f"CREATE TABLE {q(table)} ({columns})")
+                else:
+                    # Las columnas nuevas se agregan al final sin tocar los datos existentes
+                    # (vacías y no NULL si forman parte de la clave, para que el upsert las encuentre)
+                    for col in headers:
+                        if col not in existing:
+                            default = " DEFAULT ''" if col in TABLE_KEYS.get(table, []) else ""
+                            self.conn.execute(f"ALTER TABLE {q(table)} ADD COLUMN {q(col)} {'NUMERIC' if col in NUMERIC_COLUMNS else 'TEXT'}{default}")
+                
+                if table in TABLE_KEYS:
+                    # Si la clave cambió se reemplaza el índice único
+                    index_cols = [row[2] for row in self.conn.execute(f"PRAGMA index_info({q('ux_' + table)})")]
+                    if index_cols and index_cols != TABLE_KEYS[table]:
+                        self.conn.execute(f"DROP INDEX {q('ux_' + table)}")
+                    key_cols = ', '.join(q(col) for col in TABLE_KEYS[table])
+                    self.conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {q('ux_' + table)} ON {q(table)} ({key_cols})")
+                for i, index_cols in enumerate(SQLITE_INDEXES.get(table, [])):
+                    cols = ', '.join(q(col) for col in index_cols)
+                    self.conn.execute(f"CREATE INDEX IF NOT EXISTS {q(f'ix_{table}_{i}')} ON {q(table)} ({cols})")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error creando tabla {table} en SQLite: {e}")
+            return False
+    
+    def load_table(self, table):
+        # El esquema ya se ajustó al abrir la base (ensure_schema)
+        return table_schema(table), self.get_records(table)
+    
+    def get_records(self, table):
+        return self._select(table)
+    
+    def _select(self, table, offset=0):
+        headers = table_schema(table)
+        cols = ', '.join(self._quote(col) for col in headers)
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT {cols} FROM {self._quote(table)} ORDER BY rowid LIMIT -1 OFFSET ?", (offset,)
+            ).fetchall()
+        return [{col: ('' if value is None else value) for col, value in zip(headers, row)} for row in rows]
+    
+    def read_tail(self, table, known_rows, last_record):
+        if not known_rows:
+            return self._select(table)
+        records = self._select(table, offset=known_rows - 1)
+        if not records or records[0] != last_record:
+            return None
+        return records[1:]
+    
+    def append_rows(self, table, rows):
+        headers = table_schema(table)
+        cols = ', '.join(self._quote(col) for col in headers)
+        placeholders = ', '.join('?' for _ in headers)
+        with self._lock, self.conn:
+            self.conn.executemany(
+                f"INSERT INTO {self._quote(table)} ({cols}) VALUES ({placeholders})",
+                [list(row) + [''] * (len(headers) - len(row)) for row in rows]
+            )
+    
+    def upsert_row(self, table, row):
+        headers = table_schema(table)
+        q = self._quote
+        cols = ', '.join(q(col) for col in headers)
+        placeholders = ', '.join('?' for _ in headers)
+        key_cols = ', '.join(q(col) for col in TABLE_KEYS[table])
+        updates = ', '.join(f"{q(col)} = excluded.{q(col)}" for col in headers if col not in TABLE_KEYS[table])
+        with self._lock, self.conn:
+            self.conn.execute(
+                f"INSERT INTO {q(table)} ({cols}) VALUES ({placeholders}) "
+                f"ON CONFLICT ({key_cols}) DO UPDATE SET {updates}",
+                [str(value) if col in TABLE_KEYS[table] else value for col, value in zip(headers, row)]
+            )
+    
+    def update_column(self, table, column, updates):
+        if not updates:
+            return
+        q = self._quote
+        with self._lock, self.conn:
+            rowids = [row[0] for row in self.conn.execute(f"SELECT rowid FROM {q(table)} ORDER BY rowid")]
+            self.conn.executemany(
+                f"UPDATE {q(table)} SET {q(column)} = ? WHERE rowid = ?",
+                [(value, rowids[position]) for position, value in updates.items()]
+            )
+    
+    def clear_table(self, table):
+        with self._lock, self.conn:
+            self.conn.execute(f"DELETE FROM {self._quote(table)}")
+    
+    def archive_transactions(self, table, cutoff_month, on_archived):
+        cols = ', '.join(self._quote(col) for col in SHEET_HEADERS)
+        where = "substr(Fecha, 1, 7) < ? AND Fecha GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]*'"
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT rowid, {cols} FROM {self._quote(table)} WHERE {where} ORDER BY rowid", (cutoff_month,)
+            ).fetchall()
+            if not rows:
+                return []
+            rowids = [row[0] for row in rows]
+            moved = [{col: ('' if value is None else value) for col, value in zip(SHEET_HEADERS, row[1:])} for row in rows]
+            # Copiar y borrar en una sola transacción: no hay estado intermedio que reintentar
+            with self.conn:
+                self.conn.executemany(
+                    f"INSERT INTO {self._quote('Archivo_Transacciones')} ({cols}) VALUES ({', '.join('?' for _ in SHEET_HEADERS)})",
+                    [[record[col] for col in SHEET_HEADERS] for record in moved]
+                )
+                self.conn.executemany(f"DELETE FROM {self._quote(table)} WHERE rowid = ?", [(rowid,) for rowid in rowids])
+        on_archived(moved)
+        return moved
+    
+    def export_to(self, target):
+        """Copia todas las tablas a otro backend (p. ej. Google Sheets como respaldo)"""
+        for table in SHEET_SCHEMAS:
+            if not target.has_table(table):
+                continue
+            records = self.get_records(table)
+            target.clear_table(table)
+            if records:
+                target.append_rows(table, [[r[col] for col in table_schema(table)] for r in records])
+            logger.info(f"📤 Exportadas {len(records)} filas de {table}")
+
+def create_storage():
+    """Crea el backend de persistencia configurado en STORAGE_BACKEND"""
+    if STORAGE_BACKEND == 'sqlite':
+        try:
+            return SQLiteStorage(SQLITE_PATH)
+        except Exception as e:
+            logger.error(f"❌ Error abriendo SQLite ({SQLITE_PATH}), usando Google Sheets: {e}")
+    return SheetsStorage()
+
+# Backend de persistencia global (se crea en build_app_context)
+storage = None
+
+class AdvancedFinanceBotManager:
+    # Estado que se guarda en la instantánea local
+    SNAPSHOT_FIELDS = ('users', 'paydays', 'payday_dates', 'budgets', 'goals', 'notifications',
+                       'custom_categories', 'family_groups', 'user_groups')
+    
+    def __init__(self, warm_start=True):
+        self.users = {}
+        self.paydays = {}  # {user_id: day_of_month}
+        self.payday_dates = {}  # {user_id: {'day': X, 'month': Y, 'next_payday': date}}
+        self.budgets = {}  # {user_id: {category: amount}}
+        self.goals = {}    # {user_id: [{name, amount, target_date, saved}]}
+        self.notifications = {}  # {user_id: [notification_settings]}
+        self.custom_categories = {}  # {user_id: {type: [categories]}}
+        self.family_groups = {}  # {group_id: {name, code, creator, members, settings}}
+        self.user_groups = {}  # {user_id: group_id}
+        self.state_lock = threading.RLock()
+        self.reconciled = threading.Event()
+        self._snapshot_keys = {}
+        self._dirty_keys = {}  # {campo: claves modificadas mientras se reconcilia}
+        
+        # Arranque en caliente: servir desde la instantánea y reconciliar en segundo plano
+        if warm_start and self.load_snapshot():
+            threading.Thread(target=self.reconcile, name="finbot-reconcile", daemon=True).start()
+        else:
+            # Cargar datos desde Google Sheets al inicializar
+            self.load_all_data()
+            self.reconciled.set()
+    
+    def _mark_dirty(self, field, key):
+        """Anota una clave modificada antes de terminar la reconciliación para que no se pise"""
+        if not self.reconciled.is_set():
+            with self.state_lock:
+                self._dirty_keys.setdefault(field, set()).add(key)
+    
     def register_user(self, user_id, username):
         """Registra un nuevo usuario con perfil completo"""
         if user_id not in self.users:
+            self._mark_dirty('users', user_id)
             self.users[user_id] = {
                 'username': username,
                 'registered_date': datetime.datetime.now(TIMEZONE),
@@ -270,35 +1342,21 @@ class AdvancedFinanceBotManager:
             
     def save_user_data(self, user_id):
         """Guarda los datos del usuario en Google Sheets"""
-        if not sheet_users or user_id not in self.users:
+        self._mark_dirty('users', user_id)
+        if not storage.has_table('Usuarios') or user_id not in self.users:
             return False
             
         try:
             # Asegurar que la hoja tenga encabezados correctos
-            expected_headers = ['Usuario_ID', 'Usuario_Nombre', 'Fecha_Registro', 'Ultima_Actividad', 'Dia_Pago', 'Fecha_Pago_Completa', 'Ingreso_Mensual', 'Configuraciones']
-            if not self._ensure_sheet_has_headers(sheet_users, expected_headers):
+            if not storage.check_schema('Usuarios'):
                 logger.info("Configurando encabezados de usuarios...")
-                sheet_users.clear()
-                sheet_users.append_row(expected_headers)
+                storage.clear_table('Usuarios')
             
             user_info = self.users[user_id]
             now = datetime.datetime.now(TIMEZONE).strftime("%Y-%m-%d %H:%M")
             registered = user_info['registered_date'].strftime("%Y-%m-%d") if isinstance(user_info['registered_date'], datetime.datetime) else str(user_info['registered_date'])
             last_activity = user_info['last_activity'].strftime("%Y-%m-%d %H:%M") if isinstance(user_info['last_activity'], datetime.datetime) else str(user_info['last_activity'])
             
-            # Buscar si el usuario ya existe (manejo seguro)
-            try:
-                records = sheet_users.get_all_records()
-            except Exception as e:
-                logger.warning(f"Error obteniendo registros, usando lista vacía: {e}")
-                records = []
-                
-            existing_row = None
-            for i, record in enumerate(records, 2):  # Empezar desde fila 2
-                if str(record.get('Usuario_ID')) == str(user_id):
-                    existing_row = i
-                    break
-            
             row_data = [
                 str(user_id),
                 user_info['username'],
@@ -310,13 +1368,8 @@ class AdvancedFinanceBotManager:
                 str(user_info.get('preferences', {}))
             ]
             
-            if existing_row:
-                # Actualizar fila existente
-                for col, value in enumerate(row_data, 1):
-                    sheet_users.update_cell(existing_row, col, value)
-            else:
-                # Agregar nueva fila
-                sheet_users.append_row(row_data)
+            # Actualizar o agregar la fila completa con una sola llamada
+            storage.upsert_row('Usuarios', row_data)
             
             return True
         except Exception as e:
@@ -324,76 +1377,208 @@ class AdvancedFinanceBotManager:
             return False
     
     def load_all_data(self):
-        """Carga todos los datos desde Google Sheets"""
-        # Asegurar que todas las hojas tengan encabezados antes de cargar datos
-        logger.info("🔧 Verificando y configurando encabezados de hojas...")
-        self._ensure_all_sheet_headers()
-        
-        logger.info("📊 Iniciando carga de datos desde Google Sheets...")
-        self.load_users_data()
-        self.load_goals_data()
-        self.load_budgets_data()
-        self.load_categories_data()
-        self.load_paydays_data()
-        self.load_family_groups_data()
-        logger.info("✅ Carga de datos completada")
-    
-    def load_users_data(self):
+        """Carga todas las tablas con una sola lectura y las decodifica en paralelo"""
+        logger.info(f"📊 Iniciando carga de datos ({storage.name})...")
+        started = time.perf_counter()
+        
+        tables = [table for table in SHEET_SCHEMAS if table not in LAZY_TABLES and storage.has_table(table)]
+        try:
+            # Solo las transacciones del período actual; las demás se leen al consultarlas
+            now = datetime.datetime.now(TIMEZONE)
+            transaction_tables = storage.transaction_tables(now, now)
+            tables += transaction_tables
+            # Sin envíos de la cola durante la lectura: así se sabe qué filas ya incluye
+            with append_queue.flush_lock:
+                loaded = storage.load_tables(tables)
+        except Exception as e:
+            logger.error(f"❌ Error en la carga inicial de datos: {e}")
+            return
+        
+        # Verificar encabezados con la misma lectura (sin row_values por hoja)
+        for table, (headers, records) in loaded.items():
+            if headers != table_schema(table):
+                try:
+                    if storage.migrate_schema(table, headers):
+                        # Columnas nuevas al final: los datos se conservan con esas celdas vacías
+                        for record in records:
+                            for col in table_schema(table)[len(headers):]:
+                                record.setdefault(col, '')
+                        continue
+                    storage.clear_table(table)
+                    logger.info(f"📋 Encabezados de {table} configurados")
+                except Exception as e:
+                    logger.error(f"❌ Error en encabezados de {table}: {e}")
+                loaded[table] = (table_schema(table), [])
+        
+        loaders = {
+            'Usuarios': self.load_users_data,
+            'Metas_Ahorro': self.load_goals_data,
+            'Presupuestos': self.load_budgets_data,
+            'Categorias_Personalizadas': self.load_categories_data,
+            'Fechas_Pago': self.load_paydays_data,
+            'Resumen_Mensual': archive_summary.load
+        }
+        for table in transaction_tables:
+            loaders[table] = lambda records, table=table: transaction_mirror.load_partition(table, records)
+        
+        def decode(table, loader):
+            decode_started = time.perf_counter()
+            loader(records=loaded[table][1])
+            logger.info(f"⏱️ {table}: {len(loaded[table][1])} filas decodificadas en {(time.perf_counter() - decode_started) * 1000:.1f} ms")
+        
+        with ThreadPoolExecutor(max_workers=len(loaders)) as executor:
+            futures = [executor.submit(decode, table, loader) for table, loader in loaders.items() if table in loaded]
+            for future in futures:
+                future.result()
+        
+        # Los grupos necesitan los nombres de usuario ya cargados
+        if 'Grupos_Familiares' in loaded:
+            decode('Grupos_Familiares', self.load_family_groups_data)
+        
+        RowDecoder.report()
+        logger.info(f"✅ Carga de datos completada en {(time.perf_counter() - started) * 1000:.0f} ms")
+    
+    def save_snapshot(self, path=None):
+        """Guarda el estado del manager en disco (escritura atómica)"""
+        path = path or SNAPSHOT_PATH
+        if not path:
+            return False
+        
+        payload = None
+        for attempt in range(3):
+            try:
+                with self.state_lock:
+                    payload = pickle.dumps({
+                        'backend': storage.name,
+                        'schema_version': SCHEMA_VERSION,
+                        'saved_at': datetime.datetime.now(TIMEZONE),
+                        'state': {field: getattr(self, field) for field in self.SNAPSHOT_FIELDS}
+                    }, protocol=pickle.HIGHEST_PROTOCOL)
+                break
+            except RuntimeError:
+                # Un handler modificó un diccionario durante la copia; reintentar
+                continue
+        if payload is None:
+            logger.warning("⚠️ No se pudo serializar la instantánea del manager")
+            return False
+        
+        try:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(SNAPSHOT_HEADER)
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            logger.info(f"💾 Instantánea del manager guardada ({len(payload) / 1024:.0f} KB)")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error guardando la instantánea del manager: {e}")
+            return False
+    
+    def load_snapshot(self, path=None):
+        """Carga el estado desde la instantánea local; False si no existe o no es compatible"""
+        path = path or SNAPSHOT_PATH
+        if not path or not os.path.exists(path):
+            return False
+        
+        started = time.perf_counter()
+        try:
+            with open(path, 'rb') as f:
+                if f.readline() != SNAPSHOT_HEADER:
+                    logger.warning("⚠️ Instantánea con versión distinta, se ignora")
+                    return False
+                snapshot = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"⚠️ Instantánea ilegible, se ignora: {e}")
+            return False
+        
+        if snapshot.get('backend') != storage.name or snapshot.get('schema_version') != SCHEMA_VERSION:
+            logger.warning("⚠️ Instantánea de otro backend o esquema, se ignora")
+            return False
+        
+        state = snapshot.get('state', {})
+        for field in self.SNAPSHOT_FIELDS:
+            data = state.get(field, {})
+            setattr(self, field, data)
+            self._snapshot_keys[field] = set(data)
+        
+        logger.info(f"⚡ Instantánea del {snapshot.get('saved_at'):%Y-%m-%d %H:%M} cargada en "
+                    f"{(time.perf_counter() - started) * 1000:.0f} ms: {len(self.users)} usuarios")
+        return True
+    
+    def reconcile(self):
+        """Relee el almacenamiento y reemplaza lo que la instantánea tenga desactualizado"""
+        started = time.perf_counter()
+        # Desde aquí se anotan las claves que cambien mientras dura la lectura
+        self.reconciled.clear()
+        try:
+            fresh = AdvancedFinanceBotManager(warm_start=False)
+        except Exception as e:
+            logger.error(f"❌ Error reconciliando la instantánea: {e}")
+            with self.state_lock:
+                self._dirty_keys = {}
+                self.reconciled.set()
+            return False
+        
+        with self.state_lock:
+            for field in self.SNAPSHOT_FIELDS:
+                current = getattr(self, field)
+                fresh_data = getattr(fresh, field)
+                # Lo modificado durante la carga es más nuevo que lo leído: no se pisa
+                dirty = self._dirty_keys.get(field, set())
+                # Claves de la instantánea que ya no existen en el almacenamiento
+                for key in self._snapshot_keys.get(field, set()) - set(fresh_data) - dirty:
+                    current.pop(key, None)
+                current.update((key, value) for key, value in fresh_data.items() if key not in dirty)
+            self._snapshot_keys = {}
+            self._dirty_keys = {}
+            self.reconciled.set()
+        logger.info(f"🔁 Instantánea reconciliada con {storage.name} en {(time.perf_counter() - started) * 1000:.0f} ms")
+        self.save_snapshot()
+        return True
+    
+    def load_users_data(self, records=None):
         """Carga datos de usuarios desde Google Sheets"""
-        if not sheet_users:
+        if records is None and not storage.has_table('Usuarios'):
             return
             
         try:
-            # Verificar que la hoja tenga encabezados correctos
-            if not self._ensure_sheet_has_headers(sheet_users, ['Usuario_ID', 'Usuario_Nombre', 'Fecha_Registro', 'Ultima_Actividad', 'Dia_Pago', 'Fecha_Pago_Completa', 'Ingreso_Mensual', 'Configuraciones']):
-                logger.warning("Hoja de usuarios sin encabezados correctos, saltando carga")
-                return
+            if records is None:
+                # Verificar que la hoja tenga encabezados correctos
+                if not storage.check_schema('Usuarios'):
+                    logger.warning("Hoja de usuarios sin encabezados correctos, saltando carga")
+                    return
+                records = storage.get_records('Usuarios')
                 
-            records = sheet_users.get_all_records()
             if not records:  # Si no hay datos, es normal
                 logger.info("Hoja de usuarios vacía, no hay datos para cargar")
                 return
                 
-            for record in records:
-                try:
-                    user_id = int(record.get('Usuario_ID', 0))
-                except (ValueError, TypeError):
-                    logger.warning(f"Usuario_ID inválido en registro de usuarios: {record}")
-                    continue
-                    
-                if user_id > 0:
-                    try:
-                        registered_date = datetime.datetime.strptime(record.get('Fecha_Registro', ''), "%Y-%m-%d")
-                    except:
-                        registered_date = datetime.datetime.now(TIMEZONE)
-                    
-                    try:
-                        last_activity = datetime.datetime.strptime(record.get('Ultima_Actividad', ''), "%Y-%m-%d %H:%M")
-                    except:
-                        last_activity = datetime.datetime.now(TIMEZONE)
-                    
-                    self.users[user_id] = {
-                        'username': record.get('Usuario_Nombre', f'Usuario{user_id}'),
-                        'registered_date': registered_date,
-                        'payday': record.get('Dia_Pago', ''),
-                        'payday_date': record.get('Fecha_Pago_Completa', ''),
-                        'monthly_income': float(record.get('Ingreso_Mensual', 0) or 0),
-                        'last_activity': last_activity,
-                        'preferences': {
-                            'currency': 'CLP',
-                            'notifications': True,
-                            'language': 'es',
-                            'payday_reminders': True,
-                            'reminder_days_before': 3
-                        }
+            for record in RowDecoder.decode_records('Usuarios', records):
+                user_id = record.Usuario_ID
+                self.users[user_id] = {
+                    'username': record.Usuario_Nombre or f'Usuario{user_id}',
+                    'registered_date': record.Fecha_Registro or datetime.datetime.now(TIMEZONE),
+                    'payday': record.Dia_Pago,
+                    'payday_date': record.Fecha_Pago_Completa,
+                    'monthly_income': record.Ingreso_Mensual,
+                    'last_activity': record.Ultima_Actividad or datetime.datetime.now(TIMEZONE),
+                    'preferences': {
+                        'currency': 'CLP',
+                        'notifications': True,
+                        'language': 'es',
+                        'payday_reminders': True,
+                        'reminder_days_before': 3
                     }
+                }
             logger.info(f"Cargados {len(self.users)} usuarios desde Google Sheets")
         except Exception as e:
             logger.error(f"Error cargando usuarios: {e}")
     
     def save_goal(self, user_id, goal):
         """Guarda una meta de ahorro en Google Sheets"""
-        if not sheet_goals:
+        if not storage.has_table('Metas_Ahorro'):
             return False
             
         try:
@@ -411,47 +1596,37 @@ class AdvancedFinanceBotManager:
                 'Activa'
             ]
             
-            sheet_goals.append_row(row_data)
+            storage.append_rows('Metas_Ahorro', [row_data])
             return True
         except Exception as e:
             logger.error(f"Error guardando meta: {e}")
             return False
     
-    def load_goals_data(self):
+    def load_goals_data(self, records=None):
         """Carga metas de ahorro desde Google Sheets"""
-        if not sheet_goals:
+        if records is None and not storage.has_table('Metas_Ahorro'):
             return
             
         try:
-            # Verificar que la hoja tenga encabezados correctos
-            if not self._ensure_sheet_has_headers(sheet_goals, ['Usuario_ID', 'Usuario_Nombre', 'Meta_Nombre', 'Monto_Meta', 'Monto_Ahorrado', 'Fecha_Limite', 'Fecha_Creacion', 'Estado']):
-                logger.warning("Hoja de metas sin encabezados correctos, saltando carga")
-                return
+            if records is None:
+                # Verificar que la hoja tenga encabezados correctos
+                if not storage.check_schema('Metas_Ahorro'):
+                    logger.warning("Hoja de metas sin encabezados correctos, saltando carga")
+                    return
+                records = storage.get_records('Metas_Ahorro')
                 
-            records = sheet_goals.get_all_records()
             if not records:
                 logger.info("Hoja de metas vacía, no hay datos para cargar")
                 return
                 
-            for record in records:
-                try:
-                    user_id = int(record.get('Usuario_ID', 0))
-                except (ValueError, TypeError):
-                    logger.warning(f"Usuario_ID inválido en registro de metas: {record}")
-                    continue
-                    
-                if user_id > 0:
-                    if user_id not in self.goals:
-                        self.goals[user_id] = []
-                    
-                    goal = {
-                        'name': record.get('Meta_Nombre', ''),
-                        'amount': float(record.get('Monto_Meta', 0) or 0),
-                        'saved': float(record.get('Monto_Ahorrado', 0) or 0),
-                        'target_date': record.get('Fecha_Limite', ''),
-                        'created_date': record.get('Fecha_Creacion', '')
-                    }
-                    self.goals[user_id].append(goal)
+            for record in RowDecoder.decode_records('Metas_Ahorro', records):
+                self.goals.setdefault(record.Usuario_ID, []).append({
+                    'name': record.Meta_Nombre,
+                    'amount': record.Monto_Meta,
+                    'saved': record.Monto_Ahorrado,
+                    'target_date': record.Fecha_Limite,
+                    'created_date': record.Fecha_Creacion
+                })
             
             total_goals = sum(len(goals) for goals in self.goals.values())
             logger.info(f"Cargadas {total_goals} metas de ahorro desde Google Sheets")
@@ -460,27 +1635,13 @@ class AdvancedFinanceBotManager:
     
     def save_budget(self, user_id, category, amount):
         """Guarda un presupuesto en Google Sheets"""
-        if not sheet_budgets:
+        if not storage.has_table('Presupuestos'):
             return False
             
         try:
             username = self.users.get(user_id, {}).get('username', f'Usuario{user_id}')
             now = datetime.datetime.now(TIMEZONE).strftime("%Y-%m-%d %H:%M")
             
-            # Buscar si ya existe un presupuesto para esta categoría (manejo seguro)
-            try:
-                records = sheet_budgets.get_all_records()
-            except Exception as e:
-                logger.warning(f"Error obteniendo registros de presupuestos, usando lista vacía: {e}")
-                records = []
-                
-            existing_row = None
-            for i, record in enumerate(records, 2):  # Empezar desde fila 2
-                if (str(record.get('Usuario_ID')) == str(user_id) and 
-                    record.get('Categoria') == category):
-                    existing_row = i
-                    break
-            
             row_data = [
                 str(user_id),
                 username,
@@ -490,51 +1651,35 @@ class AdvancedFinanceBotManager:
                 'Activo'
             ]
             
-            if existing_row:
-                # Actualizar fila existente
-                for col, value in enumerate(row_data, 1):
-                    sheet_budgets.update_cell(existing_row, col, value)
-            else:
-                # Agregar nueva fila
-                sheet_budgets.append_row(row_data)
+            # Actualizar o agregar la fila completa con una sola llamada
+            storage.upsert_row('Presupuestos', row_data)
                 
             return True
         except Exception as e:
             logger.error(f"Error guardando presupuesto: {e}")
             return False
     
-    def load_budgets_data(self):
+    def load_budgets_data(self, records=None):
         """Carga presupuestos desde Google Sheets"""
-        if not sheet_budgets:
+        if records is None and not storage.has_table('Presupuestos'):
             return
             
         try:
-            # Verificar que la hoja tenga encabezados correctos
-            if not self._ensure_sheet_has_headers(sheet_budgets, ['Usuario_ID', 'Usuario_Nombre', 'Categoria', 'Presupuesto', 'Fecha_Creacion', 'Estado']):
-                logger.warning("Hoja de presupuestos sin encabezados correctos, saltando carga")
-                return
+            if records is None:
+                # Verificar que la hoja tenga encabezados correctos
+                if not storage.check_schema('Presupuestos'):
+                    logger.warning("Hoja de presupuestos sin encabezados correctos, saltando carga")
+                    return
+                records = storage.get_records('Presupuestos')
                 
-            records = sheet_budgets.get_all_records()
             if not records:
                 logger.info("Hoja de presupuestos vacía, no hay datos para cargar")
                 return
                 
-            for record in records:
-                try:
-                    user_id = int(record.get('Usuario_ID', 0))
-                except (ValueError, TypeError):
-                    logger.warning(f"Usuario_ID inválido en registro de presupuestos: {record}")
-                    continue
-                    
-                if user_id > 0:
-                    if user_id not in self.budgets:
-                        self.budgets[user_id] = {}
-                    
-                    category = record.get('Categoria', '')
-                    amount = float(record.get('Presupuesto', 0) or 0)
-                    
-                    if category and amount > 0:
-                        self.budgets[user_id][category] = amount
+            for record in RowDecoder.decode_records('Presupuestos', records):
+                budgets = self.budgets.setdefault(record.Usuario_ID, {})
+                if record.Categoria and record.Presupuesto > 0:
+                    budgets[record.Categoria] = record.Presupuesto
             
             total_budgets = sum(len(budgets) for budgets in self.budgets.values())
             logger.info(f"Cargados {total_budgets} presupuestos desde Google Sheets")
@@ -543,7 +1688,7 @@ class AdvancedFinanceBotManager:
     
     def save_custom_category(self, user_id, record_type, category):
         """Guarda una categoría personalizada en Google Sheets"""
-        if not sheet_categories:
+        if not storage.has_table('Categorias_Personalizadas'):
             return False
             
         try:
@@ -556,48 +1701,38 @@ class AdvancedFinanceBotManager:
                 now
             ]
             
-            sheet_categories.append_row(row_data)
+            storage.append_rows('Categorias_Personalizadas', [row_data])
             return True
         except Exception as e:
             logger.error(f"Error guardando categoría personalizada: {e}")
             return False
     
-    def load_categories_data(self):
+    def load_categories_data(self, records=None):
         """Carga categorías personalizadas desde Google Sheets"""
-        if not sheet_categories:
+        if records is None and not storage.has_table('Categorias_Personalizadas'):
             return
             
         try:
-            # Verificar que la hoja tenga encabezados correctos
-            if not self._ensure_sheet_has_headers(sheet_categories, ['Usuario_ID', 'Tipo_Registro', 'Categoria_Personalizada', 'Fecha_Creacion']):
-                logger.warning("Hoja de categorías sin encabezados correctos, saltando carga")
-                return
+            if records is None:
+                # Verificar que la hoja tenga encabezados correctos
+                if not storage.check_schema('Categorias_Personalizadas'):
+                    logger.warning("Hoja de categorías sin encabezados correctos, saltando carga")
+                    return
+                records = storage.get_records('Categorias_Personalizadas')
                 
-            records = sheet_categories.get_all_records()
             if not records:
                 logger.info("Hoja de categorías vacía, no hay datos para cargar")
                 return
                 
-            for record in records:
-                try:
-                    user_id = int(record.get('Usuario_ID', 0))
-                except (ValueError, TypeError):
-                    logger.warning(f"Usuario_ID inválido en registro de categorías: {record}")
-                    continue
-                    
-                if user_id > 0:
-                    if user_id not in self.custom_categories:
-                        self.custom_categories[user_id] = {}
-                    
-                    record_type = record.get('Tipo_Registro', '')
-                    category = record.get('Categoria_Personalizada', '')
-                    
-                    if record_type and category:
-                        if record_type not in self.custom_categories[user_id]:
-                            self.custom_categories[user_id][record_type] = []
-                        
-                        if category not in self.custom_categories[user_id][record_type]:
-                            self.custom_categories[user_id][record_type].append(category)
+            for record in RowDecoder.decode_records('Categorias_Personalizadas', records):
+                user_categories = self.custom_categories.setdefault(record.Usuario_ID, {})
+                record_type = record.Tipo_Registro
+                category = record.Categoria_Personalizada
+                
+                if record_type and category:
+                    categories = user_categories.setdefault(record_type, [])
+                    if category not in categories:
+                        categories.append(category)
             
             total_categories = sum(sum(len(cats) for cats in user_cats.values()) for user_cats in self.custom_categories.values())
             logger.info(f"Cargadas {total_categories} categorías personalizadas desde Google Sheets")
@@ -606,7 +1741,7 @@ class AdvancedFinanceBotManager:
     
     def save_payday_date(self, user_id, day, month):
         """Guarda fecha de pago en Google Sheets"""
-        if not sheet_paydays:
+        if not storage.has_table('Fechas_Pago'):
             return False
             
         try:
@@ -620,19 +1755,6 @@ class AdvancedFinanceBotManager:
             if next_payday < today:
                 next_payday = datetime.datetime(current_year + 1, month, day, tzinfo=TIMEZONE)
             
-            # Buscar si ya existe (manejo seguro)
-            try:
-                records = sheet_paydays.get_all_records()
-            except Exception as e:
-                logger.warning(f"Error obteniendo registros de fechas de pago, usando lista vacía: {e}")
-                records = []
-                
-            existing_row = None
-            for i, record in enumerate(records, 2):
-                if str(record.get('Usuario_ID')) == str(user_id):
-                    existing_row = i
-                    break
-            
             row_data = [
                 str(user_id),
                 username,
@@ -642,65 +1764,43 @@ class AdvancedFinanceBotManager:
                 now
             ]
             
-            if existing_row:
-                for col, value in enumerate(row_data, 1):
-                    sheet_paydays.update_cell(existing_row, col, value)
-            else:
-                sheet_paydays.append_row(row_data)
+            # Actualizar o agregar la fila completa con una sola llamada
+            storage.upsert_row('Fechas_Pago', row_data)
                 
             return True
         except Exception as e:
             logger.error(f"Error guardando fecha de pago: {e}")
             return False
     
-    def load_paydays_data(self):
+    def load_paydays_data(self, records=None):
         """Carga fechas de pago desde Google Sheets"""
-        if not sheet_paydays:
+        if records is None and not storage.has_table('Fechas_Pago'):
             return
             
         try:
-            # Verificar que la hoja tenga encabezados correctos
-            if not self._ensure_sheet_has_headers(sheet_paydays, ['Usuario_ID', 'Usuario_Nombre', 'Dia_Pago', 'Mes_Pago', 'Proxima_Fecha', 'Ultima_Actualizacion']):
-                logger.warning("Hoja de fechas de pago sin encabezados correctos, saltando carga")
-                return
+            if records is None:
+                # Verificar que la hoja tenga encabezados correctos
+                if not storage.check_schema('Fechas_Pago'):
+                    logger.warning("Hoja de fechas de pago sin encabezados correctos, saltando carga")
+                    return
+                records = storage.get_records('Fechas_Pago')
                 
-            records = sheet_paydays.get_all_records()
             if not records:
                 logger.info("Hoja de fechas de pago vacía, no hay datos para cargar")
                 return
                 
-            for record in records:
-                try:
-                    user_id = int(record.get('Usuario_ID', 0))
-                except (ValueError, TypeError):
-                    logger.warning(f"Usuario_ID inválido en registro de fechas de pago: {record}")
-                    continue
-                    
-                if user_id > 0:
-                    try:
-                        day = int(record.get('Dia_Pago', 0) or 0)
-                        month = int(record.get('Mes_Pago', 0) or 0)
-                    except (ValueError, TypeError):
-                        logger.warning(f"Día/mes de pago inválido para usuario {user_id}: {record}")
-                        continue
-                    
-                    if day > 0:
-                        self.paydays[user_id] = day
-                    
-                    if day > 0 and month > 0:
-                        try:
-                            next_payday_str = record.get('Proxima_Fecha', '')
-                            next_payday = datetime.datetime.strptime(next_payday_str, "%Y-%m-%d")
-                            next_payday = TIMEZONE.localize(next_payday)
-                            
-                            self.payday_dates[user_id] = {
-                                'day': day,
-                                'month': month,
-                                'next_payday': next_payday,
-                                'last_updated': datetime.datetime.now(TIMEZONE)
-                            }
-                        except:
-                            pass
+            for record in RowDecoder.decode_records('Fechas_Pago', records):
+                user_id, day, month = record.Usuario_ID, record.Dia_Pago, record.Mes_Pago
+                if day > 0:
+                    self.paydays[user_id] = day
+                
+                if day > 0 and month > 0 and record.Proxima_Fecha:
+                    self.payday_dates[user_id] = {
+                        'day': day,
+                        'month': month,
+                        'next_payday': TIMEZONE.localize(record.Proxima_Fecha),
+                        'last_updated': datetime.datetime.now(TIMEZONE)
+                    }
             
             logger.info(f"Cargadas {len(self.paydays)} configuraciones de días de pago desde Google Sheets")
         except Exception as e:
@@ -708,6 +1808,7 @@ class AdvancedFinanceBotManager:
             
     def set_payday(self, user_id, day):
         """Establece el día de pago para un usuario"""
+        self._mark_dirty('paydays', user_id)
         self.paydays[user_id] = day
         if user_id in self.users:
             self.users[user_id]['payday'] = day
@@ -731,6 +1832,7 @@ class AdvancedFinanceBotManager:
             if next_payday < today:
                 next_payday = datetime.datetime(current_year + 1, month, day, tzinfo=TIMEZONE)
             
+            self._mark_dirty('payday_dates', user_id)
             self.payday_dates[user_id] = {
                 'day': day,
                 'month': month,
@@ -844,6 +1946,7 @@ class AdvancedFinanceBotManager:
 
     def set_budget(self, user_id, category, amount):
         """Establece un presupuesto por categoría"""
+        self._mark_dirty('budgets', user_id)
         if user_id not in self.budgets:
             self.budgets[user_id] = {}
         self.budgets[user_id][category] = amount
@@ -855,6 +1958,7 @@ class AdvancedFinanceBotManager:
 
     def add_goal(self, user_id, name, amount, target_date):
         """Añade una meta de ahorro"""
+        self._mark_dirty('goals', user_id)
         if user_id not in self.goals:
             self.goals[user_id] = []
         
@@ -874,6 +1978,7 @@ class AdvancedFinanceBotManager:
 
     def add_custom_category(self, user_id, record_type, category):
         """Añade una categoría personalizada"""
+        self._mark_dirty('custom_categories', user_id)
         if user_id not in self.custom_categories:
             self.custom_categories[user_id] = {}
         if record_type not in self.custom_categories[user_id]:
@@ -931,6 +2036,8 @@ class AdvancedFinanceBotManager:
             }
         }
         
+        self._mark_dirty('family_groups', group_id)
+        self._mark_dirty('user_groups', creator_id)
         self.family_groups[group_id] = group_data
         self.user_groups[creator_id] = group_id
         
@@ -964,6 +2071,8 @@ class AdvancedFinanceBotManager:
         username = self.users.get(user_id, {}).get('username', f'Usuario{user_id}')
         
         # Agregar usuario al grupo
+        self._mark_dirty('family_groups', group_id)
+        self._mark_dirty('user_groups', user_id)
         group_data['members'].append(user_id)
         group_data['member_usernames'].append(username)
         self.user_groups[user_id] = group_id
@@ -997,220 +2106,1490 @@ class AdvancedFinanceBotManager:
         username = user_info.get('username', '')
         return username and not username.startswith('Usuario')
     
-    def save_family_group(self, group_data):
-        """Guarda un grupo familiar en Google Sheets"""
-        if not sheet_family_groups:
-            return False
-        
+    def _family_group_row(self, group_data):
+        """Convierte un grupo familiar en la fila de Google Sheets"""
+        members_str = ','.join(map(str, group_data['members']))
+        created_date = group_data['created_date'].strftime("%Y-%m-%d %H:%M")
+        settings_str = str(group_data.get('settings', {}))
+        
+        return [
+            group_data['id'],
+            group_data['name'],
+            group_data['invitation_code'],
+            str(group_data['creator_id']),
+            members_str,
+            created_date,
+            group_data['status'],
+            settings_str
+        ]
+    
+    def save_family_group(self, group_data):
+        """Guarda un grupo familiar en Google Sheets"""
+        if not storage.has_table('Grupos_Familiares'):
+            return False
+        
+        try:
+            row_data = self._family_group_row(group_data)
+            storage.upsert_row('Grupos_Familiares', row_data)
+            return True
+        except Exception as e:
+            logger.error(f"Error guardando grupo familiar: {e}")
+            return False
+    
+    def update_family_group(self, group_data):
+        """Actualiza un grupo familiar en Google Sheets"""
+        if not storage.has_table('Grupos_Familiares'):
+            return False
+        
+        try:
+            # Reescribir la fila completa (miembros y configuraciones incluidos) en una llamada
+            row_data = self._family_group_row(group_data)
+            storage.upsert_row('Grupos_Familiares', row_data)
+            return True
+        except Exception as e:
+            logger.error(f"Error actualizando grupo familiar: {e}")
+            return False
+    
+    def load_family_groups_data(self, records=None):
+        """Carga grupos familiares desde Google Sheets"""
+        if records is None and not storage.has_table('Grupos_Familiares'):
+            return
+        
+        try:
+            if records is None:
+                # Verificar que la hoja tenga encabezados correctos
+                if not storage.check_schema('Grupos_Familiares'):
+                    logger.warning("Hoja de grupos familiares sin encabezados correctos, saltando carga")
+                    return
+                records = storage.get_records('Grupos_Familiares')
+                
+            if not records:
+                logger.info("Hoja de grupos familiares vacía, no hay datos para cargar")
+                return
+                
+            for record in RowDecoder.decode_records('Grupos_Familiares', records):
+                group_id = record.Grupo_ID
+                if not group_id:
+                    continue
+                
+                members = [int(x.strip()) for x in record.Miembros.split(',') if x.strip().isdigit()]
+                creator_id = record.Creador_ID
+                
+                self.family_groups[group_id] = {
+                    'id': group_id,
+                    'name': record.Nombre_Grupo,
+                    'invitation_code': record.Codigo_Invitacion,
+                    'creator_id': creator_id,
+                    'creator_username': self.users.get(creator_id, {}).get('username', ''),
+                    'members': members,
+                    'member_usernames': [self.users.get(member_id, {}).get('username', f'Usuario{member_id}') for member_id in members],
+                    'created_date': record.Fecha_Creacion or datetime.datetime.now(TIMEZONE),
+                    'status': record.Estado or 'Activo',
+                    'settings': {
+                        'shared_budgets': True,
+                        'shared_goals': True,
+                        'notification_all_transactions': False
+                    }
+                }
+                
+                # Mapear usuarios a grupos
+                for member_id in members:
+                    self.user_groups[member_id] = group_id
+            
+            logger.info(f"Cargados {len(self.family_groups)} grupos familiares desde Google Sheets")
+        except Exception as e:
+            logger.error(f"Error cargando grupos familiares: {e}")
+
+# Códigos de tipo de transacción (sin distinguir mayúsculas: 'gasto' y 'Gasto' son lo mismo)
+TYPE_INCOME, TYPE_EXPENSE, TYPE_DEBT = 1, 2, 3
+TYPE_CODES = {'ingreso': TYPE_INCOME, 'gasto': TYPE_EXPENSE, 'deuda': TYPE_DEBT}
+TYPE_NAMES = {TYPE_INCOME: 'Ingreso', TYPE_EXPENSE: 'Gasto', TYPE_DEBT: 'Deuda'}
+
+def type_code(value):
+    """Código numérico del tipo de transacción (0 si no es reconocido)"""
+    return TYPE_CODES.get(str(value).strip().lower(), 0)
+
+class Vocabulary:
+    """Diccionario de valores repetidos (usuarios, categorías...) a códigos enteros"""
+
+    def __init__(self):
+        self.values = ['']
+        self.codes = {'': 0}
+        self._lock = threading.Lock()
+
+    def code(self, value):
+        """Código del valor, agregándolo al diccionario si es nuevo"""
+        code = self.codes.get(value)
+        if code is None:
+            with self._lock:
+                code = self.codes.get(value)
+                if code is None:
+                    code = len(self.values)
+                    self.values.append(value)
+                    self.codes[value] = code
+        return code
+
+    def lookup(self, value):
+        """Código del valor sin agregarlo (-1 si nunca apareció)"""
+        return self.codes.get(value, -1)
+
+    def encode(self, values):
+        return np.fromiter((self.code(v) for v in values), dtype=np.int32, count=len(values))
+
+# Diccionarios compartidos por todas las particiones (los códigos son comparables entre ellas)
+USER_VOCABULARY = Vocabulary()
+CATEGORY_VOCABULARY = Vocabulary()
+TYPE_VOCABULARY = Vocabulary()
+STATUS_VOCABULARY = Vocabulary()
+
+class TransactionColumns:
+    """Transacciones en columnas NumPy.
+
+    Fecha como epoch int64 (hora local, NaT si no se pudo interpretar), Monto como
+    float64, el tipo como código uint8 y usuario, categoría y estado como códigos de
+    los diccionarios compartidos. Los textos libres quedan en arreglos de objetos y
+    los valores que no se pueden reconstruir tal cual se guardan aparte.
+
+    El dueño de cada fila (owners) es su Usuario_ID; las filas antiguas sin ID usan
+    -(código del nombre de usuario) - 1, ver owner_key.
+
+    Las filas sin fecha o monto válidos quedan marcadas en `rejected`: se conservan
+    para reescribirlas tal cual, pero no entran en los índices ni en los totales.
+    """
+
+    TEXT_COLUMNS = ('Descripcion', 'Fecha_Vencimiento', 'Registro_ID')
+    CODED_COLUMNS = {'Usuario': USER_VOCABULARY, 'Tipo': TYPE_VOCABULARY,
+                     'Categoria': CATEGORY_VOCABULARY, 'Estado_Pago': STATUS_VOCABULARY}
+    NAT = np.iinfo(np.int64).min
+
+    def __init__(self, epoch, amount, types, coded, text, owners, rejected, raw_values=None, index=None):
+        self.epoch = epoch      # int64, segundos
+        self.amount = amount    # float64 (0 si el monto no es numérico)
+        self.types = types      # uint8, ver TYPE_CODES
+        self.owners = owners    # int64, Usuario_ID o clave del nombre (negativa)
+        self.rejected = rejected  # bool, filas que no se pudieron interpretar
+        self.coded = coded      # {columna: int32}
+        self.text = text        # {columna: arreglo de objetos}
+        self.raw_values = raw_values or {}  # {(fila, columna): valor original}
+        # Índices secundarios {nombre: {clave: filas}}; al unir bloques se combinan, no se recalculan
+        self.index = index if index is not None else self._build_index()
+
+    @property
+    def users(self):
+        return self.coded['Usuario']
+
+    @property
+    def categories(self):
+        return self.coded['Categoria']
+
+    def __len__(self):
+        return len(self.epoch)
+
+    @classmethod
+    def from_records(cls, records):
+        """Convierte registros (diccionarios por encabezado) a columnas"""
+        count = len(records)
+        raw_values = {}
+
+        dates = [str(r.get('Fecha', '')) for r in records]
+        try:
+            parsed = np.array(dates, dtype='datetime64[s]')
+        except ValueError:
+            parsed = np.array([cls._parse_date(d) for d in dates], dtype='datetime64[s]')
+        epoch = parsed.astype(np.int64)
+        # Guardar las fechas cuyo texto no coincide con el que se reconstruye
+        rebuilt = cls._format_dates(epoch)
+        for i in np.flatnonzero(rebuilt != np.array(dates, dtype=object)):
+            raw_values[(int(i), 'Fecha')] = dates[i]
+
+        amount = np.zeros(count, dtype=np.float64)
+        rejected = epoch == cls.NAT
+        for i, record in enumerate(records):
+            value = record.get('Monto', '')
+            try:
+                amount[i] = float(value)
+            except (ValueError, TypeError):
+                raw_values[(i, 'Monto')] = value
+                rejected[i] = True
+
+        coded = {
+            column: vocabulary.encode([r.get(column, '') for r in records])
+            for column, vocabulary in cls.CODED_COLUMNS.items()
+        }
+        type_lookup = np.array([type_code(v) for v in TYPE_VOCABULARY.values], dtype=np.uint8)
+        types = type_lookup[coded['Tipo']]
+
+        text = {}
+        for column in cls.TEXT_COLUMNS:
+            values = np.empty(count, dtype=object)
+            values[:] = [r.get(column, '') for r in records]
+            text[column] = values
+
+        owners = np.zeros(count, dtype=np.int64)
+        for i, record in enumerate(records):
+            value = record.get('Usuario_ID', '')
+            owners[i] = owner_key(value, coded['Usuario'][i])
+            if value != '' and owners[i] < 0:
+                raw_values[(i, 'Usuario_ID')] = value
+
+        return cls(epoch, amount, types, coded, text, owners, rejected, raw_values)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Convierte filas en el orden de SHEET_HEADERS"""
+        return cls.from_records([dict(zip(SHEET_HEADERS, row)) for row in rows])
+
+    @classmethod
+    def concat(cls, parts):
+        """Une varios bloques de columnas en uno"""
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return cls.from_records([])
+        if len(parts) == 1:
+            return parts[0]
+        raw_values = {}
+        offset = 0
+        for part in parts:
+            for (i, column), value in part.raw_values.items():
+                raw_values[(i + offset, column)] = value
+            offset += len(part)
+        return cls(
+            np.concatenate([p.epoch for p in parts]),
+            np.concatenate([p.amount for p in parts]),
+            np.concatenate([p.types for p in parts]),
+            {c: np.concatenate([p.coded[c] for p in parts]) for c in cls.CODED_COLUMNS},
+            {c: np.concatenate([p.text[c] for p in parts]) for c in cls.TEXT_COLUMNS},
+            np.concatenate([p.owners for p in parts]),
+            np.concatenate([p.rejected for p in parts]),
+            raw_values,
+            cls._merge_index(parts)
+        )
+
+    def months(self):
+        """Mes de cada fila como entero (meses desde 1970-01)"""
+        return self.epoch.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+
+    def weeks(self):
+        """Semana (de lunes a domingo) de cada fila como entero; el 1970-01-01 fue jueves"""
+        return (self.epoch // 86400 + 3) // 7
+
+    def _build_index(self):
+        valid = ~self.rejected
+        rows = np.arange(len(self), dtype=np.int32)[valid]
+        users = self.owners[valid]
+        pending = ((self.types == TYPE_DEBT) & (self.coded['Estado_Pago'] == STATUS_VOCABULARY.lookup('Pendiente')))[valid]
+        return {
+            'user': group_rows(rows, users),
+            'user_month': group_rows(rows, users, self.months()[valid]),
+            'pending_debts': group_rows(rows[pending], users[pending]),
+        }
+
+    @staticmethod
+    def _merge_index(parts):
+        merged = {}
+        offset = 0
+        for part in parts:
+            for name, groups in part.index.items():
+                target = merged.setdefault(name, {})
+                for key, rows in groups.items():
+                    target.setdefault(key, []).append(rows + offset if offset else rows)
+            offset += len(part)
+        return {
+            name: {key: chunks[0] if len(chunks) == 1 else np.concatenate(chunks) for key, chunks in groups.items()}
+            for name, groups in merged.items()
+        }
+
+    @staticmethod
+    def _parse_date(value):
+        try:
+            return np.datetime64(value, 's')
+        except ValueError:
+            return np.datetime64('NaT')
+
+    @classmethod
+    def _format_dates(cls, epoch):
+        formatted = np.datetime_as_string(epoch.astype('datetime64[s]'), unit='m').astype(object)
+        formatted = np.array([d.replace('T', ' ') for d in formatted], dtype=object)
+        formatted[epoch == cls.NAT] = ''
+        return formatted
+
+    def to_records(self, rows=None):
+        """Reconstruye los registros como diccionarios (todos, los de una máscara o los de una lista de filas)"""
+        if rows is None:
+            indexes = range(len(self))
+        else:
+            indexes = np.flatnonzero(rows) if rows.dtype == bool else rows
+        if not len(indexes):
+            return []
+        dates = self._format_dates(self.epoch[indexes])
+        records = []
+        for position, i in enumerate(indexes):
+            i = int(i)
+            amount = float(self.amount[i])
+            record = {
+                'Fecha': dates[position],
+                'Usuario': USER_VOCABULARY.values[self.coded['Usuario'][i]],
+                'Tipo': TYPE_VOCABULARY.values[self.coded['Tipo'][i]],
+                'Monto': int(amount) if amount.is_integer() else amount,
+                'Categoria': CATEGORY_VOCABULARY.values[self.coded['Categoria'][i]],
+                'Descripcion': self.text['Descripcion'][i],
+                'Fecha_Vencimiento': self.text['Fecha_Vencimiento'][i],
+                'Estado_Pago': STATUS_VOCABULARY.values[self.coded['Estado_Pago'][i]],
+                'Registro_ID': self.text['Registro_ID'][i],
+                'Usuario_ID': int(self.owners[i]) if self.owners[i] > 0 else '',
+            }
+            if self.raw_values:
+                for column in ('Fecha', 'Monto', 'Usuario_ID'):
+                    if (i, column) in self.raw_values:
+                        record[column] = self.raw_values[(i, column)]
+            records.append(record)
+        return records
+
+    def record_ids(self):
+        return {str(v) for v in self.text['Registro_ID'] if v}
+
+    def valid_rows(self):
+        """Filas que entran en los análisis (las no rechazadas)"""
+        return np.flatnonzero(~self.rejected).astype(np.int32)
+
+    def _index_rows(self, name, keys):
+        parts = [self.index[name][key] for key in keys if key in self.index[name]]
+        if not parts:
+            return np.empty(0, dtype=np.int32)
+        return parts[0] if len(parts) == 1 else np.sort(np.concatenate(parts))
+
+    def user_rows(self, user_id, month=None):
+        """Filas de un usuario (y de un mes, si se indica) según los índices secundarios"""
+        keys = owner_keys([user_id])
+        if month is None:
+            return self._index_rows('user', keys)
+        month = month_number(month)
+        return self._index_rows('user_month', [(key, month) for key in keys])
+
+    def rows_for_users(self, owners, since=None, until=None):
+        """Filas de varios dueños (ver owner_keys), en orden; solo de los meses [since, until) si se indican"""
+        if since is None or until is None:
+            return self._index_rows('user', owners)
+        return self._index_rows('user_month', [(owner, month) for owner in owners for month in range(since, until)])
+
+    def pending_debt_rows(self, user_id):
+        """Filas de deudas con Estado_Pago 'Pendiente' de un usuario"""
+        return self._index_rows('pending_debts', owner_keys([user_id]))
+
+def owner_key(user_id, username_code):
+    """Dueño de una fila: su Usuario_ID o, si no lo tiene, -(código del nombre) - 1"""
+    try:
+        value = int(user_id)
+    except (ValueError, TypeError):
+        value = 0
+    return value if value > 0 else -int(username_code) - 1
+
+def owner_keys(user_ids):
+    """Claves de dueño de unos usuarios: sus IDs y el nombre actual de cada uno (filas sin ID)"""
+    keys = set()
+    for user_id in user_ids:
+        keys.add(int(user_id))
+        user_info = bot_manager.users.get(int(user_id)) if bot_manager else None
+        if user_info:
+            code = USER_VOCABULARY.lookup(user_info['username'])
+            if code >= 0:
+                keys.add(-code - 1)
+    return keys
+
+def owner_label(owner):
+    """Nombre a mostrar para una clave de dueño"""
+    if owner > 0:
+        user_info = bot_manager.users.get(owner) if bot_manager else None
+        return user_info['username'] if user_info else f"Usuario{owner}"
+    return USER_VOCABULARY.values[-owner - 1]
+
+def group_starts(*keys):
+    """Ordena por una o más columnas y devuelve (orden, inicio de cada grupo, claves ordenadas)"""
+    # lexsort es estable: dentro de cada grupo las filas quedan en su orden original
+    order = np.lexsort(keys[::-1])
+    sorted_keys = [key[order] for key in keys]
+    boundary = np.zeros(len(order), dtype=bool)
+    boundary[0] = True
+    for key in sorted_keys:
+        boundary[1:] |= key[1:] != key[:-1]
+    return order, np.flatnonzero(boundary), sorted_keys
+
+def group_rows(rows, *keys):
+    """Agrupa números de fila por el valor de una o más columnas: {clave: filas en orden}"""
+    if not len(rows):
+        return {}
+    order, starts, sorted_keys = group_starts(*keys)
+    groups = np.split(rows[order], starts[1:])
+    if len(keys) == 1:
+        labels = sorted_keys[0][starts].tolist()
+    else:
+        labels = list(zip(*(key[starts].tolist() for key in sorted_keys)))
+    return dict(zip(labels, groups))
+
+def month_number(date):
+    """Mes de la fecha como entero (meses desde 1970-01), igual que TransactionColumns.months"""
+    return int(np.datetime64(date.strftime("%Y-%m"), 'M').astype(np.int64))
+
+def month_label(month):
+    """'YYYY-MM' de un mes numerado como en month_number"""
+    return str(np.datetime64(month, 'M'))
+
+def quarter_label(month):
+    """'YYYY-Tn' (trimestre) de un mes numerado como en month_number"""
+    return f"{1970 + month // 12}-T{month % 12 // 3 + 1}"
+
+def week_label(week):
+    """Fecha 'YYYY-MM-DD' del lunes de una semana numerada como en TransactionColumns.weeks"""
+    return str(np.datetime64(week * 7 - 3, 'D'))
+
+def week_start(date):
+    """Lunes de la semana de la fecha"""
+    return date - datetime.timedelta(days=date.weekday())
+
+def local_epoch(value):
+    """Epoch de una fecha u hora local, en la misma escala que TransactionColumns.epoch"""
+    return int(np.datetime64(value.strftime("%Y-%m-%dT%H:%M:%S"), 's').astype(np.int64))
+
+def is_month_start(value):
+    """Indica si la fecha es el inicio exacto de un mes (None cuenta como sin límite)"""
+    if value is None:
+        return True
+    if isinstance(value, datetime.datetime):
+        return value.day == 1 and value.time() == datetime.time()
+    return value.day == 1
+
+def last_instant(value):
+    """Último instante antes de un límite exclusivo (para elegir particiones)"""
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value - datetime.timedelta(microseconds=1)
+    return value - datetime.timedelta(days=1)
+
+def add_months(date, months):
+    """Primer día del mes desplazado `months` meses desde el de la fecha"""
+    index = date.year * 12 + date.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+class TransactionRollup:
+    """Totales de transacciones por (dueño, mes, tipo, categoría): suma, cantidad, mínimo y máximo.
+    
+    Las claves son códigos (dueño como en owner_key, categoría del diccionario compartido,
+    mes como en month_number y tipo como en TYPE_CODES), agrupadas por (usuario, mes) para que
+    una consulta de un mes no dependa de cuánta historia haya.
+    """
+    
+    def __init__(self):
+        self.cells = {}  # {(usuario, mes): {(tipo, categoria): [suma, cantidad, mínimo, máximo]}}
+    
+    def add(self, user, month, record_type, category, amount, count=1, low=None, high=None):
+        """Suma una transacción (o un grupo ya agregado) a su celda"""
+        low = amount if low is None else low
+        high = amount if high is None else high
+        cell = self.cells.setdefault((user, month), {}).get((record_type, category))
+        if cell is None:
+            self.cells[(user, month)][(record_type, category)] = [amount, count, low, high]
+        else:
+            cell[0] += amount
+            cell[1] += count
+            cell[2] = min(cell[2], low)
+            cell[3] = max(cell[3], high)
+    
+    def add_row(self, row):
+        """Suma una fila en el orden de SHEET_HEADERS"""
+        try:
+            amount = float(row[3])
+        except (ValueError, TypeError):
+            return
+        date = TransactionColumns._parse_date(str(row[0]))
+        if np.isnat(date):
+            return
+        month = date.astype('datetime64[M]').astype(np.int64)
+        user_id = row[USER_ID_COLUMN] if len(row) > USER_ID_COLUMN else ''
+        owner = owner_key(user_id, USER_VOCABULARY.code(row[1]))
+        self.add(owner, int(month), type_code(row[2]),
+                 CATEGORY_VOCABULARY.code(row[4]), amount)
+    
+    def add_columns(self, columns, rows=None, periods=None):
+        """Suma un bloque de columnas (o solo esas filas válidas) agrupándolo primero con NumPy.
+        
+        `periods` reemplaza el mes de cada fila por otro período (p. ej. columns.weeks()).
+        """
+        if rows is None:
+            rows = columns.valid_rows()
+        if periods is None:
+            periods = columns.months()
+        keys = tuple(key[rows] for key in (columns.owners, periods, columns.types, columns.categories))
+        amounts = columns.amount[rows]
+        if not len(amounts):
+            return
+        order, starts, sorted_keys = group_starts(*keys)
+        amounts = amounts[order]
+        sums = np.add.reduceat(amounts, starts)
+        lows = np.minimum.reduceat(amounts, starts)
+        highs = np.maximum.reduceat(amounts, starts)
+        counts = np.diff(np.append(starts, len(order)))
+        labels = zip(*(key[starts].tolist() for key in sorted_keys))
+        for (user, month, record_type, category), amount, count, low, high in zip(
+                labels, sums.tolist(), counts.tolist(), lows.tolist(), highs.tolist()):
+            self.add(user, month, record_type, category, amount, count, low, high)
+    
+    @classmethod
+    def from_columns(cls, columns, rows=None, periods=None):
+        rollup = cls()
+        rollup.add_columns(columns, rows, periods)
+        return rollup
+    
+    @staticmethod
+    def collect(rollups, users=None, since=None, until=None):
+        """Combina las celdas de varios resúmenes: {(dueño, mes, tipo, categoria): [suma, cantidad, mín, máx]}
+        
+        Filtra por claves de dueño (owner_keys) y por meses en [since, until). Con usuarios y meses
+        acotados se consultan directamente esas celdas; si no, se recorren los pares
+        (usuario, mes), nunca las filas.
+        """
+        combined = {}
+        for rollup in rollups:
+            if users is not None and since is not None and until is not None \
+                    and len(users) * (until - since) <= len(rollup.cells):
+                pairs = [(user, month) for user in users for month in range(since, until)
+                         if (user, month) in rollup.cells]
+            else:
+                pairs = [
+                    pair for pair in rollup.cells
+                    if (users is None or pair[0] in users)
+                    and (since is None or pair[1] >= since) and (until is None or pair[1] < until)
+                ]
+            for pair in pairs:
+                for (record_type, category), (amount, count, low, high) in rollup.cells[pair].items():
+                    key = pair + (record_type, category)
+                    cell = combined.get(key)
+                    if cell is None:
+                        combined[key] = [amount, count, low, high]
+                    else:
+                        cell[0] += amount
+                        cell[1] += count
+                        cell[2] = min(cell[2], low)
+                        cell[3] = max(cell[3], high)
+        return combined
+
+class TransactionMirror:
+    """Copia en memoria de las transacciones, por partición y compartida por todo el proceso.
+
+    Cada partición se lee completa la primera vez que se consulta y después solo sus
+    filas nuevas, y se guarda en columnas (TransactionColumns) junto con sus totales
+    (TransactionRollup). Las filas que este proceso escribió y que aún no se volvieron
+    a leer se toman de la cola de escritura al consultar; sus totales se llevan aparte
+    y se actualizan fila por fila al registrarlas.
+    """
+
+    def __init__(self):
+        self.partitions = {}    # {tabla: TransactionColumns con las filas del almacenamiento}
+        self.rollups = {}       # {tabla: TransactionRollup de esas filas}
+        self.local_rollup = TransactionRollup()  # Totales de las filas de la cola
+        self.local_version = None  # Versión de la cola con la que se calcularon
+        self.last_records = {}  # {tabla: última fila leída, tal como la devolvió el almacenamiento}
+        self.synced_at = {}     # {tabla: fecha de la última lectura}
+        self.generation = 0     # Cambia con cada lectura, para invalidar columnas combinadas
+        self._combined = {}     # {tablas: (clave, TransactionColumns)}
+        self._lock = threading.RLock()
+
+    @property
+    def loaded(self):
+        return bool(self.partitions)
+
+    def row_count(self):
+        """Filas de las particiones ya cargadas (sin leer nada del almacenamiento)"""
+        with self._lock:
+            return sum(len(columns) for columns in self.partitions.values())
+
+    def _store(self, table, records, replace):
+        ids = {str(r.get('Registro_ID')) for r in records if r.get('Registro_ID')}
+        columns = TransactionColumns.from_records(records)
+        rejected = np.flatnonzero(columns.rejected)
+        if len(rejected):
+            RowDecoder.note_rejected(table, len(rejected), records[rejected[0]])
+        with self._lock:
+            if replace or table not in self.partitions:
+                self.partitions[table] = columns
+                self.rollups[table] = TransactionRollup.from_columns(columns)
+                self.last_records[table] = records[-1] if records else None
+            elif records:
+                self.partitions[table] = TransactionColumns.concat([self.partitions[table], columns])
+                self.rollups[table].add_columns(columns)
+                self.last_records[table] = records[-1]
+            self.synced_at[table] = datetime.datetime.now(TIMEZONE)
+            self.generation += 1
+            # Las filas de este proceso que ya llegaron a la hoja dejan de tomarse de la cola
+            append_queue.acknowledge_stored(ids)
+    
+    def load_partition(self, table, records=None):
+        """Lee una partición completa (o adopta los registros de la carga inicial)"""
+        try:
+            if records is None:
+                # Bloquear envíos para que ninguna fila quede en la hoja y en la cola a la vez
+                with append_queue.flush_lock:
+                    records = storage.get_records(table) if storage.has_table(table) else []
+                    self._store(table, records, replace=True)
+            else:
+                self._store(table, records, replace=True)
+        except Exception as e:
+            logger.error(f"❌ Error cargando {table} en el espejo: {e}")
+            return False
+        
+        logger.info(f"🪞 Espejo de transacciones: {table} con {len(records)} registros")
+        return True
+    
+    def load(self):
+        """Vuelve a leer completas las particiones ya cargadas (o la del período actual)"""
+        with self._lock:
+            tables = list(self.partitions)
+        if not tables:
+            now = datetime.datetime.now(TIMEZONE)
+            tables = storage.transaction_tables(now, now)
+        if not tables:
+            return False
+        results = [self.load_partition(table) for table in tables]
+        return all(results)
+    
+    def resync(self):
+        """Descarta la copia en memoria y la vuelve a leer desde Google Sheets"""
+        logger.info("🔄 Resincronizando espejo de transacciones...")
+        return self.load()
+    
+    def sync(self, tables=None):
+        """Incorpora solo las filas nuevas (de otros usuarios o ya enviadas por la cola).
+        
+        Una partición se recarga completa únicamente si se truncó o cambió su encabezado.
+        """
+        if tables is None:
+            with self._lock:
+                tables = list(self.partitions)
+            if not tables:
+                return self.load()
+        results = [self.sync_partition(table) for table in tables]
+        return all(results)
+    
+    def sync_partition(self, table):
+        """Lee las filas agregadas a una partición desde la última lectura"""
+        with self._lock:
+            columns = self.partitions.get(table)
+            if columns is None:
+                known_rows = None
+            else:
+                known_rows = len(columns)
+                last_record = self.last_records.get(table)
+        if known_rows is None:
+            return self.load_partition(table)
+        
+        try:
+            with append_queue.flush_lock:
+                if not storage.has_table(table):
+                    # Partición del período aún sin filas enviadas
+                    new_records = []
+                else:
+                    new_records = storage.read_tail(table, known_rows, last_record)
+                if new_records is not None:
+                    self._store(table, new_records, replace=False)
+        except Exception as e:
+            logger.error(f"❌ Error sincronizando {table}: {e}")
+            return False
+        
+        if new_records is None:
+            logger.info(f"🔄 {table} truncada o con otro encabezado, recarga completa")
+            return self.load_partition(table)
+        if new_records:
+            logger.info(f"🪞 {table} sincronizada: {len(new_records)} filas nuevas")
+        return True
+    
+    def forget(self, table):
+        """Descarta una partición del espejo (p. ej. después de archivarla)"""
+        with self._lock:
+            self.partitions.pop(table, None)
+            self.rollups.pop(table, None)
+            self.last_records.pop(table, None)
+            self.synced_at.pop(table, None)
+            self.generation += 1
+    
+    def is_stale(self, table):
+        """Indica si pasó el intervalo de sincronización desde la última lectura de la partición"""
+        synced_at = self.synced_at.get(table)
+        if TRANSACTIONS_SYNC_INTERVAL <= 0 or synced_at is None:
+            return False
+        return (datetime.datetime.now(TIMEZONE) - synced_at).total_seconds() >= TRANSACTIONS_SYNC_INTERVAL
+    
+    def stored_ids(self, tables):
+        """Registro_ID ya guardados en esas particiones (tras traer sus filas nuevas)"""
+        if not self.sync(list(tables)):
+            raise RuntimeError("no se pudo leer la hoja para verificar filas ya enviadas")
+        return self.loaded_ids(tables)
+    
+    def loaded_ids(self, tables=None):
+        """Registro_ID de las particiones ya cargadas (de esas tablas, si se indican), sin leer nada"""
+        with self._lock:
+            return {
+                record_id
+                for table, columns in self.partitions.items() if tables is None or table in tables
+                for record_id in columns.record_ids()
+            }
+    
+    def _refresh(self, start, end):
+        """Particiones que cubren el rango, leídas o sincronizadas si hace falta"""
+        return self._refresh_tables(storage.transaction_tables(start, end))
+    
+    def _refresh_tables(self, tables):
+        for table in tables:
+            if table not in self.partitions:
+                self.load_partition(table)
+            elif self.is_stale(table):
+                self.sync_partition(table)
+        return tables
+    
+    def get_records(self, start=None, end=None):
+        """Registros de las particiones que cubren el rango de fechas (todas si no se indica)"""
+        tables = self._refresh(start, end)
+        with self._lock:
+            parts = [self.partitions[table] for table in tables if table in self.partitions]
+            local_rows = append_queue.local_rows()
+        records = [r for part in parts for r in part.to_records()]
+        # Filas escritas por este proceso que la hoja aún no devolvió
+        records.extend(
+            dict(zip(SHEET_HEADERS, row)) for row in local_rows if in_period_range(row[0], start, end)
+        )
+        return records
+    
+    def get_columns(self, start=None, end=None):
+        """Columnas de las particiones del rango más las filas locales aún no leídas.
+        
+        El resultado combinado se reutiliza mientras no cambien las particiones ni la cola.
+        """
+        return self._combine(tuple(self._refresh(start, end)), start, end)
+    
+    def _combine(self, tables, start, end):
+        with self._lock:
+            local_rows = [row for row in append_queue.local_rows() if in_period_range(row[0], start, end)]
+            key = (self.generation, tuple(str(row[RECORD_ID_COLUMN]) for row in local_rows))
+            cached = self._combined.get(tables)
+            if cached and cached[0] == key:
+                return cached[1]
+            parts = [self.partitions[table] for table in tables if table in self.partitions]
+            columns = TransactionColumns.concat(parts + [TransactionColumns.from_rows(local_rows)])
+            self._combined[tables] = (key, columns)
+            return columns
+    
+    def _local_rollup(self):
+        """Totales de las filas locales; se recalculan si la cola quitó o recuperó filas"""
+        with self._lock:
+            if self.local_version != append_queue.version:
+                version = append_queue.version
+                rollup = TransactionRollup()
+                rollup.add_columns(TransactionColumns.from_rows(append_queue.local_rows()))
+                self.local_rollup, self.local_version = rollup, version
+            return self.local_rollup
+    
+    def record_local(self, row):
+        """Suma a los totales una fila recién encolada (O(1))"""
+        with self._lock:
+            if self.local_version == append_queue.version:
+                self.local_rollup.add_row(row)
+            # Si la cola cambió, el próximo _local_rollup ya la incluye
+    
+    def get_rollups(self, start=None, end=None):
+        """Totales de las particiones del rango más los de las filas locales"""
+        tables = self._refresh(start, end)
+        with self._lock:
+            rollups = [self.rollups[table] for table in tables if table in self.rollups]
+            rollups.append(self._local_rollup())
+        return rollups
+    
+    def get_user_records(self, user_id, start=None, end=None, last=None):
+        """Devuelve los registros de un usuario (solo los últimos `last`, si se indica).
+        
+        Con `last` se leen las particiones de la más nueva a la más vieja y se para al
+        juntar esa cantidad, así el historial reciente no depende de cuántos meses haya.
+        """
+        tables = storage.transaction_tables(start, end)
+        if last is None or not tables:
+            columns = self.get_columns(start, end)
+            rows = columns.user_rows(user_id)
+            return columns.to_records(rows if last is None else rows[-last:])
+        
+        for count in range(1, len(tables) + 1):
+            newest = tuple(self._refresh_tables(tables[-count:]))
+            columns = self._combine(newest, start, end)
+            rows = columns.user_rows(user_id)
+            if len(rows) >= last:
+                break
+        return columns.to_records(rows[-last:])
+    
+    def get_pending_debts(self, user_id, months=PENDING_DEBT_MONTHS):
+        """Deudas pendientes de un usuario registradas en los últimos `months` meses"""
+        start = add_months(datetime.datetime.now(TIMEZONE).date(), 1 - months) if months > 0 else None
+        columns = self.get_columns(start=start)
+        return columns.to_records(columns.pending_debt_rows(user_id))
+
+# Espejo global de transacciones
+transaction_mirror = TransactionMirror()
+
+def summary_user_id(value):
+    """Usuario_ID de una fila para el resumen archivado (0 si no tiene)"""
+    try:
+        return max(int(value), 0)
+    except (ValueError, TypeError):
+        return 0
+
+class ArchiveSummary:
+    """Totales mensuales de las transacciones archivadas (usuario × mes × tipo × categoría).
+    
+    Cada total se lleva por Usuario_ID, así renombrar a un usuario o que dos compartan
+    nombre no mezcla ni pierde meses; el nombre solo identifica las filas antiguas sin ID.
+    """
+    
+    def __init__(self):
+        self.totals = {}  # {(usuario_id o 0, usuario, mes, tipo, categoria): [total, cantidad]}
+        self.unsaved = set()  # Claves cuya fila no se pudo escribir (se reintentan)
+        self.loaded = False
+        self._rollup = None
+        self._lock = threading.RLock()
+    
+    def load(self, records=None):
+        """Lee la tabla Resumen_Mensual (o adopta los registros de la carga inicial)"""
         try:
-            members_str = ','.join(map(str, group_data['members']))
-            created_date = group_data['created_date'].strftime("%Y-%m-%d %H:%M")
-            settings_str = str(group_data.get('settings', {}))
-            
-            row_data = [
-                group_data['id'],
-                group_data['name'],
-                group_data['invitation_code'],
-                str(group_data['creator_id']),
-                members_str,
-                created_date,
-                group_data['status'],
-                settings_str
-            ]
-            
-            sheet_family_groups.append_row(row_data)
-            return True
+            if records is None:
+                records = storage.get_records('Resumen_Mensual') if storage.has_table('Resumen_Mensual') else []
         except Exception as e:
-            logger.error(f"Error guardando grupo familiar: {e}")
+            logger.error(f"❌ Error cargando el resumen mensual: {e}")
             return False
+        
+        totals = {}
+        key_columns = TABLE_KEYS['Resumen_Mensual']
+        for record in RowDecoder.decode_records('Resumen_Mensual', records):
+            totals[tuple(getattr(record, col) for col in key_columns)] = [record.Total, record.Cantidad]
+        
+        with self._lock:
+            self.totals = totals
+            self.loaded = True
+            self._rollup = None
+        return True
     
-    def update_family_group(self, group_data):
-        """Actualiza un grupo familiar en Google Sheets"""
-        if not sheet_family_groups:
-            return False
+    def add(self, records):
+        """Suma transacciones recién archivadas y guarda solo las filas del resumen afectadas.
         
-        try:
-            # Obtener registros con manejo seguro
+        Los totales en memoria se actualizan siempre; si una fila no se puede escribir
+        queda pendiente y se vuelve a escribir en la próxima llamada a add o save.
+        """
+        if not self.loaded:
+            self.load()
+        
+        changed = set()
+        with self._lock:
+            for record in records:
+                key = (summary_user_id(record.get('Usuario_ID')), str(record.get('Usuario', '')),
+                       str(record.get('Fecha', ''))[:7], str(record.get('Tipo', '')), str(record.get('Categoria', '')))
+                try:
+                    amount = float(record.get('Monto') or 0)
+                except (ValueError, TypeError):
+                    amount = 0.0
+                entry = self.totals.setdefault(key, [0.0, 0])
+                entry[0] += amount
+                entry[1] += 1
+                changed.add(key)
+            self._rollup = None
+            self.unsaved |= changed
+        self.save()
+    
+    def save(self):
+        """Escribe las filas del resumen pendientes; False si alguna no se pudo escribir"""
+        with self._lock:
+            rows = {key: self.row(key, *self.totals[key]) for key in self.unsaved}
+        for key in sorted(rows):
             try:
-                records = sheet_family_groups.get_all_records()
+                storage.upsert_row('Resumen_Mensual', rows[key])
             except Exception as e:
-                logger.warning(f"Error obteniendo registros de grupos familiares, usando lista vacía: {e}")
-                records = []
-                
-            existing_row = None
+                logger.error(f"❌ Error guardando el resumen mensual ({len(rows)} filas pendientes): {e}")
+                return False
+            with self._lock:
+                self.unsaved.discard(key)
+        return True
+    
+    @staticmethod
+    def row(key, total, count):
+        """Fila de Resumen_Mensual (en el orden del esquema) de una clave de totals"""
+        user_id, user, month, record_type, category = key
+        return [user, month, record_type, category, total, count, user_id or '']
+    
+    def get_rows(self, user_id=None, username=None, start_month=None):
+        """Filas del resumen de un usuario (por ID, o por nombre las que no tienen ID) desde un mes ('YYYY-MM')"""
+        if not self.loaded:
+            self.load()
+        with self._lock:
+            return [
+                dict(zip(SHEET_SCHEMAS['Resumen_Mensual'], self.row(key, total, count)))
+                for key, (total, count) in self.totals.items()
+                if (user_id is None or key[0] == user_id or (not key[0] and key[1] == username))
+                and (start_month is None or key[2] >= start_month)
+            ]
+
+    def rollup(self):
+        """Los totales archivados como TransactionRollup (sin mínimo ni máximo por fila)"""
+        if not self.loaded:
+            self.load()
+        with self._lock:
+            if self._rollup is None:
+                rollup = TransactionRollup()
+                for (user_id, user, month, record_type, category), (total, count) in self.totals.items():
+                    try:
+                        month_code = int(np.datetime64(month, 'M').astype(np.int64))
+                    except ValueError:
+                        continue
+                    # Igual que en las transacciones: el ID y, solo si falta, el nombre
+                    rollup.add(owner_key(user_id, USER_VOCABULARY.code(user)), month_code, type_code(record_type),
+                               CATEGORY_VOCABULARY.code(category), total, count, float('inf'), float('-inf'))
+                self._rollup = rollup
+            return self._rollup
+
+# Resumen global de transacciones archivadas
+archive_summary = ArchiveSummary()
+
+class SheetAppendQueue:
+    """Cola de escritura diferida con registro local (WAL).
+    
+    Cada fila se agrega primero a un archivo local con fsync, así el usuario recibe
+    confirmación aunque Google Sheets no responda. El hilo de envío vacía la cola en
+    orden con un solo append_rows por lote y, si no sabe si un envío llegó a aplicarse,
+    descarta las filas cuyo Registro_ID ya está en el almacenamiento.
+    """
+    
+    def __init__(self, flush_interval=SHEETS_FLUSH_INTERVAL, batch_size=SHEETS_BATCH_SIZE, wal_path=TRANSACTIONS_WAL_PATH):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.wal_path = wal_path
+        self.pending = []
+        self.sent = []  # Enviadas a la hoja pero aún no leídas por el espejo
+        self.failures = 0
+        self.uncertain = False  # Puede haber filas pendientes que ya estén en la hoja
+        self.recovered = False
+        self.version = 0  # Cambia cuando salen o se recuperan filas locales (no al encolar)
+        self.flush_lock = threading.RLock()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """Recupera las filas del WAL e inicia el hilo de envío"""
+        with self._lock:
+            recovered = self._recover()
+        if recovered:
+            # Las que el espejo ya leyó de la hoja no se vuelven a contar ni a enviar
+            self.acknowledge_stored(transaction_mirror.loaded_ids())
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sheet-append-queue", daemon=True)
+        self._thread.start()
+        logger.info(f"📮 Cola de escritura iniciada (cada {self.flush_interval}s o {self.batch_size} filas)")
+    
+    def enqueue(self, row):
+        """Guarda la fila en el WAL (fsync) y la agrega a la cola; despierta al hilo si se llenó el lote"""
+        with self._lock:
+            recovered = self._recover()
+            self._append_wal([row])
+            self.pending.append(row)
+            full = len(self.pending) >= self.batch_size
+        if recovered:
+            self.acknowledge_stored(transaction_mirror.loaded_ids())
+        if full:
+            self._wakeup.set()
+    
+    def pending_rows(self):
+        """Filas aún no confirmadas por Google Sheets"""
+        with self._lock:
+            return list(self.pending)
+    
+    def local_rows(self):
+        """Filas escritas por este proceso que el espejo todavía no leyó (enviadas y pendientes)"""
+        with self._lock:
+            return self.sent + self.pending
+    
+    def acknowledge_stored(self, record_ids):
+        """Olvida las filas locales que el espejo ya leyó de la hoja.
+        
+        Siempre las enviadas; las pendientes solo si pueden estar ya guardadas (recuperadas
+        del WAL o tras un envío dudoso), que de otro modo se contarían dos veces hasta el
+        próximo envío.
+        """
+        if not record_ids:
+            return
+        with self._lock:
+            sent = [row for row in self.sent if str(row[RECORD_ID_COLUMN]) not in record_ids]
+            pending = self.pending
+            if self.uncertain:
+                pending = [row for row in self.pending if str(row[RECORD_ID_COLUMN]) not in record_ids]
+            if len(sent) == len(self.sent) and len(pending) == len(self.pending):
+                return
+            if len(pending) != len(self.pending):
+                logger.info(f"📮 {len(self.pending) - len(pending)} filas del WAL ya estaban en {storage.name}, se omiten")
+                self.pending = pending
+                self._rewrite_wal()
+            self.sent = sent
+            self.version += 1
+    
+    def flush(self):
+        """Envía las filas pendientes con un append_rows por partición"""
+        with self.flush_lock:
+            with self._lock:
+                batch = list(self.pending)
+            if not batch:
+                return True
+            if not storage.has_table('Transacciones'):
+                self.failures += 1
+                return False
             
-            for i, record in enumerate(records, 2):
-                if record.get('Grupo_ID') == group_data['id']:
-                    existing_row = i
-                    break
+            try:
+                if self.uncertain:
+                    batch = self._drop_stored(batch)
+                # Cada fila va a la partición de su fecha (la hoja del período se crea al cambiar de mes)
+                groups = defaultdict(list)
+                for row in batch:
+                    groups[storage.transaction_table_for(row[0])].append(row)
+                for table, rows in groups.items():
+                    storage.append_rows(table, rows)
+                    self._mark_sent(rows)
+            except Exception as e:
+                self.failures += 1
+                # Salvo un 429, el envío pudo haberse aplicado: verificar antes de reenviar
+                if SheetsApiLimiter._status(e) != 429:
+                    self.uncertain = True
+                logger.error(f"❌ Error enviando {len(batch)} filas a {storage.name} (intento {self.failures}): {e}")
+                return False
             
-            if existing_row:
-                members_str = ','.join(map(str, group_data['members']))
-                settings_str = str(group_data.get('settings', {}))
-                
-                # Actualizar columnas específicas
-                sheet_family_groups.update_cell(existing_row, 5, members_str)  # Miembros
-                sheet_family_groups.update_cell(existing_row, 8, settings_str)  # Configuraciones
-                
+            if not batch:
+                # Todo lo pendiente ya estaba guardado: solo queda compactar el WAL
+                with self._lock:
+                    self._rewrite_wal()
+            self.uncertain = False
+            self.failures = 0
+            if batch:
+                logger.info(f"📮 {len(batch)} transacciones enviadas a {storage.name}")
             return True
-        except Exception as e:
-            logger.error(f"Error actualizando grupo familiar: {e}")
-            return False
     
-    def load_family_groups_data(self):
-        """Carga grupos familiares desde Google Sheets"""
-        if not sheet_family_groups:
+    def _mark_sent(self, rows):
+        """Pasa filas confirmadas de pendientes a enviadas y compacta el WAL"""
+        ids = {str(row[RECORD_ID_COLUMN]) for row in rows}
+        with self._lock:
+            self.pending = [row for row in self.pending if str(row[RECORD_ID_COLUMN]) not in ids]
+            self.sent.extend(rows)
+            self._rewrite_wal()
+    
+    def _drop_stored(self, batch):
+        """Quita del lote las filas cuyo Registro_ID ya está en el almacenamiento"""
+        # Todas las hojas que pueden tener esas fechas, incluida la histórica (sheet1)
+        tables = {
+            table for fecha in {str(row[0]) for row in batch}
+            for table in storage.transaction_tables(fecha, fecha)
+        }
+        stored_ids = transaction_mirror.stored_ids(tables)
+        fresh = [row for row in batch if str(row[RECORD_ID_COLUMN]) not in stored_ids]
+        if len(fresh) < len(batch):
+            logger.info(f"📮 {len(batch) - len(fresh)} filas del WAL ya estaban en {storage.name}, se omiten")
+        with self._lock:
+            # Las omitidas ya las trajo el espejo. Se quitan por Registro_ID: al leer la hoja,
+            # el espejo pudo haber descartado algunas de la cola (acknowledge_stored)
+            self.pending = [row for row in self.pending if str(row[RECORD_ID_COLUMN]) not in stored_ids]
+            self.version += 1
+        return fresh
+    
+    def stop(self):
+        """Detiene el hilo y envía lo pendiente antes de salir"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=self.flush_interval + 30)
+        if not self.flush():
+            logger.warning(f"⚠️ {len(self.pending)} transacciones quedaron guardadas en {self.wal_path}")
+    
+    def _run(self):
+        """Bucle del hilo de envío con espera exponencial tras errores"""
+        while not self._stop.is_set():
+            delay = self.flush_interval
+            if self.failures:
+                delay = min(self.flush_interval * (2 ** self.failures), 300)
+            self._wakeup.wait(timeout=delay)
+            self._wakeup.clear()
+            if self._stop.is_set():
+                break
+            if self.pending and not storage.has_table('Transacciones'):
+                self._reconnect()
+            self.flush()
+    
+    def _reconnect(self):
+        """Vuelve a conectar con Google Sheets si la conexión inicial falló"""
+        if not isinstance(storage, SheetsStorage):
             return
-        
+        logger.info("🔌 Reintentando conexión con Google Sheets...")
+        connect_google_sheets()
+        if storage.has_table('Transacciones') and bot_manager:
+            # Cargar los datos que no se pudieron leer al iniciar
+            bot_manager.reconcile()
+    
+    def _append_wal(self, rows):
+        """Agrega filas al WAL y fuerza la escritura a disco"""
+        with open(self.wal_path, 'a', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def _rewrite_wal(self):
+        """Deja en el WAL solo las filas pendientes (o lo borra si no hay)"""
         try:
-            # Verificar que la hoja tenga encabezados correctos
-            if not self._ensure_sheet_has_headers(sheet_family_groups, ['Grupo_ID', 'Nombre_Grupo', 'Codigo_Invitacion', 'Creador_ID', 'Miembros', 'Fecha_Creacion', 'Estado', 'Configuraciones']):
-                logger.warning("Hoja de grupos familiares sin encabezados correctos, saltando carga")
-                return
-                
-            records = sheet_family_groups.get_all_records()
-            if not records:
-                logger.info("Hoja de grupos familiares vacía, no hay datos para cargar")
-                return
-                
-            for record in records:
-                group_id = record.get('Grupo_ID', '')
-                if group_id:
-                    try:
-                        members_str = record.get('Miembros', '')
-                        members = [int(x.strip()) for x in members_str.split(',') if x.strip().isdigit()]
-                        
-                        created_date_str = record.get('Fecha_Creacion', '')
-                        try:
-                            created_date = datetime.datetime.strptime(created_date_str, "%Y-%m-%d %H:%M")
-                        except:
-                            created_date = datetime.datetime.now(TIMEZONE)
-                        
-                        # Obtener nombres de usuarios
-                        member_usernames = []
-                        for member_id in members:
-                            username = self.users.get(member_id, {}).get('username', f'Usuario{member_id}')
-                            member_usernames.append(username)
-                        
-                        # Obtener creator_id con manejo seguro
-                        try:
-                            creator_id = int(record.get('Creador_ID', 0))
-                        except (ValueError, TypeError):
-                            logger.warning(f"Creador_ID inválido en grupo {group_id}: {record}")
-                            creator_id = 0
-                        
-                        group_data = {
-                            'id': group_id,
-                            'name': record.get('Nombre_Grupo', ''),
-                            'invitation_code': record.get('Codigo_Invitacion', ''),
-                            'creator_id': creator_id,
-                            'creator_username': self.users.get(creator_id, {}).get('username', ''),
-                            'members': members,
-                            'member_usernames': member_usernames,
-                            'created_date': created_date,
-                            'status': record.get('Estado', 'Activo'),
-                            'settings': {
-                                'shared_budgets': True,
-                                'shared_goals': True,
-                                'notification_all_transactions': False
-                            }
-                        }
-                        
-                        self.family_groups[group_id] = group_data
-                        
-                        # Mapear usuarios a grupos
-                        for member_id in members:
-                            self.user_groups[member_id] = group_id
-                            
-                    except Exception as e:
-                        logger.error(f"Error procesando grupo {group_id}: {e}")
-                        continue
-            
-            logger.info(f"Cargados {len(self.family_groups)} grupos familiares desde Google Sheets")
+            if self.pending:
+                tmp_path = f"{self.wal_path}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    for row in self.pending:
+                        f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.wal_path)
+            elif os.path.exists(self.wal_path):
+                os.remove(self.wal_path)
         except Exception as e:
-            logger.error(f"Error cargando grupos familiares: {e}")
-
-# Instancia global del manager mejorado
-bot_manager = AdvancedFinanceBotManager()
+            logger.error(f"❌ Error compactando el WAL de transacciones: {e}")
+    
+    def _recover(self):
+        """Recupera filas del WAL (y del archivo de la versión anterior) que no se enviaron.
+        
+        Devuelve True si recuperó filas.
+        """
+        if self.recovered:
+            return False
+        self.recovered = True
+        
+        rows = []
+        if os.path.exists(self.wal_path):
+            try:
+                with open(self.wal_path, encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            row = json.loads(line)
+                            # Filas de versiones anteriores, sin las columnas nuevas
+                            rows.append(row + [''] * (len(SHEET_HEADERS) - len(row)))
+                        except ValueError:
+                            # Línea truncada por una caída a mitad de escritura
+                            logger.warning(f"⚠️ Línea inválida en {self.wal_path}, se omite")
+            except Exception as e:
+                logger.error(f"❌ Error leyendo el WAL {self.wal_path}: {e}")
+        
+        legacy = []
+        if os.path.exists(LEGACY_SPOOL_PATH):
+            try:
+                with open(LEGACY_SPOOL_PATH, encoding='utf-8') as f:
+                    legacy = [row + [''] * (len(SHEET_HEADERS) - len(row)) for row in json.load(f)]
+                for row in legacy:
+                    row[RECORD_ID_COLUMN] = row[RECORD_ID_COLUMN] or new_record_id()
+                self._append_wal(legacy)
+                os.remove(LEGACY_SPOOL_PATH)
+            except Exception as e:
+                logger.error(f"❌ Error migrando {LEGACY_SPOOL_PATH} al WAL: {e}")
+        
+        rows += legacy
+        if rows:
+            self.pending = rows + self.pending
+            self.version += 1
+            self.uncertain = True
+            logger.info(f"📮 Recuperadas {len(rows)} transacciones pendientes de envío")
+        return bool(rows)
+
+# Cola global de escritura de transacciones
+append_queue = SheetAppendQueue()
+
+class AppContext:
+    """Contexto de la aplicación: construye el manager una sola vez y bajo demanda"""
+    
+    def __init__(self, timer=startup_timer, warm_start=True):
+        self.timer = timer
+        self.warm_start = warm_start
+        self.storage = storage
+        self.transactions = transaction_mirror
+        self.append_queue = append_queue
+        self._manager = None
+        self._lock = threading.Lock()
+    
+    @property
+    def manager(self):
+        """Manager de datos (se carga desde el almacenamiento en el primer acceso)"""
+        if self._manager is None:
+            with self._lock:
+                if self._manager is None:
+                    with self.timer.phase("Carga de datos del manager"):
+                        self._manager = AdvancedFinanceBotManager(warm_start=self.warm_start)
+        return self._manager
+
+# Contexto global y manager (se construyen en main)
+app_context = None
+bot_manager = None
+
+def build_app_context(warm_start=True):
+    """Conecta el almacenamiento, crea el contexto de la aplicación y publica el manager global.
+    
+    Con warm_start=False el manager se lee del almacenamiento, sin la instantánea local
+    ni la reconciliación en segundo plano (p. ej. para tareas de línea de comandos).
+    """
+    global app_context, bot_manager, storage
+    if app_context is None:
+        if spreadsheet is None:
+            with startup_timer.phase("Conexión con Google Sheets"):
+                connect_google_sheets()
+        if storage is None:
+            with startup_timer.phase("Backend de persistencia"):
+                storage = create_storage()
+        app_context = AppContext(warm_start=warm_start)
+    bot_manager = app_context.manager
+    return app_context
+
+class TransactionTotals:
+    """Totales por tipo y por categoría, cantidad y promedio, acumulados en una sola pasada.
+    
+    Recibe grupos ya agregados (tipo, categoría, suma, cantidad), así que recorrerlos
+    cuesta lo mismo venga cada grupo de una transacción o de miles.
+    """
+    
+    __slots__ = ('by_type', 'by_category', 'count', 'total')
+    
+    def __init__(self, groups=()):
+        self.by_type = defaultdict(float)
+        self.by_category = defaultdict(float)
+        self.count = 0
+        self.total = 0.0
+        for record_type, category, amount, count in groups:
+            self.by_type[record_type] += amount
+            self.by_category[category] += amount
+            self.count += count
+            self.total += amount
+    
+    @classmethod
+    def from_query(cls, totals):
+        """Desde el resultado de FinancialAnalyzer.query agrupado por ('type', 'category')"""
+        return cls((record_type, category, values['sum'], values['count'])
+                   for (record_type, category), values in totals.items())
+    
+    @property
+    def income(self):
+        return self.by_type.get('Ingreso', 0.0)
+    
+    @property
+    def expenses(self):
+        return self.by_type.get('Gasto', 0.0)
+    
+    @property
+    def debts(self):
+        return self.by_type.get('Deuda', 0.0)
+    
+    @property
+    def balance(self):
+        return self.income - self.expenses - self.debts
+    
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0
 
 class FinancialAnalyzer:
     """Clase para análisis financiero avanzado"""
     
+    # Dimensiones y agregados que acepta query(); cada dimensión lee una posición de la clave
+    # (dueño, período, tipo, categoría). 'week' cambia el período a semanas.
+    DIMENSIONS = {'user': 0, 'month': 1, 'quarter': 1, 'week': 1, 'type': 2, 'category': 3}
+    AGGREGATES = ('sum', 'count', 'min', 'max', 'avg')
+
+    @staticmethod
+    def query(user_ids=None, date_from=None, date_to=None, types=None, categories=None,
+              group_by=(), aggregates=('sum', 'count')):
+        """Consulta agregada de transacciones; todos los análisis pasan por aquí.
+        
+        Filtra por usuarios (IDs de Telegram), fechas en [date_from, date_to), tipos y
+        categorías, y agrupa por cualquier combinación de 'user', un período ('month',
+        'quarter' o 'week'), 'type' y 'category'. Devuelve {grupo: {agregado: valor}}, con
+        el grupo como tupla de los valores de group_by (vacía si no se agrupa).
+        
+        Cada filtro se aplica donde es más barato: el rango de fechas elige las
+        particiones; si abarca meses completos se responde con los totales incrementales
+        sin tocar filas y, si no, con los índices por usuario sobre las columnas. Los
+        meses archivados se suman desde el resumen mensual (completos, sin mínimo ni
+        máximo); al agrupar por semana no se incluyen, porque no tienen detalle diario.
+        """
+        unsupported = (set(group_by) - set(FinancialAnalyzer.DIMENSIONS)) | (set(aggregates) - set(FinancialAnalyzer.AGGREGATES))
+        if unsupported:
+            raise ValueError(f"Dimensión o agregado no soportado: {', '.join(sorted(unsupported))}")
+        if len({'month', 'quarter', 'week'} & set(group_by)) > 1:
+            raise ValueError("Solo se puede agrupar por un período (month, quarter o week)")
+        
+        weekly = 'week' in group_by
+        end = last_instant(date_to)
+        since = month_number(date_from) if date_from is not None else None
+        until = month_number(end) + 1 if end is not None else None
+        aligned = is_month_start(date_from) and is_month_start(date_to) and not weekly
+        
+        # Leer primero: al cargar filas nuevas se registran sus usuarios y categorías
+        if aligned:
+            sources = transaction_mirror.get_rollups(start=date_from, end=end)
+        else:
+            columns = transaction_mirror.get_columns(start=date_from, end=end)
+        archived = archive_summary.rollup()
+        
+        users = owner_keys(user_ids) if user_ids is not None else None
+        if users is not None and not users:
+            return {}
+        type_codes = None if types is None else {type_code(t) if isinstance(t, str) else int(t) for t in types}
+        category_codes = None if categories is None else {CATEGORY_VOCABULARY.lookup(c) for c in categories}
+        
+        if not aligned:
+            rows = columns.rows_for_users(users, since, until) if users is not None else columns.valid_rows()
+            if date_from is not None:
+                rows = rows[columns.epoch[rows] >= local_epoch(date_from)]
+            if date_to is not None:
+                rows = rows[columns.epoch[rows] < local_epoch(date_to)]
+            if type_codes is not None:
+                rows = rows[np.isin(columns.types[rows], list(type_codes))]
+            if category_codes is not None:
+                rows = rows[np.isin(columns.categories[rows], list(category_codes))]
+            sources = [TransactionRollup.from_columns(columns, rows, columns.weeks() if weekly else None)]
+        if weekly:
+            # Las filas ya se filtraron por fecha; el período de la clave es la semana
+            cells = TransactionRollup.collect(sources, users=users)
+        else:
+            sources.append(archived)
+            cells = TransactionRollup.collect(sources, users=users, since=since, until=until)
+        
+        decoders = {
+            'user': owner_label,
+            'month': month_label,
+            'quarter': quarter_label,
+            'week': week_label,
+            'type': lambda code: TYPE_NAMES.get(code, ''),
+            'category': lambda code: CATEGORY_VOCABULARY.values[code],
+        }
+        positions = [FinancialAnalyzer.DIMENSIONS[dimension] for dimension in group_by]
+        groups = {}
+        for key, (amount, count, low, high) in cells.items():
+            if type_codes is not None and key[2] not in type_codes:
+                continue
+            if category_codes is not None and key[3] not in category_codes:
+                continue
+            # Agrupar por nombre: las filas con y sin Usuario_ID de una persona van juntas
+            group = tuple(decoders[dimension](key[position]) for dimension, position in zip(group_by, positions))
+            entry = groups.get(group)
+            if entry is None:
+                groups[group] = [amount, count, low, high]
+            else:
+                entry[0] += amount
+                entry[1] += count
+                entry[2] = min(entry[2], low)
+                entry[3] = max(entry[3], high)
+        
+        result = {}
+        for group, (amount, count, low, high) in groups.items():
+            values = {
+                'sum': amount,
+                'count': count,
+                'min': low if low != float('inf') else None,
+                'max': high if high != float('-inf') else None,
+                'avg': amount / count if count else 0,
+            }
+            result[group] = {aggregate: values[aggregate] for aggregate in aggregates}
+        return result
+
+    @staticmethod
+    def _scope(user_id, user_ids):
+        """IDs a consultar: los indicados, el usuario solo o todos (None)"""
+        if user_ids is not None:
+            return list(user_ids)
+        return [user_id] if user_id else None
+
+    @staticmethod
+    def totals(user_ids=None, date_from=None, date_to=None, types=None):
+        """TransactionTotals de una consulta (misma semántica de filtros que query)"""
+        return TransactionTotals.from_query(FinancialAnalyzer.query(
+            user_ids=user_ids, date_from=date_from, date_to=date_to, types=types,
+            group_by=('type', 'category'), aggregates=('sum', 'count')
+        ))
+
+    @staticmethod
+    def _month_totals(user_id, user_ids, types=None):
+        month_start = datetime.datetime.now(TIMEZONE).date().replace(day=1)
+        scope = FinancialAnalyzer._scope(user_id, user_ids)
+        if pandas_analytics:
+            return pandas_analytics.totals(scope, month_start, add_months(month_start, 1), types=types)
+        return FinancialAnalyzer.totals(
+            user_ids=scope, date_from=month_start, date_to=add_months(month_start, 1), types=types
+        )
+
     @staticmethod
-    def get_monthly_summary(user_id=None):
+    def _trend_window(months, bucket):
+        """[inicio, fin) de los últimos `months` meses, con el inicio alineado al período"""
+        current_month = datetime.datetime.now(TIMEZONE).date().replace(day=1)
+        first_month = add_months(current_month, -(months - 1))
+        if bucket == 'quarter':
+            # Trimestres completos: la ventana empieza al inicio del trimestre
+            first_month = first_month.replace(month=(first_month.month - 1) // 3 * 3 + 1)
+        elif bucket == 'week':
+            first_month = week_start(first_month)
+        return first_month, add_months(current_month, 1)
+
+    @staticmethod
+    def get_monthly_summary(user_id=None, user_ids=None):
         """Genera resumen mensual detallado"""
-        if not sheet:
+        if not storage.has_table('Transacciones'):
             return None
             
         try:
-            records = sheet.get_all_records()
-            current_month = datetime.datetime.now(TIMEZONE).strftime("%Y-%m")
-            
-            monthly_data = []
-            for record in records:
-                if user_id and record.get('Usuario') != bot_manager.users.get(user_id, {}).get('username'):
-                    continue
-                    
-                date_str = record.get('Fecha', '')
-                if date_str.startswith(current_month):
-                    monthly_data.append(record)
-            
-            if not monthly_data:
+            totals = FinancialAnalyzer._month_totals(user_id, user_ids)
+            if not totals.count:
                 return None
-                
-            summary = {
-                'total_income': sum(float(r.get('Monto', 0)) for r in monthly_data if r.get('Tipo') == 'Ingreso'),
-                'total_expenses': sum(float(r.get('Monto', 0)) for r in monthly_data if r.get('Tipo') == 'Gasto'),
-                'total_debts': sum(float(r.get('Monto', 0)) for r in monthly_data if r.get('Tipo') == 'Deuda'),
-                'by_category': defaultdict(float),
-                'transaction_count': len(monthly_data),
-                'avg_transaction': 0
-            }
-            
-            for record in monthly_data:
-                category = record.get('Categoria', 'Sin categoría')
-                amount = float(record.get('Monto', 0))
-                summary['by_category'][category] += amount
-            
-            if monthly_data:
-                summary['avg_transaction'] = sum(float(r.get('Monto', 0)) for r in monthly_data) / len(monthly_data)
-            
-            summary['balance'] = summary['total_income'] - summary['total_expenses'] - summary['total_debts']
-            summary['savings_rate'] = (summary['balance'] / summary['total_income'] * 100) if summary['total_income'] > 0 else 0
             
-            return summary
+            return {
+                'total_income': totals.income,
+                'total_expenses': totals.expenses,
+                'total_debts': totals.debts,
+                'by_category': totals.by_category,
+                'transaction_count': totals.count,
+                'avg_transaction': totals.mean,
+                'balance': totals.balance,
+                'savings_rate': (totals.balance / totals.income * 100) if totals.income > 0 else 0
+            }
             
         except Exception as e:
             logger.error(f"Error en análisis mensual: {e}")
             return None
 
+    # Períodos de get_spending_trends
+    TREND_BUCKETS = ('week', 'month', 'quarter')
+
     @staticmethod
-    def get_spending_trends(user_id=None, months=6):
-        """Analiza tendencias de gasto en los últimos meses"""
-        if not sheet:
+    def get_spending_trends(user_id=None, months=6, user_ids=None, bucket='month'):
+        """Analiza tendencias de gasto en los últimos `months` meses, por semana, mes o trimestre.
+        
+        Solo se consultan los meses de la ventana (acotada por ambos lados), así que el
+        costo no depende de cuánta historia tenga el usuario.
+        """
+        if bucket not in FinancialAnalyzer.TREND_BUCKETS:
+            raise ValueError(f"Período no soportado: {bucket}")
+        if not storage.has_table('Transacciones'):
             return None
             
         try:
-            records = sheet.get_all_records()
-            trends = defaultdict(lambda: defaultdict(float))
+            scope = FinancialAnalyzer._scope(user_id, user_ids)
+            date_from, date_to = FinancialAnalyzer._trend_window(months, bucket)
+            if pandas_analytics:
+                return pandas_analytics.trends(scope, date_from, date_to, bucket)
+            totals = FinancialAnalyzer.query(
+                user_ids=scope, date_from=date_from, date_to=date_to,
+                types=['Gasto'], group_by=(bucket, 'category'), aggregates=('sum',)
+            )
             
-            for record in records:
-                if user_id and record.get('Usuario') != bot_manager.users.get(user_id, {}).get('username'):
-                    continue
-                
-                date_str = record.get('Fecha', '')
-                if date_str:
-                    try:
-                        date_obj = datetime.datetime.strptime(date_str[:10], "%Y-%m-%d")
-                        month_key = date_obj.strftime("%Y-%m")
-                        category = record.get('Categoria', 'Sin categoría')
-                        amount = float(record.get('Monto', 0))
-                        record_type = record.get('Tipo', '')
-                        
-                        if record_type == 'Gasto':
-                            trends[month_key][category] += amount
-                    except:
-                        continue
+            trends = defaultdict(lambda: defaultdict(float))
+            for (period, category), values in totals.items():
+                trends[period][category] += values['sum']
             
             return dict(trends)
             
@@ -1219,29 +3598,18 @@ class FinancialAnalyzer:
             return None
 
     @staticmethod
-    def get_budget_analysis(user_id):
+    def get_budget_analysis(user_id, user_ids=None, budgets=None):
         """Analiza el cumplimiento del presupuesto"""
-        if user_id not in bot_manager.budgets or not sheet:
+        if budgets is None:
+            budgets = bot_manager.budgets.get(user_id)
+        if budgets is None or not storage.has_table('Transacciones'):
             return None
             
         try:
-            current_month = datetime.datetime.now(TIMEZONE).strftime("%Y-%m")
-            records = sheet.get_all_records()
-            username = bot_manager.users.get(user_id, {}).get('username')
-            
-            monthly_spending = defaultdict(float)
-            
-            for record in records:
-                if (record.get('Usuario') == username and 
-                    record.get('Tipo') == 'Gasto' and 
-                    record.get('Fecha', '').startswith(current_month)):
-                    
-                    category = record.get('Categoria', 'Sin categoría')
-                    amount = float(record.get('Monto', 0))
-                    monthly_spending[category] += amount
+            monthly_spending = FinancialAnalyzer._month_totals(user_id, user_ids, types=['Gasto']).by_category
             
             budget_analysis = {}
-            for category, budget_amount in bot_manager.budgets[user_id].items():
+            for category, budget_amount in budgets.items():
                 spent = monthly_spending.get(category, 0)
                 percentage = (spent / budget_amount * 100) if budget_amount > 0 else 0
                 remaining = budget_amount - spent
@@ -1260,117 +3628,387 @@ class FinancialAnalyzer:
             logger.error(f"Error en análisis de presupuesto: {e}")
             return None
 
-# Instancia del analizador
-analyzer = FinancialAnalyzer()
+    @staticmethod
+    def get_top_categories(user_id=None, n=5, user_ids=None):
+        """Categorías con más movimiento del mes: [(categoría, total)] de mayor a menor"""
+        try:
+            if pandas_analytics:
+                month_start = datetime.datetime.now(TIMEZONE).date().replace(day=1)
+                return pandas_analytics.top_categories(
+                    FinancialAnalyzer._scope(user_id, user_ids), month_start, add_months(month_start, 1), n
+                )
+            by_category = FinancialAnalyzer._month_totals(user_id, user_ids).by_category
+            return sorted(by_category.items(), key=lambda item: item[1], reverse=True)[:n]
+        except Exception as e:
+            logger.error(f"Error en categorías principales: {e}")
+            return []
 
-def ensure_sheet_headers():
-    """Asegura que la hoja tenga los encabezados correctos"""
-    if not sheet:
-        return False
-        
-    try:
-        headers = sheet.row_values(1)
+    @staticmethod
+    def get_month_over_month(user_id=None, months=6, user_ids=None):
+        """Gasto de cada mes de la ventana y su variación: [(mes, total, % respecto al anterior o None)]"""
+        try:
+            scope = FinancialAnalyzer._scope(user_id, user_ids)
+            date_from, date_to = FinancialAnalyzer._trend_window(months, 'month')
+            if pandas_analytics:
+                return pandas_analytics.month_over_month(scope, date_from, date_to)
+            totals = FinancialAnalyzer.query(
+                user_ids=scope, date_from=date_from, date_to=date_to,
+                types=['Gasto'], group_by=('month',), aggregates=('sum',)
+            )
+            deltas = []
+            previous = None
+            for (month,), values in sorted(totals.items()):
+                change = (values['sum'] - previous) / previous * 100 if previous else None
+                deltas.append((month, values['sum'], change))
+                previous = values['sum']
+            return deltas
+        except Exception as e:
+            logger.error(f"Error en variación mensual: {e}")
+            return []
+
+    # Variantes del grupo familiar: una sola consulta sobre los totales de todos los miembros
+
+    @staticmethod
+    def get_group_monthly_summary(user_id):
+        """Resumen mensual combinado del grupo familiar del usuario"""
+        return FinancialAnalyzer.get_monthly_summary(user_ids=bot_manager.get_group_members(user_id))
+
+    @staticmethod
+    def get_group_spending_trends(user_id, months=6, bucket='month'):
+        """Tendencias de gasto combinadas del grupo familiar del usuario"""
+        return FinancialAnalyzer.get_spending_trends(months=months, user_ids=bot_manager.get_group_members(user_id), bucket=bucket)
+
+    @staticmethod
+    def get_group_budget_analysis(user_id):
+        """Presupuesto del grupo: suma los presupuestos de los miembros por categoría.
         
-        if not headers or headers != SHEET_HEADERS:
-            sheet.clear()
-            sheet.append_row(SHEET_HEADERS)
-            logger.info("📋 Encabezados de la hoja principal actualizados")
-        return True
-    except Exception as e:
-        logger.error(f"❌ Error al configurar encabezados: {e}")
-        return False
+        Si el grupo no comparte presupuestos, devuelve el análisis individual.
+        """
+        group = bot_manager.get_user_group(user_id)
+        if not group or not group.get('settings', {}).get('shared_budgets', True):
+            return FinancialAnalyzer.get_budget_analysis(user_id)
+        
+        members = bot_manager.get_group_members(user_id)
+        budgets = defaultdict(float)
+        for member_id in members:
+            for category, amount in bot_manager.budgets.get(member_id, {}).items():
+                budgets[category] += amount
+        if not budgets:
+            return None
+        return FinancialAnalyzer.get_budget_analysis(user_id, user_ids=members, budgets=dict(budgets))
 
-def ensure_all_sheet_headers():
-    """Asegura que todas las hojas tengan los encabezados correctos"""
-    success = True
+class PandasAnalytics:
+    """Motor de análisis sobre un DataFrame de transacciones (ANALYTICS_ENGINE=pandas).
     
-    # Hoja principal de transacciones
-    if not ensure_sheet_headers():
-        success = False
+    Copia las columnas del espejo a un DataFrame tipado: fecha como datetime64, dueño
+    como entero, tipo y categoría como categóricas, monto y cantidad. Los meses
+    archivados entran como una fila por total mensual con su cantidad, así los
+    resultados son los mismos que con los totales incrementales. El DataFrame se
+    reutiliza mientras el espejo devuelva las mismas columnas.
+    """
     
-    # Hoja de metas de ahorro
-    if sheet_goals:
-        try:
-            headers = sheet_goals.row_values(1)
-            goals_headers = ['Usuario_ID', 'Usuario_Nombre', 'Meta_Nombre', 'Monto_Meta', 'Monto_Ahorrado', 'Fecha_Limite', 'Fecha_Creacion', 'Estado']
-            if not headers or headers != goals_headers:
-                sheet_goals.clear()
-                sheet_goals.append_row(goals_headers)
-                logger.info("📋 Encabezados de Metas de Ahorro configurados")
-        except Exception as e:
-            logger.error(f"❌ Error en encabezados de metas: {e}")
-            success = False
+    TYPE_CATEGORIES = ['', 'Ingreso', 'Gasto', 'Deuda']
+    PERIODS = {'week': 'W-SUN', 'month': 'M', 'quarter': 'Q'}
+    MAX_FRAMES = 8
     
-    # Hoja de presupuestos
-    if sheet_budgets:
-        try:
-            headers = sheet_budgets.row_values(1)
-            budget_headers = ['Usuario_ID', 'Usuario_Nombre', 'Categoria', 'Presupuesto', 'Fecha_Creacion', 'Estado']
-            if not headers or headers != budget_headers:
-                sheet_budgets.clear()
-                sheet_budgets.append_row(budget_headers)
-                logger.info("📋 Encabezados de Presupuestos configurados")
-        except Exception as e:
-            logger.error(f"❌ Error en encabezados de presupuestos: {e}")
-            success = False
+    def __init__(self):
+        self._frames = {}  # {(inicio, fin): (columnas, resumen archivado, DataFrame)}
+        self._lock = threading.Lock()
+    
+    def frame(self, start=None, end=None):
+        """DataFrame de las particiones que cubren el rango, más los meses archivados"""
+        columns = transaction_mirror.get_columns(start=start, end=last_instant(end))
+        archived = archive_summary.rollup()
+        key = (start, end)
+        with self._lock:
+            cached = self._frames.get(key)
+            if cached and cached[0] is columns and cached[1] is archived:
+                return cached[2]
+        frame = self._build(columns, archived)
+        with self._lock:
+            if len(self._frames) >= self.MAX_FRAMES:
+                self._frames.clear()
+            self._frames[key] = (columns, archived, frame)
+        return frame
+    
+    @classmethod
+    def _build(cls, columns, archived):
+        type_names = np.array([TYPE_NAMES.get(code, '') for code in range(256)], dtype=object)
+        rows = columns.valid_rows()
+        
+        cells = [
+            (owner, month, record_type, category, amount, count)
+            for (owner, month), groups in archived.cells.items()
+            for (record_type, category), (amount, count, _, _) in groups.items()
+        ]
+        owners, months, types, categories, amounts, counts = (
+            np.array(values) for values in zip(*cells)
+        ) if cells else [np.empty(0, dtype=np.int64)] * 6
+        
+        # Las categorías se toman después de leer todo: así incluyen las recién registradas
+        category_names = list(CATEGORY_VOCABULARY.values)
+        return pd.DataFrame({
+            'fecha': np.concatenate([columns.epoch[rows].astype('datetime64[s]'),
+                                     months.astype('datetime64[M]').astype('datetime64[s]')]),
+            'owner': np.concatenate([columns.owners[rows], owners.astype(np.int64)]),
+            'tipo': pd.Categorical(np.concatenate([type_names[columns.types[rows]], type_names[types.astype(np.int64)]]),
+                                   categories=cls.TYPE_CATEGORIES),
+            'categoria': pd.Categorical.from_codes(
+                np.concatenate([columns.categories[rows], categories.astype(np.int32)]), category_names),
+            'monto': np.concatenate([columns.amount[rows], amounts.astype(np.float64)]),
+            'cantidad': np.concatenate([np.ones(len(rows), dtype=np.int64), counts.astype(np.int64)]),
+            'archivado': np.concatenate([np.zeros(len(rows), dtype=bool), np.ones(len(cells), dtype=bool)]),
+        })
+    
+    def select(self, user_ids, start, end, types=None, archived=True):
+        """Filas de esos usuarios con fecha en [start, end) (y de esos tipos, si se indican)"""
+        frame = self.frame(start, end)
+        mask = np.ones(len(frame), dtype=bool)
+        if user_ids is not None:
+            mask &= frame['owner'].isin(list(owner_keys(user_ids))).to_numpy()
+        if start is not None:
+            mask &= (frame['fecha'] >= pd.Timestamp(start)).to_numpy()
+        if end is not None:
+            mask &= (frame['fecha'] < pd.Timestamp(end)).to_numpy()
+        if types is not None:
+            mask &= frame['tipo'].isin([TYPE_NAMES[type_code(t)] for t in types]).to_numpy()
+        if not archived:
+            mask &= ~frame['archivado'].to_numpy()
+        return frame[mask]
+    
+    def totals(self, user_ids, start, end, types=None):
+        """TransactionTotals de un groupby por tipo y categoría"""
+        grouped = self.select(user_ids, start, end, types).groupby(['tipo', 'categoria'], observed=True)[['monto', 'cantidad']].sum()
+        return TransactionTotals(
+            (record_type, category, float(amount), int(count))
+            for (record_type, category), amount, count in grouped.itertuples()
+        )
     
-    # Hoja de usuarios
-    if sheet_users:
-        try:
-            headers = sheet_users.row_values(1)
-            user_headers = ['Usuario_ID', 'Usuario_Nombre', 'Fecha_Registro', 'Ultima_Actividad', 'Dia_Pago', 'Fecha_Pago_Completa', 'Ingreso_Mensual', 'Configuraciones']
-            if not headers or headers != user_headers:
-                sheet_users.clear()
-                sheet_users.append_row(user_headers)
-                logger.info("📋 Encabezados de Usuarios configurados")
-        except Exception as e:
-            logger.error(f"❌ Error en encabezados de usuarios: {e}")
-            success = False
+    def trends(self, user_ids, start, end, bucket):
+        """Gasto por período y categoría: {período: {categoría: total}}, como get_spending_trends"""
+        # Los meses archivados no tienen detalle diario: no se reparten en semanas
+        data = self.select(user_ids, start, end, types=['Gasto'], archived=bucket != 'week')
+        periods = data['fecha'].dt.to_period(self.PERIODS[bucket])
+        grouped = data.groupby([periods, 'categoria'], observed=True)['monto'].sum()
+        trends = defaultdict(dict)
+        for (period, category), amount in grouped.items():
+            trends[self._period_label(period, bucket)][category] = float(amount)
+        return dict(trends)
     
-    # Hoja de categorías personalizadas
-    if sheet_categories:
-        try:
-            headers = sheet_categories.row_values(1)
-            category_headers = ['Usuario_ID', 'Tipo_Registro', 'Categoria_Personalizada', 'Fecha_Creacion']
-            if not headers or headers != category_headers:
-                sheet_categories.clear()
-                sheet_categories.append_row(category_headers)
-                logger.info("📋 Encabezados de Categorías Personalizadas configurados")
-        except Exception as e:
-            logger.error(f"❌ Error en encabezados de categorías: {e}")
-            success = False
+    @staticmethod
+    def _period_label(period, bucket):
+        if bucket == 'week':
+            return period.start_time.strftime("%Y-%m-%d")
+        if bucket == 'quarter':
+            return f"{period.year}-T{period.quarter}"
+        return period.strftime("%Y-%m")
+    
+    def top_categories(self, user_ids, start, end, n):
+        by_category = self.select(user_ids, start, end).groupby('categoria', observed=True)['monto'].sum()
+        return [(category, float(amount)) for category, amount in by_category.nlargest(n).items()]
+    
+    def month_over_month(self, user_ids, start, end):
+        data = self.select(user_ids, start, end, types=['Gasto'])
+        monthly = data.groupby(data['fecha'].dt.to_period('M'))['monto'].sum().sort_index()
+        changes = monthly.pct_change() * 100
+        return [
+            (period.strftime("%Y-%m"), float(amount), None if pd.isna(change) or np.isinf(change) else float(change))
+            for (period, amount), change in zip(monthly.items(), changes)
+        ]
+
+# Motor pandas (solo si se eligió con ANALYTICS_ENGINE)
+pandas_analytics = PandasAnalytics() if ANALYTICS_ENGINE == 'pandas' else None
+
+# Instancia del analizador
+analyzer = FinancialAnalyzer()
+
+# Título del gráfico de tendencias según el período de get_spending_trends
+TREND_TITLES = {'week': "Gasto por semana", 'month': "Gasto por mes", 'quarter': "Gasto por trimestre"}
+
+# Vistas de tendencias: callback -> (período, meses de la ventana, texto del botón)
+TREND_VIEWS = {
+    'show_trends_week': ('week', 2, "📅 Por semana"),
+    'show_trends': ('month', 6, "🗓️ Por mes"),
+    'show_trends_quarter': ('quarter', 12, "📆 Por trimestre"),
+}
+
+def trend_period_name(period, bucket):
+    """Nombre legible de un período de get_spending_trends"""
+    if bucket == 'week':
+        return f"Semana del {datetime.datetime.strptime(period, '%Y-%m-%d'):%d/%m/%Y}"
+    if bucket == 'quarter':
+        year, quarter = period.split('-')
+        return f"{quarter} {year}"
+    return datetime.datetime.strptime(period, "%Y-%m").strftime("%B %Y")
+
+def trend_view_buttons(bucket):
+    """Botones para cambiar de período en la vista de tendencias"""
+    return [InlineKeyboardButton(label, callback_data=callback)
+            for callback, (view_bucket, _, label) in TREND_VIEWS.items() if view_bucket != bucket]
+
+def format_spending_trends(trends, bucket):
+    """Texto de la vista de tendencias: los últimos períodos con sus 3 categorías principales"""
+    msg = f"📈 **Análisis de Tendencias de Gasto** ({TREND_TITLES[bucket].lower()})\n\n"
+    
+    for period in sorted(trends.keys(), reverse=True)[:8]:
+        period_data = trends[period]
+        total_period = sum(period_data.values())
+        msg += f"📅 **{trend_period_name(period, bucket)}**: ${total_period:,.0f}\n"
+        
+        # Top 3 categorías del período
+        top_categories = sorted(period_data.items(), key=lambda x: x[1], reverse=True)[:3]
+        for cat, amount in top_categories:
+            msg += f"   • {cat}: ${amount:,.0f}\n"
+        msg += "\n"
+    return msg
+
+def render_chart(kind, data, title=None):
+    """Dibuja un gráfico y devuelve el PNG (corre en los procesos de ChartService)"""
+    figure = mpl_figure.Figure(figsize=(8, 4.5), dpi=100)
+    ax = figure.add_subplot()
+    labels = [row[0] for row in data]
+    
+    if kind == 'trend':
+        ax.plot(labels, [row[1] for row in data], marker='o', color='#1f77b4')
+        ax.set_title(title or TREND_TITLES['month'])
+        ax.yaxis.set_major_formatter(lambda value, _: f"${value:,.0f}")
+        ax.grid(axis='y', alpha=0.3)
+    elif kind == 'categories':
+        ax.pie([row[1] for row in data], labels=labels, autopct='%1.0f%%', startangle=90)
+        ax.set_title(title or "Categorías del mes")
+        ax.axis('equal')
+    elif kind == 'budget':
+        colors = {'over': '#d62728', 'warning': '#ff7f0e', 'good': '#2ca02c'}
+        ax.barh(labels, [row[1] for row in data], color='#dddddd', label="Presupuesto")
+        ax.barh(labels, [row[2] for row in data], height=0.5,
+                color=[colors[row[3]] for row in data], label="Gastado")
+        ax.set_title(title or "Presupuestos del mes")
+        ax.xaxis.set_major_formatter(lambda value, _: f"${value:,.0f}")
+        ax.legend(loc='lower right')
+    else:
+        raise ValueError(f"Gráfico desconocido: {kind}")
+    
+    buffer = BytesIO()
+    figure.savefig(buffer, format='png', bbox_inches='tight')
+    return buffer.getvalue()
+
+class ChartService:
+    """Gráficos PNG dibujados fuera del hilo del dispatcher, con caché.
+    
+    Los handlers solo encolan el gráfico: se dibuja en un pool de procesos y la
+    foto se envía al terminar, sin frenar la atención de otros mensajes. Cada PNG
+    queda en caché con la clave (usuario, tipo de gráfico, título, versión de los
+    datos), donde la versión es el SHA-1 de los datos dibujados, junto con el file_id
+    que devuelve Telegram: ver de nuevo el mismo gráfico no dibuja ni sube nada.
+    
+    Los procesos se crean con spawn: un fork del proceso del bot copiaría locks
+    tomados por sus hilos (cola de escritura, reconciliación, programador).
+    """
+    
+    def __init__(self, workers=CHART_WORKERS, cache_size=CHART_CACHE_SIZE):
+        self.workers = workers
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # {clave: [png, file_id]}
+        self._pending = {}           # {clave: Future} para no dibujar dos veces lo mismo
+        self._pool = None
+        self._senders = None         # hilos que suben las fotos a Telegram
+        self._lock = threading.Lock()
+    
+    @property
+    def enabled(self):
+        return self.workers > 0
+    
+    def start(self):
+        """Crea el pool de procesos y los hilos de envío (main lo llama antes de iniciar otros hilos)"""
+        with self._lock:
+            if self.enabled and self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+                self._senders = ThreadPoolExecutor(max_workers=self.workers,
+                                                   thread_name_prefix="finbot-charts")
     
-    # Hoja de fechas de pago
-    if sheet_paydays:
+    @staticmethod
+    def version(data):
+        """Versión estable de los datos de un gráfico (hash() cambia entre procesos)"""
+        return hashlib.sha1(pickle.dumps(data)).hexdigest()
+    
+    def render(self, user_id, kind, data, title=None):
+        """Future con la entrada de caché [png, file_id] del gráfico"""
+        self.start()
+        key = (user_id, kind, title, self.version(data))
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+                future = Future()
+                future.set_result(entry)
+                return future
+            future = self._pending.get(key)
+            if future is None:
+                rendered = self._pool.submit(render_chart, kind, data, title)
+                future = Future()
+                self._pending[key] = future
+                rendered.add_done_callback(lambda done: self._store(key, done, future))
+        return future
+    
+    def _store(self, key, rendered, future):
         try:
-            headers = sheet_paydays.row_values(1)
-            payday_headers = ['Usuario_ID', 'Usuario_Nombre', 'Dia_Pago', 'Mes_Pago', 'Proxima_Fecha', 'Ultima_Actualizacion']
-            if not headers or headers != payday_headers:
-                sheet_paydays.clear()
-                sheet_paydays.append_row(payday_headers)
-                logger.info("📋 Encabezados de Fechas de Pago configurados")
+            entry = [rendered.result(), None]
         except Exception as e:
-            logger.error(f"❌ Error en encabezados de fechas de pago: {e}")
-            success = False
+            with self._lock:
+                self._pending.pop(key, None)
+            future.set_exception(e)
+            return
+        with self._lock:
+            self._pending.pop(key, None)
+            self._cache[key] = entry
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        future.set_result(entry)
+    
+    def send(self, message, user_id, kind, data, caption=None, title=None):
+        """Responde al mensaje con el gráfico cuando esté listo (sin esperar el dibujo)"""
+        if not self.enabled or not data:
+            return
+        
+        def deliver(future):
+            try:
+                entry = future.result()
+                sent = message.reply_photo(photo=entry[1] or BytesIO(entry[0]), caption=caption)
+                if entry[1] is None and sent and sent.photo:
+                    entry[1] = sent.photo[-1].file_id
+            except Exception as e:
+                logger.error(f"❌ Error enviando gráfico {kind}: {e}")
+        
+        # El envío siempre va a los hilos de envío, también con el gráfico ya en caché:
+        # add_done_callback sobre un Future terminado correría en el hilo del dispatcher
+        self.render(user_id, kind, data, title).add_done_callback(
+            lambda future: self._senders.submit(deliver, future))
     
-    # Hoja de grupos familiares
-    if sheet_family_groups:
-        try:
-            headers = sheet_family_groups.row_values(1)
-            group_headers = ['Grupo_ID', 'Nombre_Grupo', 'Codigo_Invitacion', 'Creador_ID', 'Miembros', 'Fecha_Creacion', 'Estado', 'Configuraciones']
-            if not headers or headers != group_headers:
-                sheet_family_groups.clear()
-                sheet_family_groups.append_row(group_headers)
-                logger.info("📋 Encabezados de Grupos Familiares configurados")
-        except Exception as e:
-            logger.error(f"❌ Error en encabezados de grupos familiares: {e}")
-            success = False
+    def send_trends(self, message, user_id, trends, bucket='month'):
+        """Línea del gasto total por período, a partir de get_spending_trends"""
+        data = tuple((period, sum(trends[period].values())) for period in sorted(trends))
+        self.send(message, user_id, 'trend', data, title=TREND_TITLES[bucket])
+    
+    def send_categories(self, message, user_id, top_categories):
+        """Torta de las categorías principales, a partir de get_top_categories"""
+        data = tuple((category, amount) for category, amount in top_categories if amount > 0)
+        self.send(message, user_id, 'categories', data)
+    
+    def send_budget(self, message, user_id, budget_analysis):
+        """Barras de gastado contra presupuesto, a partir de get_budget_analysis"""
+        data = tuple((category, values['budget'], values['spent'], values['status'])
+                     for category, values in sorted((budget_analysis or {}).items()))
+        self.send(message, user_id, 'budget', data)
     
-    return success
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._senders.shutdown(wait=False)
+
+# Servicio de gráficos
+chart_service = ChartService()
 
-# Instancias globales
-bot_manager = AdvancedFinanceBotManager()
-analyzer = FinancialAnalyzer()
 
 def get_user_display_name(user_id, context):
     """Obtiene el nombre de display del usuario"""
@@ -1387,17 +4025,15 @@ def get_user_display_name(user_id, context):
         return f"Usuario{user_id}"
 
 def add_record_to_sheet(user_id, record_type, amount, category, description="", due_date="", status="Completado", context=None):
-    """Añade un registro a la hoja de Google Sheets"""
-    if not sheet:
-        logger.error("❌ No hay conexión con Google Sheets")
-        return False
-        
+    """Añade un registro a la hoja de Google Sheets (primero al WAL local, luego en lote)"""
     try:
         now = datetime.datetime.now(TIMEZONE).strftime("%Y-%m-%d %H:%M")
         username = get_user_display_name(user_id, context) if context else f"Usuario{user_id}"
         
-        row = [now, username, record_type, amount, category, description, due_date, status]
-        sheet.append_row(row)
+        row = [now, username, record_type, amount, category, description, due_date, status, new_record_id(), user_id]
+        # Durable en disco aunque Google Sheets no responda; el espejo la muestra desde la cola
+        append_queue.enqueue(row)
+        transaction_mirror.record_local(row)
         
         # Actualizar última actividad del usuario
         if user_id in bot_manager.users:
@@ -1728,48 +4364,35 @@ def receive_invitation_code(update: Update, context: CallbackContext):
         update.message.reply_text(f"❌ {message}\n\nInténtalo de nuevo o contacta a quien te invitó:")
         return TYPING_INVITATION_CODE
 
-def show_spending_trends_callback(query, context):
-    """Muestra análisis de tendencias de gasto (versión para callbacks)"""
+def show_spending_trends_callback(query, context, view="show_trends"):
+    """Muestra análisis de tendencias de gasto por semana, mes o trimestre (versión para callbacks)"""
     user_id = query.from_user.id
+    bucket, months, _ = TREND_VIEWS[view]
     
     try:
-        trends = analyzer.get_spending_trends(user_id, months=6)
+        trends = analyzer.get_spending_trends(user_id, months=months, bucket=bucket)
         
         if not trends:
             query.edit_message_text("📈 No hay suficientes datos para mostrar tendencias.")
             return CHOOSING
         
-        msg = "📈 **Análisis de Tendencias de Gasto**\n\n"
-        
-        # Calcular tendencias por mes
-        sorted_months = sorted(trends.keys(), reverse=True)[:6]
+        msg = format_spending_trends(trends, bucket)
         
-        for month in sorted_months:
-            month_data = trends[month]
-            total_month = sum(month_data.values())
-            
-            month_name = datetime.datetime.strptime(month, "%Y-%m").strftime("%B %Y")
-            msg += f"📅 **{month_name}**: ${total_month:,.0f}\n"
-            
-            # Top 3 categorías del mes
-            top_categories = sorted(month_data.items(), key=lambda x: x[1], reverse=True)[:3]
-            for cat, amount in top_categories:
-                msg += f"   • {cat}: ${amount:,.0f}\n"
-            msg += "\n"
+        query.edit_message_text(msg, reply_markup=InlineKeyboardMarkup([trend_view_buttons(bucket)]))
+        chart_service.send_trends(query.message, user_id, trends, bucket)
         
-        query.edit_message_text(msg)
+        if bucket != 'month':
+            return CHOOSING
         
         # Mostrar análisis de tendencias
-        if len(sorted_months) >= 2:
-            current_month_total = sum(trends[sorted_months[0]].values())
-            previous_month_total = sum(trends[sorted_months[1]].values())
+        month_over_month = analyzer.get_month_over_month(user_id, months=6)
+        if len(month_over_month) >= 2 and month_over_month[-1][2] is not None:
+            change = month_over_month[-1][2]
             
-            if current_month_total > previous_month_total:
-                change = ((current_month_total - previous_month_total) / previous_month_total) * 100
+            if change > 0:
                 trend_msg = f"📊 **Tendencia**: Tus gastos aumentaron {change:.1f}% respecto al mes anterior."
             else:
-                change = ((previous_month_total - current_month_total) / previous_month_total) * 100
-                trend_msg = f"📊 **Tendencia**: Tus gastos disminuyeron {change:.1f}% respecto al mes anterior. ¡Bien!"
+                trend_msg = f"📊 **Tendencia**: Tus gastos disminuyeron {-change:.1f}% respecto al mes anterior. ¡Bien!"
             
             keyboard = [
                 [InlineKeyboardButton("🏠 Volver al Menú", callback_data="back_to_menu")]
@@ -1810,40 +4433,34 @@ Controla tus gastos con presupuestos personalizados:
 
 def show_enhanced_reminders_callback(query, context):
     """Recordatorios mejorados con más opciones (versión para callbacks)"""
-    if not sheet:
+    if not storage.has_table('Transacciones'):
         query.edit_message_text("❌ Error: No se puede acceder a la base de datos.")
         return CHOOSING
     
     try:
-        records = sheet.get_all_records()
         pending_debts = []
         upcoming_paydays = []
         
         today = datetime.datetime.now(TIMEZONE)
         user_id = query.from_user.id
-        username = bot_manager.users.get(user_id, {}).get('username')
         
-        # Deudas pendientes
-        for record in records:
-            if (record.get('Tipo') == 'Deuda' and 
-                record.get('Estado_Pago') == 'Pendiente' and
-                record.get('Usuario') == username):
-                
-                due_date_str = record.get('Fecha_Vencimiento', '')
-                if due_date_str:
-                    try:
-                        due_date = datetime.datetime.strptime(due_date_str, "%d/%m/%Y")
-                        days_until_due = (due_date - today).days
-                        
-                        if days_until_due <= 15:  # Mostrar deudas con hasta 15 días de anticipación
-                            pending_debts.append({
-                                'monto': record.get('Monto', 0),
-                                'categoria': record.get('Categoria', 'N/A'),
-                                'vencimiento': due_date_str,
-                                'dias': days_until_due
-                            })
-                    except ValueError:
-                        continue
+        # Deudas pendientes (del índice por usuario, tipo y estado)
+        for record in transaction_mirror.get_pending_debts(user_id):
+            due_date_str = record.get('Fecha_Vencimiento', '')
+            if due_date_str:
+                try:
+                    due_date = datetime.datetime.strptime(due_date_str, "%d/%m/%Y")
+                    days_until_due = (due_date - today).days
+                    
+                    if days_until_due <= 15:  # Mostrar deudas con hasta 15 días de anticipación
+                        pending_debts.append({
+                            'monto': record.get('Monto', 0),
+                            'categoria': record.get('Categoria', 'N/A'),
+                            'vencimiento': due_date_str,
+                            'dias': days_until_due
+                        })
+                except ValueError:
+                    continue
         
         # Días de pago próximos - Mejorado para fechas completas
         if user_id in bot_manager.payday_dates:
@@ -1936,18 +4553,18 @@ def export_user_data_callback(query, context):
     """Exporta los datos del usuario (versión para callbacks)"""
     user_id = query.from_user.id
     
-    if not sheet:
+    if not storage.has_table('Transacciones'):
         query.edit_message_text("❌ Error: No se puede acceder a la base de datos.")
         return CHOOSING
     
     try:
         username = bot_manager.users.get(user_id, {}).get('username')
-        records = sheet.get_all_records()
         
         # Filtrar registros del usuario
-        user_records = [r for r in records if r.get('Usuario') == username]
+        user_records = transaction_mirror.get_user_records(user_id)
+        archived = archive_summary.get_rows(user_id, username)
         
-        if not user_records:
+        if not user_records and not archived:
             query.edit_message_text("📤 No tienes datos para exportar.")
             return CHOOSING
         
@@ -1956,24 +4573,23 @@ def export_user_data_callback(query, context):
             'usuario': username,
             'fecha_exportacion': datetime.datetime.now(TIMEZONE).strftime("%Y-%m-%d %H:%M"),
             'total_registros': len(user_records),
-            'registros': user_records
+            'registros': user_records,
+            'resumen_archivado': archived
         }
         
-        # Generar estadísticas
-        total_ingresos = sum(float(r.get('Monto', 0)) for r in user_records if r.get('Tipo') == 'Ingreso')
-        total_gastos = sum(float(r.get('Monto', 0)) for r in user_records if r.get('Tipo') == 'Gasto')
-        total_deudas = sum(float(r.get('Monto', 0)) for r in user_records if r.get('Tipo') == 'Deuda')
+        # Generar estadísticas (incluye los meses archivados)
+        totals = analyzer.totals(user_ids=[user_id])
         
         msg = f"""
 📤 **Exportación de Datos Completada**
 
 👤 **Usuario**: {username}
 📊 **Resumen**:
-• Total de registros: {len(user_records)}
-• Ingresos totales: ${total_ingresos:,.0f}
-• Gastos totales: ${total_gastos:,.0f}
-• Deudas totales: ${total_deudas:,.0f}
-• Balance general: ${total_ingresos - total_gastos - total_deudas:,.0f}
+• Total de registros: {totals.count}
+• Ingresos totales: ${totals.income:,.0f}
+• Gastos totales: ${totals.expenses:,.0f}
+• Deudas totales: ${totals.debts:,.0f}
+• Balance general: ${totals.balance:,.0f}
 
 📋 **Datos disponibles en Google Sheets**
 🔗 Puedes acceder a tu hoja completa en Google Sheets para análisis detallado.
@@ -2472,8 +5088,9 @@ def show_complete_analysis(update: Update, context: CallbackContext):
 📈 **Análisis por Categorías:**
 """
         
-        if monthly_summary['by_category']:
-            for category, amount in sorted(monthly_summary['by_category'].items(), key=lambda x: x[1], reverse=True)[:5]:
+        top_categories = analyzer.get_top_categories(user_id) if monthly_summary['by_category'] else []
+        if top_categories:
+            for category, amount in top_categories:
                 percentage = (amount / monthly_summary['total_expenses']) * 100 if monthly_summary['total_expenses'] > 0 else 0
                 msg += f"• {category}: ${amount:,.0f} ({percentage:.1f}%)\n"
         
@@ -2486,6 +5103,7 @@ def show_complete_analysis(update: Update, context: CallbackContext):
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         update.message.reply_text(msg, reply_markup=reply_markup)
+        chart_service.send_categories(update.message, user_id, top_categories)
         
     except Exception as e:
         logger.error(f"Error en análisis completo: {e}")
@@ -2497,16 +5115,13 @@ def show_enhanced_history(update: Update, context: CallbackContext):
     """Muestra historial mejorado de transacciones"""
     user_id = update.effective_user.id
     
-    if not sheet:
+    if not storage.has_table('Transacciones'):
         update.message.reply_text("❌ Error: No se puede acceder a la base de datos.")
         return CHOOSING
     
     try:
-        username = bot_manager.users.get(user_id, {}).get('username')
-        records = sheet.get_all_records()
-        
         # Filtrar registros del usuario (últimos 20)
-        user_records = [r for r in records if r.get('Usuario') == username][-20:]
+        user_records = transaction_mirror.get_user_records(user_id, last=20)
         
         if not user_records:
             update.message.reply_text("📜 No tienes transacciones registradas aún.")
@@ -2574,25 +5189,10 @@ def show_spending_trends(update: Update, context: CallbackContext):
             update.message.reply_text("📈 No hay suficientes datos para mostrar tendencias.")
             return CHOOSING
         
-        msg = "📈 **Análisis de Tendencias de Gasto**\n\n"
-        
-        # Calcular tendencias por mes
-        sorted_months = sorted(trends.keys(), reverse=True)[:6]
-        
-        for month in sorted_months:
-            month_data = trends[month]
-            total_month = sum(month_data.values())
-            
-            month_name = datetime.datetime.strptime(month, "%Y-%m").strftime("%B %Y")
-            msg += f"📅 **{month_name}**: ${total_month:,.0f}\n"
-            
-            # Top 3 categorías del mes
-            top_categories = sorted(month_data.items(), key=lambda x: x[1], reverse=True)[:3]
-            for cat, amount in top_categories:
-                msg += f"   • {cat}: ${amount:,.0f}\n"
-            msg += "\n"
+        msg = format_spending_trends(trends, 'month')
         
         keyboard = [
+            trend_view_buttons('month'),
             [InlineKeyboardButton("📊 Análisis Completo", callback_data="complete_analysis")],
             [InlineKeyboardButton("🤖 IA Financiera", callback_data="ai_assistant")],
             [InlineKeyboardButton("🏠 Volver al Menú", callback_data="back_to_menu")]
@@ -2600,6 +5200,7 @@ def show_spending_trends(update: Update, context: CallbackContext):
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         update.message.reply_text(msg, reply_markup=reply_markup)
+        chart_service.send_trends(update.message, user_id, trends)
         
     except Exception as e:
         logger.error(f"Error en tendencias: {e}")
@@ -2709,6 +5310,7 @@ def show_user_budgets(query, context):
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     query.edit_message_text(msg, reply_markup=reply_markup)
+    chart_service.send_budget(query.message, user_id, analyzer.get_budget_analysis(user_id))
     return CHOOSING
 
 def show_complete_analysis_callback(query, context):
@@ -2735,12 +5337,14 @@ def show_complete_analysis_callback(query, context):
 📈 **Top Categorías:**
 """
         
-        if monthly_summary['by_category']:
-            for category, amount in sorted(monthly_summary['by_category'].items(), key=lambda x: x[1], reverse=True)[:5]:
+        top_categories = analyzer.get_top_categories(user_id) if monthly_summary['by_category'] else []
+        if top_categories:
+            for category, amount in top_categories:
                 percentage = (amount / monthly_summary['total_expenses']) * 100 if monthly_summary['total_expenses'] > 0 else 0
                 msg += f"• {category}: ${amount:,.0f} ({percentage:.1f}%)\n"
         
         query.edit_message_text(msg)
+        chart_service.send_categories(query.message, user_id, top_categories)
         
     except Exception as e:
         logger.error(f"Error en análisis completo callback: {e}")
@@ -2748,6 +5352,61 @@ def show_complete_analysis_callback(query, context):
     
     return CHOOSING
 
+def show_group_analysis_callback(query, context):
+    """Análisis combinado del grupo familiar (resumen, presupuestos y tendencias)"""
+    user_id = query.from_user.id
+    group = bot_manager.get_user_group(user_id)
+    
+    if not group:
+        query.edit_message_text("👤 No perteneces a un grupo familiar. Créalo o únete desde Gestión Familiar.")
+        return CHOOSING
+    
+    try:
+        monthly_summary = analyzer.get_group_monthly_summary(user_id)
+        
+        if not monthly_summary:
+            query.edit_message_text("📊 El grupo aún no tiene transacciones este mes.")
+            return CHOOSING
+        
+        msg = f"""
+👨‍👩‍👧‍👦 **Análisis del Grupo: {group['name']}**
+📅 **{datetime.datetime.now(TIMEZONE).strftime('%B %Y')}**
+👥 **Miembros:** {', '.join(group['member_usernames'])}
+
+💰 **Resumen Conjunto:**
+• Ingresos: ${monthly_summary['total_income']:,.0f}
+• Gastos: ${monthly_summary['total_expenses']:,.0f}
+• Deudas: ${monthly_summary['total_debts']:,.0f}
+• Balance: ${monthly_summary['balance']:,.0f}
+• Tasa de Ahorro: {monthly_summary['savings_rate']:.1f}%
+
+📈 **Top Categorías:**
+"""
+        
+        for category, amount in analyzer.get_top_categories(user_ids=bot_manager.get_group_members(user_id)):
+            msg += f"• {category}: ${amount:,.0f}\n"
+        
+        budget_analysis = analyzer.get_group_budget_analysis(user_id)
+        if budget_analysis:
+            msg += "\n💡 **Presupuestos del Grupo:**\n"
+            for category, data in budget_analysis.items():
+                emoji = "🔴" if data['status'] == 'over' else "🟡" if data['status'] == 'warning' else "🟢"
+                msg += f"{emoji} {category}: ${data['spent']:,.0f} / ${data['budget']:,.0f} ({data['percentage']:.0f}%)\n"
+        
+        trends = analyzer.get_group_spending_trends(user_id, months=3)
+        if trends:
+            msg += "\n📆 **Gasto por Mes:**\n"
+            for month in sorted(trends.keys(), reverse=True):
+                msg += f"• {month}: ${sum(trends[month].values()):,.0f}\n"
+        
+        query.edit_message_text(msg)
+        
+    except Exception as e:
+        logger.error(f"Error en análisis del grupo: {e}")
+        query.edit_message_text("❌ Error al generar el análisis del grupo.")
+    
+    return CHOOSING
+
 def show_advanced_settings(update: Update, context: CallbackContext):
     """Configuración avanzada del bot con gestión familiar"""
     keyboard = [
@@ -2901,8 +5560,11 @@ def button_callback(update: Update, context: CallbackContext):
         elif data == "complete_analysis":
             return show_complete_analysis_callback(query, context)
         
-        elif data == "show_trends":
-            return show_spending_trends_callback(query, context)
+        elif data == "group_analysis":
+            return show_group_analysis_callback(query, context)
+        
+        elif data in TREND_VIEWS:
+            return show_spending_trends_callback(query, context, data)
         
         elif data == "export_data":
             return export_user_data_callback(query, context)
@@ -2943,6 +5605,7 @@ def show_family_management(query, context):
         keyboard = [
             [InlineKeyboardButton("📋 Ver Código de Invitación", callback_data="show_invitation_code")],
             [InlineKeyboardButton("👥 Ver Miembros", callback_data="show_group_members")],
+            [InlineKeyboardButton("📊 Análisis del Grupo", callback_data="group_analysis")],
             [InlineKeyboardButton("🏠 Volver", callback_data="back_to_menu")]
         ]
     else:
@@ -3009,6 +5672,17 @@ def show_quick_stats(update: Update, context: CallbackContext):
         logger.error(f"Error in quick stats: {e}")
         update.message.reply_text("❌ Error al obtener estadísticas.")
 
+def resync_transactions(update: Update, context: CallbackContext):
+    """Comando /resync - Vuelve a leer las particiones ya cargadas (solo administradores)"""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        logger.warning(f"⚠️ /resync rechazado para el usuario {update.effective_user.id}")
+        update.message.reply_text("⛔ Este comando es solo para administradores.")
+        return
+    if transaction_mirror.resync():
+        update.message.reply_text(f"🔄 Datos sincronizados: {transaction_mirror.row_count()} transacciones.")
+    else:
+        update.message.reply_text("❌ No se pudo sincronizar con Google Sheets.")
+
 def schedule_payday_reminders():
     """Programa los recordatorios de pago diarios"""
     import schedule
@@ -3030,6 +5704,179 @@ def send_payday_reminders():
     except Exception as e:
         logger.error(f"Error enviando recordatorios de pago: {e}")
 
+def export_storage_to_sheets():
+    """Copia la base SQLite a Google Sheets como respaldo consultable"""
+    if not isinstance(storage, SQLiteStorage) or not sheet:
+        return
+    try:
+        storage.export_to(SheetsStorage())
+        logger.info("📤 Exportación a Google Sheets completada")
+    except Exception as e:
+        logger.error(f"❌ Error exportando a Google Sheets: {e}")
+
+def schedule_sheets_export():
+    """Programa la exportación diaria a Google Sheets cuando se usa SQLite"""
+    if isinstance(storage, SQLiteStorage) and SHEETS_EXPORT_TIME:
+        schedule.every().day.at(SHEETS_EXPORT_TIME).do(export_storage_to_sheets)
+        logger.info(f"Exportación a Google Sheets programada a las {SHEETS_EXPORT_TIME}")
+
+def compact_transactions(now=None):
+    """Mueve al archivo las transacciones más antiguas que el horizonte y actualiza Resumen_Mensual"""
+    if ARCHIVE_AFTER_MONTHS <= 0 or not storage.has_table('Archivo_Transacciones'):
+        return 0
+    
+    now = now or datetime.datetime.now(TIMEZONE)
+    cutoff = now.replace(day=1)
+    for _ in range(ARCHIVE_AFTER_MONTHS):
+        cutoff = (cutoff - datetime.timedelta(days=1)).replace(day=1)
+    cutoff_month = cutoff.strftime("%Y-%m")
+    
+    archived = 0
+    try:
+        # Filas del resumen que no se pudieron escribir en una compactación anterior
+        archive_summary.save()
+        # Sin envíos de la cola mientras se mueven filas entre hojas
+        with append_queue.flush_lock:
+            for table in storage.transaction_tables(end=cutoff - datetime.timedelta(days=1)):
+                try:
+                    moved = storage.archive_transactions(table, cutoff_month, archive_summary.add)
+                except Exception:
+                    # Parte de las filas pudo salir de la tabla: se vuelve a leer al consultarla
+                    transaction_mirror.forget(table)
+                    raise
+                if moved:
+                    transaction_mirror.forget(table)
+                    append_queue.acknowledge_stored({str(r.get('Registro_ID')) for r in moved if r.get('Registro_ID')})
+                    archived += len(moved)
+                    logger.info(f"🗄️ {table}: {len(moved)} transacciones anteriores a {cutoff_month} archivadas")
+    except Exception as e:
+        logger.error(f"❌ Error archivando transacciones: {e}")
+    return archived
+
+def user_ids_by_name():
+    """{nombre de usuario: ID} de los usuarios registrados; los nombres repetidos se omiten"""
+    counts = Counter(info['username'] for info in bot_manager.users.values())
+    return {info['username']: user_id for user_id, info in bot_manager.users.items() if counts[info['username']] == 1}
+
+def backfill_user_ids():
+    """Completa Usuario_ID en las filas de transacciones y del resumen archivado que solo tienen el nombre.
+    
+    El ID sale del nombre de un usuario registrado (si no está repetido) o del nombre
+    por defecto 'Usuario<ID>'. Devuelve {tabla: (filas completadas, filas sin resolver)}.
+    """
+    names = user_ids_by_name()
+    default_name = re.compile(r'^Usuario(\d+)$')
+    
+    def resolve(username):
+        user_id = names.get(username)
+        if user_id is None:
+            match = default_name.match(username)
+            user_id = int(match.group(1)) if match else None
+        return user_id
+    
+    results = {}
+    # Sin envíos de la cola mientras se reescriben filas existentes
+    with append_queue.flush_lock:
+        tables = storage.transaction_tables()
+        if storage.has_table('Archivo_Transacciones'):
+            tables.append('Archivo_Transacciones')
+        for table in tables:
+            records = storage.get_records(table)
+            if not records:
+                continue
+            if not storage.check_schema(table):
+                logger.error(f"❌ {table} no tiene la columna Usuario_ID, se omite")
+                continue
+            if 'Usuario_ID' not in records[0]:
+                # La columna se acaba de agregar al migrar el encabezado
+                records = storage.get_records(table)
+            updates = {}
+            unresolved = 0
+            for position, record in enumerate(records):
+                if str(record.get('Usuario_ID', '')).strip():
+                    continue
+                user_id = resolve(str(record.get('Usuario', '')))
+                if user_id is None:
+                    unresolved += 1
+                else:
+                    updates[position] = user_id
+            storage.update_column(table, 'Usuario_ID', updates)
+            transaction_mirror.forget(table)
+            results[table] = (len(updates), unresolved)
+            logger.info(f"🪪 {table}: Usuario_ID completado en {len(updates)} filas, {unresolved} sin resolver")
+        if storage.has_table('Resumen_Mensual'):
+            results['Resumen_Mensual'] = backfill_summary_user_ids(resolve)
+    return results
+
+def backfill_summary_user_ids(resolve):
+    """Completa Usuario_ID en Resumen_Mensual; si dos filas quedan con la misma clave se suman en una"""
+    table = 'Resumen_Mensual'
+    records = storage.get_records(table)
+    if not records:
+        return (0, 0)
+    if not storage.check_schema(table):
+        logger.error(f"❌ {table} no tiene la columna Usuario_ID, se omite")
+        return (0, len(records))
+    if 'Usuario_ID' not in records[0]:
+        records = storage.get_records(table)
+    
+    totals = {}
+    updates = {}
+    unresolved = 0
+    for position, record in enumerate(records):
+        user_id = summary_user_id(record.get('Usuario_ID'))
+        if not user_id:
+            user_id = resolve(str(record.get('Usuario', ''))) or 0
+            if user_id:
+                updates[position] = user_id
+            else:
+                unresolved += 1
+        key = (user_id, str(record.get('Usuario', '')), str(record.get('Mes', '')),
+               str(record.get('Tipo', '')), str(record.get('Categoria', '')))
+        entry = totals.setdefault(key, [0.0, 0])
+        entry[0] += float(record.get('Total') or 0)
+        entry[1] += int(record.get('Cantidad') or 0)
+    
+    if len(totals) < len(records):
+        # Una fila sin ID coincidió con otra que ya lo tenía: se reescribe la tabla con los totales sumados
+        storage.clear_table(table)
+        storage.append_rows(table, [ArchiveSummary.row(key, *values) for key, values in sorted(totals.items())])
+    else:
+        storage.update_column(table, 'Usuario_ID', updates)
+    archive_summary.load()
+    logger.info(f"🪪 {table}: Usuario_ID completado en {len(updates)} filas, {unresolved} sin resolver")
+    return (len(updates), unresolved)
+
+def run_backfill_user_ids():
+    """Migración única desde la línea de comandos: python bot.py --backfill-user-ids"""
+    configure_logging()
+    # Sin instantánea: la reconciliación en segundo plano reescribiría las mismas hojas
+    build_app_context(warm_start=False)
+    results = backfill_user_ids()
+    logger.info(f"🪪 Migración terminada: {sum(filled for filled, _ in results.values())} filas completadas, "
+                f"{sum(unresolved for _, unresolved in results.values())} sin resolver")
+
+def schedule_archive():
+    """Programa la compactación diaria de transacciones antiguas"""
+    if ARCHIVE_AFTER_MONTHS > 0 and ARCHIVE_TIME:
+        schedule.every().day.at(ARCHIVE_TIME).do(compact_transactions)
+        logger.info(f"Archivo de transacciones de más de {ARCHIVE_AFTER_MONTHS} meses programado a las {ARCHIVE_TIME}")
+
+def save_manager_snapshot():
+    """Guarda la instantánea del manager (tarea programada)"""
+    if bot_manager:
+        bot_manager.save_snapshot()
+
+def schedule_snapshots():
+    """Programa el guardado periódico de la instantánea local"""
+    if SNAPSHOT_PATH and SNAPSHOT_INTERVAL > 0:
+        schedule.every(SNAPSHOT_INTERVAL).minutes.do(save_manager_snapshot)
+        logger.info(f"Instantánea del manager programada cada {SNAPSHOT_INTERVAL} minutos")
+
+def schedule_api_report():
+    """Programa el reporte horario de uso de la API de Google Sheets"""
+    schedule.every().hour.do(sheets_api.report)
+
 def run_scheduler():
     """Ejecuta el programador de tareas en segundo plano"""
     import schedule
@@ -3039,14 +5886,23 @@ def run_scheduler():
 
 def main():
     """Función principal mejorada con sistema de registro"""
+    configure_logging()
     if not BOT_TOKEN:
         logger.error("Token del bot no configurado")
         return
     
-    if not ensure_all_sheet_headers():
-        logger.warning("No se pudo configurar todas las hojas de Google Sheets")
+    # Pool de gráficos antes que cualquier otro hilo (reconciliación, cola, programador)
+    chart_service.start()
+    
+    # Contexto de la aplicación: el manager se carga una sola vez aquí
+    app = build_app_context()
     
-    updater = Updater(BOT_TOKEN)
+    # Iniciar la cola de escritura diferida
+    with startup_timer.phase("Cola de escritura"):
+        app.append_queue.start()
+    
+    with startup_timer.phase("Conexión con Telegram"):
+        updater = Updater(BOT_TOKEN)
     dp = updater.dispatcher
     
     # Manejador de conversación mejorado con estados de registro
@@ -3094,7 +5950,8 @@ def main():
         "/start - Menú principal\n"
         "/cancel - Cancelar operación actual\n"
         "/help - Mostrar esta ayuda\n"
-        "/stats - Estadísticas rápidas\n\n"
+        "/stats - Estadísticas rápidas\n"
+        "/resync - Sincronizar datos con Google Sheets (administradores)\n\n"
         "🎯 **Sistema de Registro y Vinculación:**\n"
         "• 👤 Registro personalizado de usuarios\n"
         "• 👨‍👩‍👧‍👦 Creación de grupos familiares\n"
@@ -3114,6 +5971,9 @@ def main():
     # Comando de estadísticas rápidas
     dp.add_handler(CommandHandler('stats', lambda u, c: show_quick_stats(u, c)))
     
+    # Resincronización manual del espejo de transacciones
+    dp.add_handler(CommandHandler('resync', resync_transactions))
+    
     # Manejo de errores mejorado
     def error_handler(update, context):
         """Maneja errores del bot"""
@@ -3128,6 +5988,18 @@ def main():
     # Programar recordatorios de pago
     schedule_payday_reminders()
     
+    # Programar exportación de respaldo a Google Sheets
+    schedule_sheets_export()
+    
+    # Programar la instantánea para arranques en caliente
+    schedule_snapshots()
+    
+    # Programar el archivo de transacciones antiguas
+    schedule_archive()
+    
+    # Reporte periódico de cuota y latencia de Google Sheets
+    schedule_api_report()
+    
     # Iniciar programador en segundo plano
     scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
     scheduler_thread.start()
@@ -3137,8 +6009,20 @@ def main():
     logger.info("👨‍👩‍👧‍👦 Sistema de grupos familiares activo")
     logger.info("🔔 Recordatorios de pago programados y activos")
     
-    updater.start_polling()
+    with startup_timer.phase("Inicio de polling"):
+        updater.start_polling()
+    startup_timer.report()
     updater.idle()
+    
+    # Enviar transacciones pendientes antes de terminar
+    logger.info("🛑 Deteniendo bot, enviando transacciones pendientes...")
+    app.append_queue.stop()
+    app.manager.save_snapshot()
+    chart_service.shutdown()
+    sheets_api.report()
 
 if __name__ == '__main__':
-    main()
+    if '--backfill-user-ids' in sys.argv[1:]:
+        run_backfill_user_ids()
+    else:
+        main()
@@ -17,7 +17,7 @@ GOOGLE_SHEETS_SCOPE = [
 
 SHEET_HEADERS = [
     'Fecha', 'Usuario', 'Tipo', 'Monto', 
-    'Categoria', 'Descripcion', 'Fecha_Vencimiento', 'Estado_Pago'
+    'Categoria', 'Descripcion', 'Fecha_Vencimiento', 'Estado_Pago', 'Registro_ID', 'Usuario_ID'
 ]
 
 # Categorías por tipo
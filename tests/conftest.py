@@ -0,0 +1,203 @@
+"""Hoja de cálculo en memoria para probar bot.py sin Google Sheets ni Telegram"""
+import importlib
+import re
+import sys
+from pathlib import Path
+
+import gspread
+import pytest
+from gspread.utils import a1_to_rowcol, numericise_all
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def parse_range(range_name):
+    """'A1:C3' (o 'Hoja!A2:J') -> (fila1, col1, fila2 o None, col2)"""
+    range_name = range_name.split('!', 1)[-1]
+    start, _, end = range_name.partition(':')
+    row1, col1 = a1_to_rowcol(start if re.search(r'\d', start) else start + '1')
+    if not end:
+        return row1, col1, row1, col1
+    if re.search(r'\d', end):
+        row2, col2 = a1_to_rowcol(end)
+    else:
+        row2, col2 = None, a1_to_rowcol(end + '1')[1]
+    return row1, col1, row2, col2
+
+
+class FakeWorksheet:
+    """Lo mínimo de gspread.Worksheet que usa bot.py, con las filas en una lista"""
+
+    def __init__(self, spreadsheet, title, rows=None, cols=26):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = len(spreadsheet.sheets)
+        self.col_count = cols
+        self.rows = [list(map(str, row)) for row in rows or []]
+
+    @property
+    def row_count(self):
+        return max(1000, len(self.rows))
+
+    def _set(self, row, col, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        cells = self.rows[row - 1]
+        while len(cells) < col:
+            cells.append('')
+        cells[col - 1] = str(value)
+
+    def _get(self, range_name):
+        row1, col1, row2, col2 = parse_range(range_name)
+        values = [row[col1 - 1:col2] for row in self.rows[row1 - 1:row2 or len(self.rows)]]
+        while values and not any(values[-1]):
+            values.pop()
+        return values
+
+    def row_values(self, row, **kwargs):
+        return list(self.rows[row - 1]) if len(self.rows) >= row else []
+
+    def get_all_values(self, **kwargs):
+        return [list(row) for row in self.rows]
+
+    def get_all_records(self, **kwargs):
+        if not self.rows:
+            return []
+        headers = self.rows[0]
+        return [
+            dict(zip(headers, numericise_all(row + [''] * (len(headers) - len(row)))))
+            for row in self.rows[1:]
+        ]
+
+    def get(self, range_name=None, **kwargs):
+        return self._get(range_name)
+
+    def batch_get(self, ranges, **kwargs):
+        return [self._get(range_name) for range_name in ranges]
+
+    def _updated(self, first_row, count, width):
+        return {'updates': {'updatedRange': f"'{self.title}'!A{first_row}:{chr(64 + max(width, 1))}{first_row + count - 1}"}}
+
+    def append_row(self, values, **kwargs):
+        self.rows.append([str(v) for v in values])
+        return self._updated(len(self.rows), 1, len(values))
+
+    def append_rows(self, values, **kwargs):
+        first_row = len(self.rows) + 1
+        self.rows.extend([str(v) for v in row] for row in values)
+        return self._updated(first_row, len(values), max(len(row) for row in values))
+
+    def update_cell(self, row, col, value):
+        self._set(row, col, value)
+
+    def update(self, range_name, values=None, **kwargs):
+        row1, col1, _, _ = parse_range(range_name)
+        for i, row in enumerate(values):
+            for j, value in enumerate(row):
+                self._set(row1 + i, col1 + j, value)
+
+    def batch_update(self, data, **kwargs):
+        for item in data:
+            self.update(item['range'], item['values'])
+
+    def delete_rows(self, start, end=None):
+        del self.rows[start - 1:end or start]
+
+    def clear(self):
+        self.rows = []
+
+    def add_rows(self, count):
+        pass
+
+    def add_cols(self, count):
+        self.col_count += count
+
+    def define_named_range(self, range_name, name):
+        self.spreadsheet.named_ranges.append({'name': name, 'range': {'sheetId': self.id}})
+
+
+class FakeSpreadsheet:
+    def __init__(self):
+        self.sheets = {}
+        self.named_ranges = []
+        self.add_worksheet('Hoja 1', 1000, 26)
+
+    @property
+    def sheet1(self):
+        return self.sheets['Hoja 1']
+
+    def worksheet(self, title):
+        if title not in self.sheets:
+            raise gspread.WorksheetNotFound(title)
+        return self.sheets[title]
+
+    def worksheets(self, **kwargs):
+        return list(self.sheets.values())
+
+    def add_worksheet(self, title, rows, cols, index=None):
+        self.sheets[title] = FakeWorksheet(self, title, cols=cols)
+        return self.sheets[title]
+
+    def del_worksheet(self, worksheet):
+        del self.sheets[worksheet.title]
+
+    def list_named_ranges(self):
+        return list(self.named_ranges)
+
+    def values_batch_get(self, ranges, params=None):
+        value_ranges = []
+        for range_name in ranges:
+            rows = self.sheets[range_name.split('!')[0].strip("'").replace("''", "'")].get_all_values()
+            value_ranges.append({'range': range_name, 'values': rows} if rows else {'range': range_name})
+        return {'valueRanges': value_ranges}
+
+
+class FakeClient:
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def open(self, name):
+        return self.spreadsheet
+
+
+@pytest.fixture
+def spreadsheet():
+    return FakeSpreadsheet()
+
+
+@pytest.fixture
+def load_bot(spreadsheet, monkeypatch, tmp_path):
+    """Importa bot.py desde cero contra la hoja en memoria; los archivos locales van a tmp_path"""
+    from oauth2client.service_account import ServiceAccountCredentials
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TIMEZONE', 'America/Santiago')
+    monkeypatch.setenv('SNAPSHOT_PATH', '')
+    monkeypatch.setenv('STORAGE_BACKEND', 'sheets')
+    monkeypatch.setenv('TRANSACTIONS_WAL_PATH', str(tmp_path / 'transactions.wal'))
+    monkeypatch.setenv('SHEETS_SPOOL_PATH', str(tmp_path / 'pending_transactions.json'))
+    monkeypatch.setenv('CHART_WORKERS', '0')
+    # La hoja en memoria no tiene cuota de la API
+    monkeypatch.setenv('SHEETS_READS_PER_MINUTE', '100000')
+    monkeypatch.setenv('SHEETS_WRITES_PER_MINUTE', '100000')
+    monkeypatch.setattr(ServiceAccountCredentials, 'from_json_keyfile_name',
+                        classmethod(lambda cls, *args, **kwargs: object()))
+    monkeypatch.setattr(gspread, 'authorize', lambda credentials: FakeClient(spreadsheet))
+    monkeypatch.syspath_prepend(str(ROOT))
+
+    def load(env=None, build=True):
+        for name, value in (env or {}).items():
+            monkeypatch.setenv(name, value)
+        sys.modules.pop('bot', None)
+        bot = importlib.import_module('bot')
+        if build:
+            bot.build_app_context()
+        return bot
+
+    yield load
+    sys.modules.pop('bot', None)
+
+
+@pytest.fixture
+def bot(load_bot):
+    return load_bot()
@@ -0,0 +1,58 @@
+import datetime
+
+import pytest
+
+from test_compaction import USERS_HEADERS
+
+BUCKETS = ('week', 'month', 'quarter')
+CATEGORIES = ('Comida', 'Transporte', 'Ocio', 'Salud')
+
+
+def flatten(trends):
+    return {(period, category): amount
+            for period, categories in (trends or {}).items() for category, amount in categories.items()}
+
+
+@pytest.fixture
+def engines(spreadsheet, load_bot):
+    """El mismo historial leído con el motor por defecto y con el de pandas"""
+    spreadsheet.add_worksheet('Usuarios', 1000, 8).rows = [
+        USERS_HEADERS, ['5', 'Ana', '', '', '', '', '', ''], ['6', 'Beto', '', '', '', '', '', '']]
+    bot = load_bot()
+    now = datetime.datetime.now(bot.TIMEZONE).replace(second=0, microsecond=0)
+    # Cerca de la medianoche y del cambio de semana, mes y trimestre, y también archivados
+    for i in range(120):
+        when = now - datetime.timedelta(days=i * 4, hours=(i * 7) % 24, minutes=(i * 13) % 60)
+        record_type = ('Gasto', 'Gasto', 'Ingreso', 'Deuda')[i % 4]
+        bot.append_queue.enqueue([when.strftime("%Y-%m-%d %H:%M"), 'Ana' if i % 3 else 'Beto', record_type,
+                                  round(5 + i * 1.25, 2), CATEGORIES[i % len(CATEGORIES)], '', '',
+                                  'Completado', f'r{i}', 5 if i % 3 else 6])
+    assert bot.append_queue.flush()
+    assert bot.compact_transactions() > 0
+
+    return load_bot(), load_bot(env={'ANALYTICS_ENGINE': 'pandas'})
+
+
+@pytest.mark.parametrize('bucket', BUCKETS)
+@pytest.mark.parametrize('user_id', [5, None])
+def test_pandas_trends_match_the_rollups(engines, bucket, user_id):
+    rollup, pandas = engines
+    assert rollup.pandas_analytics is None and pandas.pandas_analytics is not None
+
+    expected = flatten(rollup.analyzer.get_spending_trends(user_id, months=18, bucket=bucket))
+    result = flatten(pandas.analyzer.get_spending_trends(user_id, months=18, bucket=bucket))
+
+    assert expected
+    assert result == pytest.approx(expected)
+
+
+def test_pandas_summaries_match_the_rollups(engines):
+    rollup, pandas = engines
+    for user_id in (5, 6, None):
+        assert (pandas.analyzer.get_top_categories(user_id, n=3)
+                == pytest.approx(rollup.analyzer.get_top_categories(user_id, n=3)))
+        expected = rollup.analyzer.get_monthly_summary(user_id)
+        result = pandas.analyzer.get_monthly_summary(user_id)
+        assert result['transaction_count'] == expected['transaction_count']
+        assert result['total_expenses'] == pytest.approx(expected['total_expenses'])
+        assert dict(result['by_category']) == pytest.approx(dict(expected['by_category']))
@@ -0,0 +1,41 @@
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+def test_import_does_not_connect_or_build_the_manager(load_bot, monkeypatch):
+    import gspread
+    connections = []
+    monkeypatch.setattr(gspread, 'authorize', lambda credentials: connections.append(credentials))
+
+    bot = load_bot(build=False)
+
+    assert connections == []
+    assert bot.spreadsheet is None and bot.storage is None and bot.bot_manager is None
+
+
+def test_the_manager_is_built_once(load_bot, monkeypatch):
+    bot = load_bot(build=False)
+    loads = []
+    load_all_data = bot.AdvancedFinanceBotManager.load_all_data
+    monkeypatch.setattr(bot.AdvancedFinanceBotManager, 'load_all_data',
+                        lambda self: loads.append(self) or load_all_data(self))
+
+    context = bot.build_app_context()
+    manager = bot.bot_manager
+
+    assert bot.build_app_context() is context
+    assert context.manager is manager is bot.bot_manager
+    assert loads == [manager]
+
+
+def test_heavy_libraries_are_imported_on_first_use():
+    code = ("import sys, bot; "
+            "print('pandas' in sys.modules, 'matplotlib' in sys.modules); "
+            "bot.pd.DataFrame; "
+            "print('pandas' in sys.modules, bot.pd.loaded, bot.mpl_figure.loaded)")
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, timeout=120)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split('\n')[:2] == ['False False', 'True True False']
@@ -0,0 +1,63 @@
+import datetime
+
+from test_schema import LEGACY_HEADERS, run_with_timeout
+
+
+def test_backfill_migrates_legacy_sheet_without_warm_start(spreadsheet, load_bot, tmp_path):
+    snapshot = str(tmp_path / 'snapshot.pkl')
+    users = spreadsheet.add_worksheet('Usuarios', 1000, 8)
+    users.rows = [['Usuario_ID', 'Usuario_Nombre', 'Fecha_Registro', 'Ultima_Actividad', 'Dia_Pago',
+                   'Fecha_Pago_Completa', 'Ingreso_Mensual', 'Configuraciones'],
+                  ['5', 'Ana', '', '', '', '', '', '']]
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+    spreadsheet.sheet1.rows = [LEGACY_HEADERS,
+                               [now, 'Ana', 'Gasto', '10', 'Comida', '', '', 'Completado', 'r1'],
+                               [now, 'Usuario42', 'Gasto', '5', 'Comida', '', '', 'Completado', 'r2'],
+                               [now, 'Nadie', 'Gasto', '1', 'Comida', '', '', 'Completado', 'r3']]
+    # Una instantánea previa haría que el arranque normal reconcilie en segundo plano
+    first = load_bot(env={'SNAPSHOT_PATH': snapshot})
+    first.bot_manager.save_snapshot()
+
+    bot = load_bot(env={'SNAPSHOT_PATH': snapshot}, build=False)
+    reconciled = []
+    bot.AdvancedFinanceBotManager.reconcile = lambda self: reconciled.append(self)
+
+    run_with_timeout(bot.run_backfill_user_ids)
+
+    rows = spreadsheet.sheet1.rows
+    assert rows[0] == bot.SHEET_HEADERS
+    assert [row[9] if len(row) > 9 else '' for row in rows[1:]] == ['5', '42', '']
+    assert reconciled == []
+    assert not bot.app_context.warm_start
+
+
+def test_backfill_migrates_legacy_summary_rows(spreadsheet, load_bot):
+    users = spreadsheet.add_worksheet('Usuarios', 1000, 8)
+    users.rows = [['Usuario_ID', 'Usuario_Nombre', 'Fecha_Registro', 'Ultima_Actividad', 'Dia_Pago',
+                   'Fecha_Pago_Completa', 'Ingreso_Mensual', 'Configuraciones'],
+                  ['5', 'Ana', '', '', '', '', '', '']]
+    # Resumen anterior a Usuario_ID, más una fila de Ana ya con ID para el mismo mes
+    spreadsheet.add_worksheet('Resumen_Mensual', 1000, 6).rows = [
+        ['Usuario', 'Mes', 'Tipo', 'Categoria', 'Total', 'Cantidad'],
+        ['Ana', '2024-01', 'Gasto', 'Comida', '10', '2'],
+        ['Usuario42', '2024-01', 'Gasto', 'Comida', '4', '1'],
+        ['Nadie', '2024-02', 'Gasto', 'Ocio', '1', '1'],
+    ]
+    bot = load_bot(build=False)
+    bot.build_app_context(warm_start=False)
+    spreadsheet.sheets['Resumen_Mensual'].rows.append(['Ana', '2024-01', 'Gasto', 'Comida', '5', '1', '5'])
+    bot.archive_summary.load()
+
+    results = run_with_timeout(bot.backfill_user_ids)
+
+    assert results['Resumen_Mensual'] == (2, 1)
+    rows = spreadsheet.sheets['Resumen_Mensual'].rows
+    assert rows[0] == bot.SHEET_SCHEMAS['Resumen_Mensual']
+    assert sorted(rows[1:]) == [
+        ['Ana', '2024-01', 'Gasto', 'Comida', '15.0', '3', '5'],
+        ['Nadie', '2024-02', 'Gasto', 'Ocio', '1.0', '1', ''],
+        ['Usuario42', '2024-01', 'Gasto', 'Comida', '4.0', '1', '42'],
+    ]
+    assert bot.analyzer.totals(user_ids=[5]).expenses == 15
+    bot.bot_manager.users[5]['username'] = 'Anita'
+    assert bot.analyzer.totals(user_ids=[5]).expenses == 15
@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+
+
+class FakeMessage:
+    """Registra las fotos enviadas y el hilo que las envió"""
+
+    def __init__(self):
+        self.sent = []
+        self.threads = []
+        self.delivered = threading.Event()
+
+    def reply_photo(self, photo, caption=None):
+        self.sent.append(photo if isinstance(photo, str) else photo.getvalue())
+        self.threads.append(threading.current_thread().name)
+        self.delivered.set()
+        photo_size = type('PhotoSize', (), {'file_id': f'file{len(self.sent)}'})()
+        return type('Message', (), {'photo': [photo_size]})()
+
+
+@pytest.fixture
+def charts(load_bot):
+    bot = load_bot(env={'CHART_WORKERS': '1'}, build=False)
+    bot.chart_service.start()
+    yield bot
+    bot.chart_service.shutdown()
+
+
+def send(bot, method, *args, **kwargs):
+    message = FakeMessage()
+    method(message, 1, *args, **kwargs)
+    assert message.delivered.wait(60), "el gráfico no llegó"
+    return message
+
+
+TRENDS = {'2026-08': {'Comida': 10.0, 'Ocio': 5.0}, '2026-09': {'Comida': 20.0}}
+
+
+def test_charts_render_in_spawned_workers_and_send_off_the_caller_thread(charts):
+    bot = charts
+
+    first = send(bot, bot.chart_service.send_trends, TRENDS)
+    cached = send(bot, bot.chart_service.send_trends, TRENDS)
+
+    assert first.sent[0].startswith(b'\x89PNG')
+    # La segunda vez se reenvía el file_id de Telegram, también desde un hilo de envío
+    assert cached.sent == ['file1']
+    caller = threading.current_thread().name
+    assert caller not in first.threads + cached.threads
+
+
+def test_trend_cache_key_depends_on_the_bucket_and_data(charts):
+    bot = charts
+    send(bot, bot.chart_service.send_trends, TRENDS)
+    send(bot, bot.chart_service.send_trends, TRENDS, bucket='quarter')
+    send(bot, bot.chart_service.send_trends, {'2026-10': {'Comida': 1.0}})
+
+    titles = [key[2] for key in bot.chart_service._cache]
+    assert titles == ["Gasto por mes", "Gasto por trimestre", "Gasto por mes"]
+    assert len({key[3] for key in bot.chart_service._cache}) == 2
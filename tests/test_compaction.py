@@ -0,0 +1,174 @@
+import datetime
+
+import pytest
+
+from conftest import FakeSpreadsheet, FakeWorksheet
+
+USERS_HEADERS = ['Usuario_ID', 'Usuario_Nombre', 'Fecha_Registro', 'Ultima_Actividad', 'Dia_Pago',
+                 'Fecha_Pago_Completa', 'Ingreso_Mensual', 'Configuraciones']
+
+
+def row(when, record_type, amount, category, record_id):
+    return [when, 'Ana', record_type, amount, category, '', '', 'Completado', record_id, 5]
+
+
+def totals(bot, **kwargs):
+    return bot.FinancialAnalyzer.query(group_by=('user', 'month', 'type', 'category'),
+                                       aggregates=('sum', 'count'), **kwargs)
+
+
+def archived_ids(spreadsheet):
+    return sorted(r[8] for r in spreadsheet.sheets['Archivo_Transacciones'].rows[1:])
+
+
+def summary_counts(spreadsheet):
+    rows = spreadsheet.sheets['Resumen_Mensual'].rows
+    count = rows[0].index('Cantidad')
+    return sorted(int(r[count]) for r in rows[1:])
+
+
+@pytest.fixture
+def history(spreadsheet, load_bot):
+    """Ana (ID 5) con transacciones de 2024 y 2025 en particiones y en la hoja histórica, y del mes actual"""
+    spreadsheet.add_worksheet('Usuarios', 1000, 8).rows = [USERS_HEADERS, ['5', 'Ana', '', '', '', '', '', '']]
+    bot = load_bot(build=False)
+    now = datetime.datetime.now(bot.TIMEZONE).strftime("%Y-%m-%d %H:%M")
+    # En la hoja histórica las filas viejas quedan en dos tramos separados por una actual
+    spreadsheet.sheet1.rows = [bot.SHEET_HEADERS] + [[str(v) for v in r] for r in (
+        row('2023-11-02 08:00', 'Gasto', 4, 'Ropa', 'h0'),
+        row(now, 'Gasto', 1, 'Ropa', 'h1'),
+        row('2023-12-24 20:00', 'Gasto', 6, 'Ocio', 'h2'),
+        row('2023-12-30 21:00', 'Ingreso', 50, 'Sueldo', 'h3'),
+    )]
+    bot = load_bot()
+    for i, (when, record_type, amount, category) in enumerate([
+        ('2024-01-03 10:00', 'Gasto', 7, 'Ropa'),
+        ('2024-01-20 18:30', 'Gasto', 3, 'Ropa'),
+        ('2024-01-25 09:00', 'Ingreso', 100, 'Sueldo'),
+        ('2025-02-15 10:00', 'Gasto', 10, 'Comida'),
+        (now, 'Gasto', 2, 'Comida'),
+    ]):
+        bot.append_queue.enqueue(row(when, record_type, amount, category, f'r{i}'))
+    assert bot.append_queue.flush()
+    return bot
+
+
+ARCHIVED = ['h0', 'h2', 'h3', 'r0', 'r1', 'r2', 'r3']
+
+
+def test_compaction_keeps_totals(history, spreadsheet, load_bot):
+    bot = history
+    before = totals(bot)
+    trends = bot.analyzer.get_spending_trends(5, months=48)
+
+    assert bot.compact_transactions() == 7
+
+    assert 'Transacciones_2024_01' not in spreadsheet.sheets
+    assert 'Transacciones_2025_02' not in spreadsheet.sheets
+    assert [r[8] for r in spreadsheet.sheet1.rows[1:]] == ['h1']
+    assert archived_ids(spreadsheet) == ARCHIVED
+    assert summary_counts(spreadsheet) == [1, 1, 1, 1, 1, 2]
+    assert totals(bot) == before
+    assert bot.analyzer.get_spending_trends(5, months=48) == trends
+    # Tras reiniciar, los meses archivados salen de Resumen_Mensual
+    assert totals(load_bot()) == before
+
+
+def test_compaction_is_idempotent(history, spreadsheet):
+    bot = history
+    bot.compact_transactions()
+    summary = [list(r) for r in spreadsheet.sheets['Resumen_Mensual'].rows]
+    before = totals(bot)
+
+    assert bot.compact_transactions() == 0
+
+    assert spreadsheet.sheets['Resumen_Mensual'].rows == summary
+    assert totals(bot) == before
+
+
+def fail_once(monkeypatch, cls, method, call_number=1, landed=False):
+    """Hace fallar la llamada número call_number a cls.method, después de aplicarla si landed"""
+    original = getattr(cls, method)
+    calls = []
+
+    def flaky(self, *args, **kwargs):
+        calls.append(args)
+        if len(calls) != call_number:
+            return original(self, *args, **kwargs)
+        if landed:
+            original(self, *args, **kwargs)
+        raise ConnectionError(f"{method} falló")
+
+    monkeypatch.setattr(cls, method, flaky)
+    return calls
+
+
+@pytest.mark.parametrize('cls, method, call_number, landed', [
+    (FakeWorksheet, 'delete_rows', 1, False),
+    (FakeWorksheet, 'delete_rows', 2, False),
+    (FakeWorksheet, 'delete_rows', 1, True),
+    (FakeSpreadsheet, 'del_worksheet', 1, False),
+    (FakeSpreadsheet, 'del_worksheet', 2, False),
+    (FakeSpreadsheet, 'del_worksheet', 1, True),
+])
+def test_failed_delete_then_rerun_keeps_totals(history, spreadsheet, load_bot, monkeypatch,
+                                               cls, method, call_number, landed):
+    bot = history
+    before = totals(bot)
+    calls = fail_once(monkeypatch, cls, method, call_number, landed)
+
+    bot.compact_transactions()
+
+    assert len(calls) >= call_number
+    assert totals(bot) == before
+    assert totals(load_bot()) == before
+
+    bot.compact_transactions()
+
+    assert archived_ids(spreadsheet) == ARCHIVED
+    assert summary_counts(spreadsheet) == [1, 1, 1, 1, 1, 2]
+    assert [r[8] for r in spreadsheet.sheet1.rows[1:]] == ['h1']
+    assert totals(bot) == before
+    assert totals(load_bot()) == before
+
+
+def test_unsaved_summary_rows_are_written_by_the_next_run(history, spreadsheet, load_bot, monkeypatch):
+    bot = history
+    before = totals(bot)
+    upsert_row = bot.storage.upsert_row
+
+    def upsert_fails(table, row):
+        raise ConnectionError("upsert_row falló")
+
+    monkeypatch.setattr(bot.storage, 'upsert_row', upsert_fails)
+    assert bot.compact_transactions() == 7
+    assert totals(bot) == before
+    assert bot.archive_summary.unsaved
+
+    monkeypatch.setattr(bot.storage, 'upsert_row', upsert_row)
+    assert bot.compact_transactions() == 0
+    assert not bot.archive_summary.unsaved
+    assert summary_counts(spreadsheet) == [1, 1, 1, 1, 1, 2]
+    assert totals(load_bot()) == before
+
+
+def test_users_sharing_a_name_keep_their_archived_totals(spreadsheet, load_bot):
+    spreadsheet.add_worksheet('Usuarios', 1000, 8).rows = [
+        USERS_HEADERS, ['5', 'Ana', '', '', '', '', '', ''], ['7', 'Ana', '', '', '', '', '', '']]
+    bot = load_bot()
+    for when, amount, user_id in (('2024-01-03 10:00', 7, 5), ('2024-01-04 10:00', 100, 7), ('2025-02-15 10:00', 3, 7)):
+        bot.append_queue.enqueue([when, 'Ana', 'Gasto', amount, 'Comida', '', '', 'Completado',
+                                  bot.new_record_id(), user_id])
+    assert bot.append_queue.flush()
+
+    assert bot.compact_transactions() == 3
+
+    assert bot.analyzer.totals(user_ids=[5]).expenses == 7
+    assert bot.analyzer.totals(user_ids=[7]).expenses == 103
+    # Renombrar no deja huérfanos los meses archivados
+    bot.bot_manager.users[5]['username'] = 'Anita'
+    assert bot.analyzer.totals(user_ids=[5]).expenses == 7
+    restarted = load_bot()
+    assert restarted.analyzer.totals(user_ids=[5]).expenses == 7
+    assert restarted.analyzer.totals(user_ids=[7]).expenses == 103
+    assert [r['Total'] for r in restarted.archive_summary.get_rows(7, 'Ana')] == [100, 3]
@@ -0,0 +1,45 @@
+import datetime
+
+from test_compaction import USERS_HEADERS
+
+
+def test_rows_are_converted_by_column_type_in_any_header_order(bot):
+    decoder = bot.RowDecoder.for_table('Fechas_Pago', ['Mes_Pago', 'Usuario_ID', 'Dia_Pago', 'Proxima_Fecha'])
+    record = decoder.decode_row(['3', '5', '15.0', '2026-03-15'])
+
+    assert (record.Usuario_ID, record.Dia_Pago, record.Mes_Pago) == (5, 15, 3)
+    assert record.Proxima_Fecha == datetime.datetime(2026, 3, 15)
+    # Columnas que faltan en la hoja quedan vacías
+    assert record.Usuario_Nombre == '' and record.Ultima_Actualizacion == ''
+    assert bot.RowDecoder.for_table('Fechas_Pago', ['Mes_Pago', 'Usuario_ID', 'Dia_Pago', 'Proxima_Fecha']) is decoder
+
+
+def test_invalid_rows_are_dropped_and_counted(bot):
+    bot.RowDecoder.rejected.clear()
+    records = [
+        {'Usuario_ID': '5', 'Usuario_Nombre': 'Ana', 'Ingreso_Mensual': '1500.5', 'Fecha_Registro': 'ayer'},
+        {'Usuario_ID': '', 'Usuario_Nombre': 'Sin ID', 'Ingreso_Mensual': '', 'Fecha_Registro': ''},
+        {'Usuario_ID': '-3', 'Usuario_Nombre': 'Negativo', 'Ingreso_Mensual': '', 'Fecha_Registro': ''},
+        {'Usuario_ID': '6', 'Usuario_Nombre': 'Beto', 'Ingreso_Mensual': 'mucho', 'Fecha_Registro': ''},
+        {'Usuario_ID': '7', 'Usuario_Nombre': 'Carla', 'Ingreso_Mensual': '', 'Fecha_Registro': '2025-01-02'},
+    ]
+
+    decoded = bot.RowDecoder.decode_records('Usuarios', records)
+
+    assert [(r.Usuario_ID, r.Ingreso_Mensual) for r in decoded] == [(5, 1500.5), (7, 0.0)]
+    # Una fecha ilegible no descarta la fila
+    assert decoded[0].Fecha_Registro is None
+    assert decoded[1].Fecha_Registro == datetime.datetime(2025, 1, 2)
+    assert bot.RowDecoder.rejected['Usuarios'] == 3
+    # Las referencias opcionales inválidas quedan en 0
+    summary = bot.RowDecoder.decode_records('Resumen_Mensual', [{'Usuario_ID': 'x', 'Total': '1', 'Cantidad': '2'}])
+    assert summary[0].Usuario_ID == 0
+
+
+def test_startup_skips_rows_that_do_not_decode(spreadsheet, load_bot):
+    spreadsheet.add_worksheet('Usuarios', 1000, 8).rows = [
+        USERS_HEADERS, ['5', 'Ana', '', '', '', '', '', ''], ['abc', 'Roto', '', '', '', '', '', '']]
+
+    bot = load_bot()
+
+    assert list(bot.bot_manager.users) == [5]
@@ -0,0 +1,86 @@
+import pytest
+import requests
+
+
+class HttpError(Exception):
+    """Error con la forma de gspread.exceptions.APIError (response.status_code)"""
+
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.response = type('Response', (), {'status_code': status})()
+
+
+@pytest.fixture
+def limiter(bot, monkeypatch):
+    monkeypatch.setattr(bot.time, 'sleep', lambda seconds: None)
+    return bot.SheetsApiLimiter(reads_per_minute=1000, writes_per_minute=1000, max_retries=3)
+
+
+def failing(*errors, result='ok'):
+    """Función que falla con cada error indicado y después devuelve result"""
+    calls = []
+
+    def call():
+        calls.append(len(calls))
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return call, calls
+
+
+@pytest.mark.parametrize('error', [HttpError(503), HttpError(429), requests.exceptions.ConnectionError()])
+def test_reads_are_retried_on_transient_errors(limiter, error):
+    call, calls = failing(error)
+
+    assert limiter.call('get_all_values', call) == 'ok'
+    assert len(calls) == 2
+    assert limiter.metrics['get_all_values']['retries'] == 1
+
+
+@pytest.mark.parametrize('method', ['append_rows', 'delete_rows', 'del_worksheet'])
+@pytest.mark.parametrize('error', [HttpError(503), requests.exceptions.Timeout()])
+def test_non_idempotent_writes_are_not_retried_after_they_may_have_landed(limiter, method, error):
+    call, calls = failing(error)
+
+    with pytest.raises(type(error)):
+        limiter.call(method, call)
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize('method', ['append_rows', 'delete_rows'])
+def test_quota_errors_are_retried_for_every_method(limiter, method):
+    call, calls = failing(HttpError(429))
+
+    assert limiter.call(method, call) == 'ok'
+    assert len(calls) == 2
+
+
+def test_client_errors_and_exhausted_retries_raise(limiter):
+    call, calls = failing(HttpError(400))
+    with pytest.raises(HttpError):
+        limiter.call('update', call)
+    assert len(calls) == 1
+
+    call, calls = failing(*[HttpError(500)] * 5)
+    with pytest.raises(HttpError):
+        limiter.call('update', call)
+    assert len(calls) == 4
+    assert limiter.metrics['update']['errors'] == 5
+
+
+def test_archive_does_not_delete_rows_that_moved(bot, spreadsheet, monkeypatch):
+    for i, when in enumerate(('2024-01-03 10:00', '2024-01-05 10:00', '2026-10-05 10:00')):
+        spreadsheet.sheet1.rows.append([when, 'Ana', 'Gasto', '1', 'Ropa', '', '', 'Completado', f'r{i}', '5'])
+    load_table = bot.storage.load_table
+
+    def load_then_another_writer_inserts(table):
+        result = load_table(table)
+        if table == 'Transacciones':
+            spreadsheet.sheet1.rows.insert(1, ['2026-10-06 10:00', 'Beto', 'Gasto', '2', 'Ropa', '', '', 'Completado', 'x', '6'])
+        return result
+
+    monkeypatch.setattr(bot.storage, 'load_table', load_then_another_writer_inserts)
+
+    with pytest.raises(RuntimeError):
+        bot.storage.archive_transactions('Transacciones', '2026-01', lambda records: None)
+    assert [row[8] for row in spreadsheet.sheet1.rows[1:]] == ['x', 'r0', 'r1', 'r2']
@@ -0,0 +1,77 @@
+import datetime
+
+import pytest
+
+from test_compaction import USERS_HEADERS
+
+
+def row(when, record_type, amount, record_id, status='Completado', user_id=5, username='Ana'):
+    return [when, username, record_type, amount, 'Comida', '', '', status, record_id, user_id]
+
+
+@pytest.fixture
+def now(bot):
+    return datetime.datetime.now(bot.TIMEZONE).strftime("%Y-%m-%d %H:%M")
+
+
+def test_type_codes_ignore_case_and_spaces(bot):
+    assert bot.type_code('Gasto') == bot.type_code('GASTO') == bot.type_code(' gasto ') == bot.TYPE_EXPENSE
+    assert bot.type_code('ingreso') == bot.TYPE_INCOME
+    assert bot.type_code('DEUDA') == bot.TYPE_DEBT
+    assert bot.type_code('Otro') == bot.type_code('') == 0
+
+
+def test_lowercase_types_count_in_the_totals_and_keep_their_text(spreadsheet, load_bot, now):
+    spreadsheet.add_worksheet('Usuarios', 1000, 8).rows = [USERS_HEADERS, ['5', 'Ana', '', '', '', '', '', '']]
+    bot = load_bot()
+    for i, record_type in enumerate(('Gasto', 'gasto', 'GASTO', 'ingreso')):
+        bot.append_queue.enqueue(row(now, record_type, 10, f'r{i}'))
+    assert bot.append_queue.flush()
+
+    bot = load_bot()
+    totals = bot.analyzer.totals(user_ids=[5])
+    assert totals.expenses == 30
+    assert totals.income == 10
+    records = bot.transaction_mirror.get_user_records(5)
+    assert [r['Tipo'] for r in records] == ['Gasto', 'gasto', 'GASTO', 'ingreso']
+
+
+def test_indexes_find_user_rows_and_pending_debts(bot, now):
+    columns = bot.TransactionColumns.from_rows([
+        row(now, 'Gasto', 1, 'a'),
+        row(now, 'Deuda', 2, 'b', status='Pendiente'),
+        row(now, 'Deuda', 3, 'c', status='Pagado'),
+        row(now, 'Gasto', 4, 'd', user_id=6, username='Beto'),
+        row('no es fecha', 'Gasto', 5, 'e'),
+        row(now, 'Deuda', 6, 'f', user_id='', username='Ana'),
+    ])
+    ids = lambda rows: [r['Registro_ID'] for r in columns.to_records(rows)]
+
+    # La fila sin fecha válida se conserva pero no entra en los índices
+    assert columns.rejected.tolist() == [False, False, False, False, True, False]
+    assert ids(columns.user_rows(6)) == ['d']
+    assert ids(columns.pending_debt_rows(6)) == []
+    assert columns.to_records()[4]['Fecha'] == 'no es fecha'
+
+    bot.bot_manager.users[5] = {'username': 'Ana'}
+    # Las filas antiguas sin Usuario_ID se asocian por el nombre actual
+    assert ids(columns.user_rows(5)) == ['a', 'b', 'c', 'f']
+    assert ids(columns.pending_debt_rows(5)) == ['b']
+
+
+def test_sync_reads_only_the_rows_appended_by_another_writer(bot, spreadsheet, now, monkeypatch):
+    bot.append_queue.enqueue(row(now, 'Gasto', 1, 'mine'))
+    assert bot.append_queue.flush()
+    mirror = bot.transaction_mirror
+    table = bot.transaction_partition(datetime.datetime.now(bot.TIMEZONE))
+    assert [r['Registro_ID'] for r in mirror.get_user_records(5)] == ['mine']
+
+    spreadsheet.sheets[table].rows.append([str(v) for v in row(now, 'Gasto', 2, 'other')])
+    reads = []
+    read_tail = bot.storage.read_tail
+    monkeypatch.setattr(bot.storage, 'read_tail', lambda *args: reads.append(args) or read_tail(*args))
+
+    assert mirror.sync_partition(table)
+
+    assert [args[:2] for args in reads] == [(table, 1)]
+    assert [r['Registro_ID'] for r in mirror.get_user_records(5)] == ['mine', 'other']
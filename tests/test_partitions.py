@@ -0,0 +1,92 @@
+import datetime
+
+
+def row(bot, when, amount, record_id):
+    return [when, 'Ana', 'Gasto', amount, 'Comida', '', '', 'Completado', record_id, 5]
+
+
+def stored(spreadsheet, title):
+    return [r[8] for r in spreadsheet.sheets[title].rows[1:]]
+
+
+def test_rows_go_to_the_partition_of_their_date(bot, spreadsheet):
+    now = datetime.datetime.now(bot.TIMEZONE)
+    current = bot.transaction_partition(now)
+    bot.append_queue.enqueue(row(bot, '2025-03-15 10:00', 1, 'r1'))
+    bot.append_queue.enqueue(row(bot, '2025-04-01 00:00', 2, 'r2'))
+    bot.append_queue.enqueue(row(bot, now.strftime("%Y-%m-%d %H:%M"), 3, 'r3'))
+
+    assert bot.append_queue.flush()
+
+    assert stored(spreadsheet, 'Transacciones_2025_03') == ['r1']
+    assert stored(spreadsheet, 'Transacciones_2025_04') == ['r2']
+    assert stored(spreadsheet, current) == ['r3']
+    assert spreadsheet.sheet1.rows[1:] == []
+    for title in ('Transacciones_2025_03', 'Transacciones_2025_04', current):
+        assert spreadsheet.sheets[title].rows[0] == bot.SHEET_HEADERS
+
+
+def test_transaction_tables_selects_partitions_by_range(bot):
+    for when in ('2025-03-15 10:00', '2025-04-15 10:00', '2025-06-15 10:00'):
+        bot.append_queue.enqueue(row(bot, when, 1, bot.new_record_id()))
+    assert bot.append_queue.flush()
+    tables = bot.storage.transaction_tables
+
+    assert tables() == ['Transacciones', 'Transacciones_2025_03', 'Transacciones_2025_04', 'Transacciones_2025_06']
+    assert tables(datetime.date(2025, 4, 1), datetime.date(2025, 5, 31)) == ['Transacciones_2025_04']
+    assert tables('2025-05-01', '2025-05-31') == []
+    # La hoja histórica solo entra si el rango llega hasta antes de la primera partición
+    assert tables(end=datetime.date(2025, 3, 31)) == ['Transacciones', 'Transacciones_2025_03']
+    assert tables(start=datetime.date(2025, 6, 1)) == ['Transacciones_2025_06']
+
+
+def test_startup_reads_only_the_current_partition(spreadsheet, load_bot):
+    bot = load_bot()
+    now = datetime.datetime.now(bot.TIMEZONE)
+    bot.append_queue.enqueue(row(bot, '2025-03-15 10:00', 7, 'old'))
+    bot.append_queue.enqueue(row(bot, now.strftime("%Y-%m-%d %H:%M"), 3, 'new'))
+    assert bot.append_queue.flush()
+
+    bot = load_bot()
+    assert list(bot.transaction_mirror.partitions) == [bot.transaction_partition(now)]
+
+    # Una consulta de marzo carga esa partición (y la histórica) bajo demanda
+    records = bot.transaction_mirror.get_records(datetime.date(2025, 3, 1), datetime.date(2025, 3, 31))
+    assert [r['Registro_ID'] for r in records] == ['old']
+    assert 'Transacciones_2025_03' in bot.transaction_mirror.partitions
+
+
+def test_recent_history_reads_partitions_newest_first(spreadsheet, load_bot):
+    bot = load_bot()
+    now = datetime.datetime.now(bot.TIMEZONE)
+    bot.append_queue.enqueue(row(bot, '2025-03-15 10:00', 7, 'old'))
+    bot.append_queue.enqueue(row(bot, '2025-04-15 10:00', 7, 'april'))
+    for i in range(3):
+        bot.append_queue.enqueue(row(bot, now.strftime("%Y-%m-%d %H:%M"), i, f'new{i}'))
+    assert bot.append_queue.flush()
+
+    bot = load_bot()
+    records = bot.transaction_mirror.get_user_records(5, last=3)
+    assert [r['Registro_ID'] for r in records] == ['new0', 'new1', 'new2']
+    assert list(bot.transaction_mirror.partitions) == [bot.transaction_partition(now)]
+
+    # Si faltan filas sigue hacia atrás solo hasta juntarlas
+    records = bot.transaction_mirror.get_user_records(5, last=4)
+    assert [r['Registro_ID'] for r in records] == ['april', 'new0', 'new1', 'new2']
+    assert 'Transacciones_2025_03' not in bot.transaction_mirror.partitions
+    assert len(bot.transaction_mirror.get_user_records(5, last=20)) == 5
+
+
+def test_reminders_only_read_the_recent_months(spreadsheet, load_bot):
+    bot = load_bot(env={'PENDING_DEBT_MONTHS': '3'})
+    now = datetime.datetime.now(bot.TIMEZONE)
+    old = bot.add_months(now.date(), -5).strftime("%Y-%m-%d 10:00")
+    recent = bot.add_months(now.date(), -1).strftime("%Y-%m-%d 10:00")
+    for when, record_id in ((old, 'old'), (recent, 'recent')):
+        bot.append_queue.enqueue([when, 'Ana', 'Deuda', 10, 'Banco', '', '', 'Pendiente', record_id, 5])
+    assert bot.append_queue.flush()
+
+    bot = load_bot()
+    assert [r['Registro_ID'] for r in bot.transaction_mirror.get_pending_debts(5)] == ['recent']
+    assert bot.transaction_partition(old) not in bot.transaction_mirror.partitions
+    assert [r['Registro_ID'] for r in bot.transaction_mirror.get_pending_debts(5, months=0)] == ['old', 'recent']
@@ -0,0 +1,236 @@
+import datetime
+
+import pytest
+
+from test_compaction import USERS_HEADERS
+
+# (fecha, usuario, tipo, monto, categoría)
+LEDGER = [
+    ('2025-01-05 09:00', 5, 'Gasto', 10, 'Comida'),
+    ('2025-01-20 21:30', 5, 'Gasto', 30, 'Comida'),
+    ('2025-01-31 23:59', 5, 'Ingreso', 500, 'Sueldo'),
+    ('2025-02-01 00:00', 5, 'Gasto', 7, 'Ocio'),
+    ('2025-02-14 12:00', 6, 'Gasto', 40, 'Comida'),
+    ('2025-03-03 08:15', 6, 'Deuda', 100, 'Banco'),
+    ('2025-03-28 18:00', 5, 'Gasto', 5, 'Comida'),
+]
+NAMES = {5: 'Ana', 6: 'Beto'}
+
+
+@pytest.fixture
+def ledger(spreadsheet, load_bot):
+    """Ana (5) y Beto (6) con movimientos de enero a marzo de 2025, leídos después de reiniciar"""
+    spreadsheet.add_worksheet('Usuarios', 1000, 8).rows = [
+        USERS_HEADERS, ['5', 'Ana', '', '', '', '', '', ''], ['6', 'Beto', '', '', '', '', '', '']]
+    bot = load_bot()
+    for i, (when, user_id, record_type, amount, category) in enumerate(LEDGER):
+        bot.append_queue.enqueue([when, NAMES[user_id], record_type, amount, category, '', '',
+                                  'Completado', f'r{i}', user_id])
+    assert bot.append_queue.flush()
+    return load_bot()
+
+
+def expected(group, date_from='0000', date_to='9999', user_ids=(5, 6), types=None):
+    """Lo mismo que query(group_by=..., aggregates=('sum', 'count')) calculado a mano"""
+    result = {}
+    for when, user_id, record_type, amount, category in LEDGER:
+        if not date_from <= when < date_to or user_id not in user_ids or (types and record_type not in types):
+            continue
+        key = tuple({'user': NAMES[user_id], 'month': when[:7], 'type': record_type, 'category': category}[g]
+                    for g in group)
+        entry = result.setdefault(key, {'sum': 0, 'count': 0})
+        entry['sum'] += amount
+        entry['count'] += 1
+    return result
+
+
+@pytest.mark.parametrize('group_by', [(), ('user',), ('month', 'category'), ('user', 'month', 'type', 'category')])
+def test_query_groups_by_any_combination(ledger, group_by):
+    assert ledger.FinancialAnalyzer.query(group_by=group_by) == expected(group_by)
+
+
+def test_query_filters_match_with_whole_and_partial_months(ledger):
+    query = ledger.FinancialAnalyzer.query
+    group = ('user', 'month', 'category')
+
+    # Meses completos: responden los totales incrementales
+    whole = query(user_ids=[5], date_from=datetime.date(2025, 1, 1), date_to=datetime.date(2025, 3, 1),
+                  types=['Gasto'], group_by=group)
+    assert whole == expected(group, '2025-01-01', '2025-03-01', user_ids=(5,), types=('Gasto',))
+
+    # Un rango que corta meses filtra las filas
+    partial = query(date_from=datetime.datetime(2025, 1, 20, 21, 30), date_to=datetime.datetime(2025, 2, 14, 12, 0),
+                    group_by=group)
+    assert partial == expected(group, '2025-01-20 21:30', '2025-02-14 12:00')
+
+    assert query(categories=['Comida'], group_by=('user',)) == {
+        ('Ana',): {'sum': 45, 'count': 3}, ('Beto',): {'sum': 40, 'count': 1}}
+    assert query(user_ids=[]) == {}
+
+
+def test_query_aggregates_and_validation(ledger):
+    query = ledger.FinancialAnalyzer.query
+    result = query(user_ids=[5], types=['gasto'], group_by=('category',), aggregates=('min', 'max', 'avg', 'count'))
+
+    assert result == {('Comida',): {'min': 5, 'max': 30, 'avg': 15, 'count': 3},
+                      ('Ocio',): {'min': 7, 'max': 7, 'avg': 7, 'count': 1}}
+    with pytest.raises(ValueError):
+        query(group_by=('day',))
+    with pytest.raises(ValueError):
+        query(group_by=('month', 'week'))
+
+
+def month_totals(bot, user_id):
+    today = datetime.datetime.now(bot.TIMEZONE).date().replace(day=1)
+    return bot.FinancialAnalyzer.totals(user_ids=[user_id], date_from=today, date_to=bot.add_months(today, 1))
+
+
+def test_rollups_follow_queued_flushed_and_synced_rows(ledger, spreadsheet):
+    bot = ledger
+    mirror = bot.transaction_mirror
+    assert month_totals(bot, 5).count == 0
+
+    assert bot.add_record_to_sheet(5, 'Gasto', 12, 'Comida')
+    version = mirror.local_version
+    assert bot.add_record_to_sheet(5, 'Gasto', 8, 'Ocio')
+    # La fila encolada se suma a los totales locales sin recalcularlos
+    assert mirror.local_version == version
+    assert (month_totals(bot, 5).count, month_totals(bot, 5).expenses) == (2, 20)
+
+    assert bot.append_queue.flush()
+    table = bot.transaction_partition(datetime.datetime.now(bot.TIMEZONE))
+    mirror.sync_partition(table)
+    assert (month_totals(bot, 5).count, month_totals(bot, 5).expenses) == (2, 20)
+
+    # Una fila de otra instancia entra a los totales de la partición al sincronizar
+    now = datetime.datetime.now(bot.TIMEZONE).strftime("%Y-%m-%d %H:%M")
+    spreadsheet.sheets[table].rows.append([now, 'Ana', 'Ingreso', '100', 'Sueldo', '', '', 'Completado', 'x', '5'])
+    mirror.sync_partition(table)
+    totals = month_totals(bot, 5)
+    assert (totals.count, totals.expenses, totals.income) == (3, 20, 100)
+    assert mirror.rollups[table].cells == bot.TransactionRollup.from_columns(mirror.partitions[table]).cells
+
+
+def test_trends_read_only_the_months_of_the_window(spreadsheet, load_bot):
+    bot = load_bot()
+    this_month = datetime.datetime.now(bot.TIMEZONE).date().replace(day=1)
+    for months_ago in range(8):
+        month = bot.add_months(this_month, -months_ago)
+        bot.append_queue.enqueue([month.strftime("%Y-%m-01 12:00"), 'Ana', 'Gasto', 10 + months_ago, 'Comida',
+                                  '', '', 'Completado', f'm{months_ago}', 5])
+    assert bot.append_queue.flush()
+
+    bot = load_bot()
+    trends = bot.analyzer.get_spending_trends(5, months=3)
+
+    assert trends == {bot.add_months(this_month, -k).strftime("%Y-%m"): {'Comida': 10 + k} for k in range(3)}
+    oldest = bot.transaction_partition(bot.add_months(this_month, -3))
+    assert oldest not in bot.transaction_mirror.partitions
+
+    weekly = bot.analyzer.get_spending_trends(5, months=3, bucket='week')
+    assert sum(sum(c.values()) for c in weekly.values()) == 10 + 11 + 12
+    assert all(datetime.date.fromisoformat(week).weekday() == 0 for week in weekly)
+    quarterly = bot.analyzer.get_spending_trends(5, months=1, bucket='quarter')
+    # El trimestre se cuenta completo aunque la ventana empiece a mitad de él
+    quarter_start = this_month.replace(month=(this_month.month - 1) // 3 * 3 + 1)
+    label = f"{this_month.year}-T{(this_month.month - 1) // 3 + 1}"
+    months_in_quarter = (this_month.month - quarter_start.month) + 1
+    assert quarterly == {label: {'Comida': sum(10 + k for k in range(months_in_quarter))}}
+    with pytest.raises(ValueError):
+        bot.analyzer.get_spending_trends(5, bucket='day')
+
+
+def test_family_group_analyses_combine_the_members(ledger):
+    bot = ledger
+    manager = bot.bot_manager
+    manager.register_user(7, 'Carla')
+    _, code = manager.create_family_group(5, 'Casa')
+    assert manager.join_family_group(6, code)[0]
+    for user_id, amount, category in ((5, 10, 'Comida'), (6, 25, 'Comida'), (6, 5, 'Ocio'), (7, 99, 'Comida')):
+        assert bot.add_record_to_sheet(user_id, 'Gasto', amount, category)
+    manager.set_budget(5, 'Comida', 20)
+    manager.set_budget(6, 'Comida', 30)
+    manager.set_budget(7, 'Comida', 1000)
+
+    summary = bot.analyzer.get_group_monthly_summary(6)
+    assert (summary['transaction_count'], summary['total_expenses']) == (3, 40)
+    assert dict(summary['by_category']) == {'Comida': 35, 'Ocio': 5}
+
+    budget = bot.analyzer.get_group_budget_analysis(5)
+    assert (budget['Comida']['budget'], budget['Comida']['spent']) == (50, 35)
+
+    month = datetime.datetime.now(bot.TIMEZONE).strftime("%Y-%m")
+    assert bot.analyzer.get_group_spending_trends(5, months=1) == {month: {'Comida': 35, 'Ocio': 5}}
+
+    # Sin presupuestos compartidos cada uno ve el suyo
+    manager.get_user_group(5)['settings']['shared_budgets'] = False
+    budget = bot.analyzer.get_group_budget_analysis(5)
+    assert (budget['Comida']['budget'], budget['Comida']['spent']) == (20, 10)
+
+
+def test_totals_kernel_adds_grouped_rows_once(bot):
+    totals = bot.TransactionTotals([('Ingreso', 'Sueldo', 500, 1), ('Gasto', 'Comida', 40, 3),
+                                    ('Gasto', 'Ocio', 7, 1), ('Deuda', 'Comida', 100, 1)])
+
+    assert (totals.income, totals.expenses, totals.debts, totals.balance) == (500, 47, 100, 353)
+    assert dict(totals.by_category) == {'Sueldo': 500, 'Comida': 140, 'Ocio': 7}
+    assert (totals.count, totals.mean) == (6, 647 / 6)
+    assert bot.TransactionTotals().mean == 0
+
+
+class FakeQuery:
+    def __init__(self, user_id):
+        self.from_user = type('User', (), {'id': user_id})()
+        self.message = self
+        self.messages = []
+        self.markups = []
+
+    def edit_message_text(self, text, reply_markup=None, **kwargs):
+        self.messages.append(text)
+        self.markups.append(reply_markup)
+
+    reply_text = edit_message_text
+
+
+def test_export_totals_are_the_same_before_and_after_archiving(ledger):
+    bot = ledger
+    query = FakeQuery(5)
+    bot.export_user_data_callback(query, None)
+    assert bot.compact_transactions() == len(LEDGER)
+    bot.export_user_data_callback(query, None)
+
+    before, after = query.messages
+    assert before == after
+    for line in ('Total de registros: 5', 'Ingresos totales: $500', 'Gastos totales: $52', 'Balance general: $448'):
+        assert line in before
+
+
+@pytest.mark.parametrize('view, title, other_views', [
+    ('show_trends_week', 'gasto por semana', ['show_trends', 'show_trends_quarter']),
+    ('show_trends', 'gasto por mes', ['show_trends_week', 'show_trends_quarter']),
+    ('show_trends_quarter', 'gasto por trimestre', ['show_trends_week', 'show_trends']),
+])
+def test_trend_views_show_weeks_and_quarters(bot, monkeypatch, view, title, other_views):
+    today = datetime.datetime.now(bot.TIMEZONE)
+    charts = []
+    monkeypatch.setattr(bot.chart_service, 'send_trends', lambda message, user_id, trends, bucket='month':
+                        charts.append(bot.TREND_TITLES[bucket]))
+    bot.bot_manager.register_user(5, 'Ana')
+    assert bot.add_record_to_sheet(5, 'Gasto', 12, 'Comida')
+    query = FakeQuery(5)
+
+    bot.show_spending_trends_callback(query, None, view)
+
+    text = query.messages[0]
+    assert title in text and 'Comida: $12' in text
+    if view == 'show_trends_week':
+        monday = today.date() - datetime.timedelta(days=today.weekday())
+        assert f"Semana del {monday:%d/%m/%Y}" in text
+    elif view == 'show_trends':
+        assert today.strftime("%B %Y") in text
+    else:
+        assert f"T{(today.month - 1) // 3 + 1} {today.year}" in text
+    buttons, = query.markups[0].inline_keyboard
+    assert [button.callback_data for button in buttons] == other_views
+    # El gráfico lleva el título del período elegido
+    assert [chart.lower() for chart in charts] == [title]
@@ -0,0 +1,50 @@
+import threading
+
+LEGACY_HEADERS = ['Fecha', 'Usuario', 'Tipo', 'Monto', 'Categoria', 'Descripcion',
+                  'Fecha_Vencimiento', 'Estado_Pago', 'Registro_ID']
+
+
+def run_with_timeout(function, timeout=10):
+    """Ejecuta en otro hilo para que un bloqueo falle la prueba en vez de colgarla"""
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault('value', function()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "la llamada no terminó (¿bloqueo?)"
+    return result['value']
+
+
+def test_check_schema_migrates_legacy_headers(spreadsheet, load_bot):
+    ws = spreadsheet.sheet1
+    ws.rows = [LEGACY_HEADERS, ['2026-10-01 10:00', 'Ana', 'Gasto', '10', 'Comida', '', '', 'Completado', 'r1']]
+    bot = load_bot(build=False)
+    bot.connect_google_sheets()
+    bot.storage = bot.create_storage()
+
+    assert run_with_timeout(lambda: bot.storage.check_schema('Transacciones')) is True
+
+    assert ws.rows[0] == bot.SHEET_HEADERS
+    assert ws.rows[1][:9] == ['2026-10-01 10:00', 'Ana', 'Gasto', '10', 'Comida', '', '', 'Completado', 'r1']
+    assert 'Transacciones' in bot.storage.verified
+    # Verificada una vez, la siguiente llamada no vuelve a leer la hoja
+    ws.rows[0] = ['otro']
+    assert bot.storage.check_schema('Transacciones') is True
+
+
+def test_startup_migrates_legacy_sheet(spreadsheet, load_bot):
+    spreadsheet.sheet1.rows = [LEGACY_HEADERS]
+    bot = load_bot(build=False)
+
+    run_with_timeout(bot.build_app_context)
+
+    assert spreadsheet.sheet1.rows[0] == bot.SHEET_HEADERS
+
+
+def test_check_schema_rejects_unrelated_headers(spreadsheet, load_bot):
+    spreadsheet.sheet1.rows = [['Fecha', 'Otra cosa']]
+    bot = load_bot(build=False)
+    bot.connect_google_sheets()
+    bot.storage = bot.create_storage()
+
+    assert run_with_timeout(lambda: bot.storage.check_schema('Transacciones')) is False
+    assert spreadsheet.sheet1.rows[0] == ['Fecha', 'Otra cosa']
@@ -0,0 +1,68 @@
+import pytest
+
+from test_compaction import USERS_HEADERS
+
+BUDGET_HEADERS = ['Usuario_ID', 'Usuario_Nombre', 'Categoria', 'Presupuesto', 'Fecha_Creacion', 'Estado']
+
+
+@pytest.fixture
+def warm(spreadsheet, load_bot, tmp_path, monkeypatch):
+    """Instantánea con Ana y Beto; después la hoja cambia y el bot arranca desde la instantánea"""
+    snapshot = str(tmp_path / 'snapshot.pkl')
+    spreadsheet.add_worksheet('Usuarios', 1000, 8).rows = [
+        USERS_HEADERS, ['5', 'Ana', '', '', '', '', '', ''], ['6', 'Beto', '', '', '', '', '', '']]
+    spreadsheet.add_worksheet('Presupuestos', 1000, 6).rows = [
+        BUDGET_HEADERS, ['5', 'Ana', 'Comida', '100', '', 'Activo'], ['6', 'Beto', 'Ocio', '50', '', 'Activo']]
+    assert load_bot(env={'SNAPSHOT_PATH': snapshot}).bot_manager.save_snapshot()
+
+    # Otra instancia borró a Beto, agregó a Carla y cambió el presupuesto de Ana
+    spreadsheet.sheets['Usuarios'].rows = [
+        USERS_HEADERS, ['5', 'Ana', '', '', '', '', '', ''], ['7', 'Carla', '', '', '', '', '', '']]
+    spreadsheet.sheets['Presupuestos'].rows = [BUDGET_HEADERS, ['5', 'Ana', 'Comida', '300', '', 'Activo']]
+
+    bot = load_bot(build=False)
+    reconcile = bot.AdvancedFinanceBotManager.reconcile
+    monkeypatch.setattr(bot.AdvancedFinanceBotManager, 'reconcile', lambda self: None)
+    bot.build_app_context()
+    return bot, reconcile
+
+
+def test_warm_start_serves_the_snapshot_until_reconciled(warm):
+    bot, reconcile = warm
+    manager = bot.bot_manager
+
+    assert not manager.reconciled.is_set()
+    assert sorted(manager.users) == [5, 6]
+    assert manager.budgets[5] == {'Comida': 100}
+
+    assert reconcile(manager)
+
+    assert manager.reconciled.is_set()
+    assert sorted(manager.users) == [5, 7]
+    assert manager.budgets == {5: {'Comida': 300}}
+
+
+def test_reconcile_keeps_changes_made_during_the_load(warm, monkeypatch):
+    bot, reconcile = warm
+    manager = bot.bot_manager
+    load_tables = bot.storage.load_tables
+
+    def load_then_user_edits(tables):
+        # La lectura ya terminó cuando Ana cambia su presupuesto y Beto su nombre
+        loaded = load_tables(tables)
+        if 'Presupuestos' in tables:
+            manager.set_budget(5, 'Comida', 999)
+            manager.users[6]['username'] = 'Bea'
+            manager.save_user_data(6)
+        return loaded
+
+    monkeypatch.setattr(bot.storage, 'load_tables', load_then_user_edits)
+
+    assert reconcile(manager)
+
+    assert manager.budgets[5] == {'Comida': 999}
+    assert sorted(manager.users) == [5, 6, 7]
+    assert manager.users[6]['username'] == 'Bea'
+    # Pasada la reconciliación ya no se anota nada
+    manager.set_budget(7, 'Ocio', 10)
+    assert manager._dirty_keys == {}
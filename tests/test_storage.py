@@ -0,0 +1,123 @@
+import pytest
+
+from conftest import FakeWorksheet
+
+BUDGET_HEADERS = ['Usuario_ID', 'Usuario_Nombre', 'Categoria', 'Presupuesto', 'Fecha_Creacion', 'Estado']
+
+
+def count_calls(monkeypatch, cls, method):
+    """Cuenta las llamadas a cls.method sin cambiar lo que hace"""
+    original = getattr(cls, method)
+    calls = []
+
+    def counted(self, *args, **kwargs):
+        calls.append((getattr(self, 'title', None), args))
+        return original(self, *args, **kwargs)
+
+    monkeypatch.setattr(cls, method, counted)
+    return calls
+
+
+def test_upsert_updates_the_indexed_row_with_one_write(bot, spreadsheet, monkeypatch):
+    budgets = spreadsheet.sheets['Presupuestos']
+    budgets.rows = [BUDGET_HEADERS, ['5', 'Ana', 'Comida', '100', '', 'Activo'], ['6', 'Beto', 'Ocio', '50', '', 'Activo']]
+    bot.storage.load_table('Presupuestos')
+    reads = count_calls(monkeypatch, FakeWorksheet, 'get_all_values')
+    updates = count_calls(monkeypatch, FakeWorksheet, 'update')
+
+    bot.storage.upsert_row('Presupuestos', ['6', 'Beto', 'Ocio', '80', '', 'Activo'])
+    bot.storage.upsert_row('Presupuestos', ['7', 'Carla', 'Ropa', '30', '', 'Activo'])
+    bot.storage.upsert_row('Presupuestos', ['7', 'Carla', 'Ropa', '35', '', 'Activo'])
+
+    assert budgets.rows[1:] == [['5', 'Ana', 'Comida', '100', '', 'Activo'],
+                                ['6', 'Beto', 'Ocio', '80', '', 'Activo'],
+                                ['7', 'Carla', 'Ropa', '35', '', 'Activo']]
+    # La fila se encuentra por el índice (sin releer la hoja) y se escribe completa en una llamada
+    assert reads == []
+    assert [args[0] for _, args in updates] == ['A3:F3', 'A4:F4']
+
+
+@pytest.fixture
+def sqlite_bot(load_bot, tmp_path):
+    env = {'STORAGE_BACKEND': 'sqlite', 'SQLITE_PATH': str(tmp_path / 'finbot.db')}
+    return lambda: load_bot(env=env)
+
+
+def test_sqlite_backend_keeps_state_and_transactions_across_restarts(sqlite_bot, spreadsheet):
+    bot = sqlite_bot()
+    assert bot.storage.name == 'sqlite'
+    bot.bot_manager.register_user(5, 'Ana')
+    bot.bot_manager.set_budget(5, 'Comida', 100)
+    bot.bot_manager.set_budget(5, 'Comida', 120)
+    bot.append_queue.enqueue(['2025-03-15 10:00', 'Ana', 'Gasto', 40, 'Comida', '', '', 'Completado', 'r1', 5])
+    bot.append_queue.enqueue(['2026-01-15 10:00', 'Ana', 'Gasto', 2, 'Comida', '', '', 'Completado', 'r2', 5])
+    assert bot.append_queue.flush()
+
+    bot = sqlite_bot()
+
+    assert bot.bot_manager.users[5]['username'] == 'Ana'
+    assert bot.bot_manager.budgets == {5: {'Comida': 120}}
+    assert [r['Registro_ID'] for r in bot.transaction_mirror.get_user_records(5)] == ['r1', 'r2']
+    # Nada se escribió en Google Sheets
+    assert spreadsheet.sheet1.rows == [] and spreadsheet.sheets['Presupuestos'].rows[1:] == []
+
+
+def test_sqlite_read_tail_and_archive(sqlite_bot):
+    bot = sqlite_bot()
+    storage = bot.storage
+    rows = [[f'2025-0{month}-15 10:00', 'Ana', 'Gasto', month, 'Comida', '', '', 'Completado', f'r{month}', 5]
+            for month in (1, 2, 3)]
+    storage.append_rows('Transacciones', rows[:2])
+    known = storage.get_records('Transacciones')
+    storage.append_rows('Transacciones', rows[2:])
+
+    assert [r['Registro_ID'] for r in storage.read_tail('Transacciones', 2, known[-1])] == ['r3']
+    # Si la última fila conocida ya no coincide hay que recargar todo
+    assert storage.read_tail('Transacciones', 2, known[0]) is None
+
+    archived = []
+    moved = storage.archive_transactions('Transacciones', '2025-03', archived.extend)
+
+    assert [r['Registro_ID'] for r in moved] == [r['Registro_ID'] for r in archived] == ['r1', 'r2']
+    assert [r['Registro_ID'] for r in storage.get_records('Transacciones')] == ['r3']
+    assert [r['Registro_ID'] for r in storage.get_records('Archivo_Transacciones')] == ['r1', 'r2']
+
+
+def test_startup_reads_every_sheet_in_one_batched_call(spreadsheet, load_bot, monkeypatch):
+    from conftest import FakeSpreadsheet
+    load_bot()
+    spreadsheet.sheets['Usuarios'].rows.append(['5', 'Ana', '', '', '', '', '', ''])
+    spreadsheet.sheets['Presupuestos'].rows.append(['5', 'Ana', 'Comida', '100', '', 'Activo'])
+    batches = count_calls(monkeypatch, FakeSpreadsheet, 'values_batch_get')
+    reads = count_calls(monkeypatch, FakeWorksheet, 'get_all_values')
+
+    bot = load_bot()
+
+    assert len(batches) == 1
+    ranges = batches[0][1][0]
+    assert {"'Usuarios'", "'Presupuestos'", "'Metas_Ahorro'", "'Resumen_Mensual'"} <= set(ranges)
+    # La hoja en memoria responde el lote con get_all_values: ninguna lectura fuera de él
+    assert len(reads) == len(ranges)
+    assert bot.bot_manager.users[5]['username'] == 'Ana'
+    assert bot.bot_manager.budgets == {5: {'Comida': 100}}
+
+
+def test_headers_are_verified_once_per_process_and_marked_for_the_next(spreadsheet, load_bot, monkeypatch):
+    bot = load_bot()
+    header_reads = count_calls(monkeypatch, FakeWorksheet, 'row_values')
+    # Planilla sin marcadores de versión: hay que leer los encabezados
+    spreadsheet.named_ranges.clear()
+    bot.storage._schema_markers = None
+    bot.storage.verified.clear()
+
+    assert bot.storage.check_schema('Presupuestos')
+    assert bot.storage.check_schema('Presupuestos')
+    assert bot.storage.ensure_schema('Presupuestos')
+    assert header_reads == [('Presupuestos', (1,))]
+    assert bot.storage._schema_marker('Presupuestos') in [r['name'] for r in spreadsheet.named_ranges]
+
+    # Otro proceso confía en el marcador de versión y tampoco relee los encabezados
+    bot = load_bot()
+    bot.storage.verified.clear()
+    assert bot.storage.check_schema('Presupuestos')
+    assert len(header_reads) == 1
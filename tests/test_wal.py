@@ -0,0 +1,116 @@
+import datetime
+import json
+
+import pytest
+
+
+def row(bot, record_id, amount=10, when=None):
+    when = when or datetime.datetime.now(bot.TIMEZONE)
+    return [when.strftime("%Y-%m-%d %H:%M"), 'Ana', 'Gasto', amount, 'Comida', '', '', 'Completado', record_id, 1]
+
+
+@pytest.fixture
+def crashed(spreadsheet, load_bot, tmp_path):
+    """Hoja con r1..r5 y un WAL que quedó con r4, r5 (ya enviadas) y r6 (sin enviar)"""
+    bot = load_bot(env={'SHEETS_FLUSH_INTERVAL': '3600'}, build=False)
+    spreadsheet.sheet1.rows = [bot.SHEET_HEADERS] + [[str(v) for v in row(bot, f'r{i}')] for i in range(1, 6)]
+    with open(tmp_path / 'transactions.wal', 'w', encoding='utf-8') as f:
+        for record_id in ('r4', 'r5', 'r6'):
+            f.write(json.dumps(row(bot, record_id)) + "\n")
+    yield bot
+    bot.append_queue.stop()
+
+
+def summary(bot):
+    result = bot.analyzer.get_monthly_summary(1)
+    return result['transaction_count'], result['total_expenses']
+
+
+def wal_ids(tmp_path):
+    with open(tmp_path / 'transactions.wal', encoding='utf-8') as f:
+        return [json.loads(line)[8] for line in f]
+
+
+def test_recovery_after_load_does_not_double_count(crashed, tmp_path):
+    bot = crashed
+    bot.build_app_context()
+    bot.append_queue.start()
+
+    assert summary(bot) == (6, 60.0)
+    assert wal_ids(tmp_path) == ['r6']
+
+
+def test_recovery_before_load_does_not_double_count(crashed, tmp_path):
+    bot = crashed
+    bot.append_queue.start()
+    bot.build_app_context()
+
+    assert summary(bot) == (6, 60.0)
+    assert wal_ids(tmp_path) == ['r6']
+
+
+def test_replayed_rows_are_sent_once(crashed, spreadsheet):
+    bot = crashed
+    bot.build_app_context()
+    bot.append_queue.start()
+
+    assert bot.append_queue.flush()
+
+    stored = [r[8] for ws in spreadsheet.sheets.values() for r in ws.rows[1:] if len(r) > 8]
+    assert sorted(stored) == ['r1', 'r2', 'r3', 'r4', 'r5', 'r6']
+    assert summary(bot) == (6, 60.0)
+
+
+def test_enqueue_survives_a_crash_before_flush(bot, tmp_path):
+    bot.add_record_to_sheet(1, 'gasto', 25, 'Comida')
+
+    assert len(wal_ids(tmp_path)) == 1
+    assert summary(bot) == (1, 25.0)
+
+
+def test_rows_enqueued_during_the_dedupe_are_kept(crashed, spreadsheet, monkeypatch):
+    bot = crashed
+    # Recuperar sin cargar la hoja: el envío tiene que leerla para descartar r4 y r5
+    bot.append_queue.start()
+    bot.connect_google_sheets()
+    bot.storage = bot.create_storage()
+    get_records = bot.storage.get_records
+
+    def get_records_while_user_writes(table):
+        # Un usuario registra r7 mientras el envío verifica la hoja
+        if not any(r[8] == 'r7' for r in bot.append_queue.pending_rows()):
+            bot.append_queue.enqueue(row(bot, 'r7'))
+        return get_records(table)
+
+    monkeypatch.setattr(bot.storage, 'get_records', get_records_while_user_writes)
+
+    assert bot.append_queue.flush()
+    assert [r[8] for r in bot.append_queue.pending_rows()] == ['r7']
+    assert bot.append_queue.flush()
+
+    stored = [r[8] for ws in spreadsheet.sheets.values() for r in ws.rows[1:] if len(r) > 8]
+    assert sorted(stored) == ['r1', 'r2', 'r3', 'r4', 'r5', 'r6', 'r7']
+
+
+def test_records_are_queued_and_sent_in_one_append_per_partition(bot, spreadsheet, monkeypatch):
+    from conftest import FakeWorksheet
+    appends = []
+    append_rows = FakeWorksheet.append_rows
+    monkeypatch.setattr(FakeWorksheet, 'append_rows',
+                        lambda self, values, **kwargs: appends.append((self.title, len(values))) or append_rows(self, values, **kwargs))
+    bot.bot_manager.register_user(1, 'Ana')
+
+    for amount in (10, 20, 30):
+        assert bot.add_record_to_sheet(1, 'Gasto', amount, 'Comida')
+    bot.append_queue.enqueue(row(bot, 'old', when=datetime.datetime(2025, 3, 15, 10, 0)))
+
+    # Nada llegó a la hoja todavía, pero el resumen ya lo cuenta
+    assert appends == []
+    assert summary(bot) == (3, 60)
+
+    assert bot.append_queue.flush()
+
+    current = bot.transaction_partition(datetime.datetime.now(bot.TIMEZONE))
+    assert sorted(appends) == sorted([(current, 3), ('Transacciones_2025_03', 1)])
+    assert bot.append_queue.pending_rows() == []
+    assert summary(bot) == (3, 60)